@@ -0,0 +1,74 @@
+"""
+Chunking throughput in MB/s of corpus, on the bundled garymarcus.jsonl
+by default.
+
+Reports the tokenize-and-split step alone (posts already in memory) and
+the whole of `raft chunk` (read, split, write _chunked.jsonl), best of
+a few rounds.
+
+    python benchmarks/chunking_throughput.py [--corpus data/NAME.jsonl] [--rounds 5] [--workers N]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from raft import chunker  # noqa: E402
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def best_of(rounds: int, fn) -> float:
+    """The fastest of `rounds` timed calls, in seconds (output muted)."""
+    timings = []
+    for _ in range(rounds):
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            started = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--corpus", default=os.path.join(ROOT, "data", "garymarcus.jsonl"))
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=1, help="raft chunk --workers")
+    args = parser.parse_args()
+
+    megabytes = os.path.getsize(args.corpus) / 1e6
+    with open(args.corpus) as f:
+        posts = [json.loads(line) for line in f if line.strip()]
+    with contextlib.redirect_stdout(io.StringIO()):
+        chunks = sum(1 for _ in chunker.split_into_chunks(posts))
+    print(
+        f"{args.corpus}: {megabytes:.2f} MB, {len(posts)} posts, {chunks} chunks, "
+        f"{chunker.TOKENIZER_THREADS} tokenizer thread(s)"
+    )
+
+    split = best_of(args.rounds, lambda: sum(1 for _ in chunker.split_into_chunks(posts)))
+    print(f"split only   {megabytes / split:8.2f} MB/s")
+
+    cwd = os.getcwd()
+    tmp = tempfile.mkdtemp()
+    try:
+        os.makedirs(os.path.join(tmp, "data"))
+        shutil.copy(args.corpus, os.path.join(tmp, "data", "bench.jsonl"))
+        os.chdir(tmp)
+        whole = best_of(args.rounds, lambda: chunker.chunker("bench", args.workers))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp, ignore_errors=True)
+    print(f"raft chunk   {megabytes / whole:8.2f} MB/s ({args.workers} process(es))")
+
+
+if __name__ == "__main__":
+    main()
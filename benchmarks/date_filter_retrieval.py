@@ -0,0 +1,136 @@
+"""
+Latency and completeness of the earlier-writings filter (date_num <
+before), chroma against the flat index with and without its date-sorted
+rows.
+
+Builds a synthetic corpus three ways -- dated (every record carries a
+date), mixed (half undated, as pre-2.3 embeddings are) and undated -- in
+a chroma collection and in a flat snapshot, then asks the same queries
+with date bounds that leave 1%, 10%, 50% and all of the dated records
+eligible. Reports ms/query, how many of the K results came back, and the
+recall of the exact top-K among the eligible records.
+
+    python benchmarks/date_filter_retrieval.py [--count 20000] [--dimensions 384] [--queries 200]
+
+"flat, masked" is the flat index as it was before its rows were sorted:
+every row scored, the ineligible ones then masked out.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from chromadb import PersistentClient  # noqa: E402
+
+from raft import flat_index  # noqa: E402
+
+K = 5
+WINDOWS = (0.01, 0.1, 0.5, 1.0)
+
+
+def synthetic(count: int, dimensions: int, seed: int) -> np.ndarray:
+    """Unit vectors around a few hundred topics, like a persona corpus."""
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(300, dimensions))
+    vectors = topics[rng.integers(0, len(topics), count)] + rng.normal(size=(count, dimensions))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float32)
+
+
+def dates_for(count: int, undated: float, seed: int) -> np.ndarray:
+    """date_num per record, days over ten years in random order; -1 for the undated share."""
+    rng = np.random.default_rng(seed)
+    days = np.datetime64("2015-01-01") + rng.integers(0, 3650, count)
+    dates = np.array([int(str(day).replace("-", "")) for day in days], dtype=np.int64)
+    dates[rng.random(count) < undated] = -1
+    return dates
+
+
+def bound_for(dated: np.ndarray, window: float) -> int:
+    """A date_num bound leaving `window` of the (sorted) dated records eligible."""
+    if window >= 1.0:
+        return int(dated[-1]) + 1
+    return int(dated[int(window * len(dated))])
+
+
+def load_chroma(path: str, vectors: np.ndarray, dates: np.ndarray) -> Any:
+    collection = PersistentClient(path=path).create_collection("bench")
+    for start in range(0, len(vectors), 5000):
+        end = min(start + 5000, len(vectors))
+        collection.add(
+            ids=[f"r{i}" for i in range(start, end)],
+            embeddings=vectors[start:end],
+            documents=["" for _ in range(start, end)],
+            metadatas=[
+                {"date_num": int(d)} if d >= 0 else {"title": "undated"} for d in dates[start:end]
+            ],
+        )
+    return collection
+
+
+def timed(index: Any, queries: np.ndarray, where: Optional[Dict[str, Any]]) -> tuple:
+    """(ms/query, ids per query) of asking the queries one at a time, as retrieval does."""
+    got: List[List[str]] = []
+    started = time.perf_counter()
+    for query in queries:
+        kwargs = {"where": where} if where else {}
+        got.append(index.query(query_embeddings=[query.tolist()], n_results=K, include=[], **kwargs)["ids"][0])
+    return (time.perf_counter() - started) * 1000 / len(queries), got
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--count", type=int, default=20_000)
+    parser.add_argument("--dimensions", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    vectors = synthetic(args.count, args.dimensions, args.seed)
+    rng = np.random.default_rng(args.seed + 1)
+    pairs = rng.integers(0, len(vectors), (args.queries, 2))
+    queries = (vectors[pairs[:, 0]] + vectors[pairs[:, 1]]) / 2
+    print(f"{len(vectors)} vectors x {vectors.shape[1]}, {len(queries)} queries, top {K}")
+    print(f"{'corpus':<8} {'eligible':>8} {'index':<14} {'ms/query':>9} {'results':>8} {'recall':>7}")
+
+    for corpus, undated in (("dated", 0.0), ("mixed", 0.5), ("undated", 1.0)):
+        dates = dates_for(len(vectors), undated, args.seed)
+        with tempfile.TemporaryDirectory() as tmp:
+            chroma = load_chroma(os.path.join(tmp, "chroma"), vectors, dates)
+            flat_index.build_flat_index("", chroma, path=os.path.join(tmp, "flat"))
+            flat = flat_index.FlatIndex(os.path.join(tmp, "flat"))
+            dated = np.sort(dates[dates >= 0])
+            # an undated corpus is never filtered (see MemoryManager)
+            windows = WINDOWS if len(dated) else (None,)
+            for window in windows:
+                where = {"date_num": {"$lt": bound_for(dated, window)}} if window else None
+                eligible = f"{window:.0%}" if window else "-"
+                truth: Optional[List[List[str]]] = None
+                for label in ("flat, sorted", "flat, masked", "chroma"):
+                    if label == "chroma":
+                        index = chroma
+                    else:
+                        index = flat
+                        flat.date_sorted = label == "flat, sorted"
+                    ms, got = timed(index, queries, where)
+                    if truth is None:
+                        truth = got  # the flat index is exact
+                    returned = sum(len(ids) for ids in got) / len(got)
+                    found = sum(len(set(a) & set(b)) for a, b in zip(got, truth))
+                    wanted = sum(len(ids) for ids in truth) or 1
+                    print(
+                        f"{corpus:<8} {eligible:>8} {label:<14} {ms:>9.3f} {returned:>8.2f} "
+                        f"{found / wanted:>7.3f}"
+                    )
+            flat.close()
+
+
+if __name__ == "__main__":
+    main()
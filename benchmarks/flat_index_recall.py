@@ -0,0 +1,113 @@
+"""
+Recall@5 of the flat index at reduced precision, against full precision.
+
+Builds the flat index of a corpus at float32, float16 and int8, asks
+each the same queries, and reports how many of the float32 top-5 each
+finds -- with and without the float32 re-scoring of candidates -- plus
+the size of the vectors searched and the query latency.
+
+    python benchmarks/flat_index_recall.py                 # synthetic, ada-sized
+    python benchmarks/flat_index_recall.py --name NAME     # an embedded dataset
+
+Queries are midpoints of two random corpus vectors: near real records,
+but not any one of them.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from raft import flat_index, store  # noqa: E402
+
+K = 5
+
+
+class ArrayCollection:
+    """Just enough of a chroma collection for build_flat_index."""
+
+    metadata = {"embedding_model": "synthetic"}
+
+    def __init__(self, vectors: np.ndarray):
+        self.vectors = vectors
+
+    def get(self, include: List[str], limit: int, offset: int) -> Dict[str, Any]:
+        rows = range(offset, min(offset + limit, len(self.vectors)))
+        return {
+            "ids": [f"r{i}" for i in rows],
+            "embeddings": self.vectors[offset : offset + limit],
+            "documents": ["" for _ in rows],
+            "metadatas": [{"date_num": 0} for _ in rows],
+        }
+
+
+def synthetic(count: int, dimensions: int, seed: int) -> np.ndarray:
+    """Unit vectors around a few hundred topics, like a persona corpus."""
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(300, dimensions))
+    vectors = topics[rng.integers(0, len(topics), count)] + rng.normal(size=(count, dimensions))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float32)
+
+
+def dataset_vectors(name: str) -> np.ndarray:
+    found = store.collection(name)
+    if found is None:
+        sys.exit(f"no collection for {name} -- run `raft embed {name}` first")
+    vectors = []
+    for offset in range(0, found.count(), 5000):
+        page = found.get(include=["embeddings"], limit=5000, offset=offset)
+        vectors.append(np.asarray(page["embeddings"], dtype=np.float32))
+    return np.concatenate(vectors)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--name", help="an embedded dataset (default: synthetic)")
+    parser.add_argument("--count", type=int, default=50_000, help="synthetic corpus size")
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    vectors = dataset_vectors(args.name) if args.name else synthetic(
+        args.count, args.dimensions, args.seed
+    )
+    rng = np.random.default_rng(args.seed + 1)
+    pairs = rng.integers(0, len(vectors), (args.queries, 2))
+    queries = (vectors[pairs[:, 0]] + vectors[pairs[:, 1]]) / 2
+    collection = ArrayCollection(vectors)
+    print(f"{len(vectors)} vectors x {vectors.shape[1]}, {len(queries)} queries, recall@{K}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        indexes = {}
+        for precision in flat_index.PRECISIONS:
+            path = os.path.join(tmp, precision)
+            flat_index.build_flat_index("", collection, precision, path=path)
+            indexes[precision] = flat_index.FlatIndex(path)
+
+        truth = indexes["float32"].query(queries.tolist(), n_results=K, include=[])["ids"]
+        print(f"{'precision':<10} {'searched MB':>11} {'rescore':>8} {'recall@5':>9} {'ms/query':>9}")
+        for precision, index in indexes.items():
+            searched = index.vectors.nbytes + (index.scales.nbytes if index.scales is not None else 0)
+            for rescore in (False, True) if precision != "float32" else (True,):
+                index.rescore = rescore
+                started = time.perf_counter()
+                got = index.query(queries.tolist(), n_results=K, include=[])["ids"]
+                elapsed = (time.perf_counter() - started) * 1000 / len(queries)
+                found = sum(len(set(a) & set(b)) for a, b in zip(got, truth))
+                print(
+                    f"{precision:<10} {searched / 2**20:>11.1f} {str(rescore).lower():>8} "
+                    f"{found / (K * len(truth)):>9.4f} {elapsed:>9.3f}"
+                )
+            index.close()
+
+
+if __name__ == "__main__":
+    main()
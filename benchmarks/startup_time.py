@@ -0,0 +1,89 @@
+"""
+Startup time of `raft --help` and `raft serve`, in fresh processes.
+
+`raft serve` is timed up to its first prompt: it runs in an empty
+working directory (so no collection to open) with a finetuned model
+given, and an empty first line ends the session. Each command runs a
+few times; the best and median wall times are reported, along with
+whether the process loaded a tokenizer.
+
+    python benchmarks/startup_time.py [--rounds 7] [--max-help-ms N] [--max-serve-ms N]
+
+With a budget given, the script exits non-zero when the best time is
+over it, so it can guard against import-time regressions.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Tuple
+
+SRC = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# Runs the CLI, then reports on stderr whether tiktoken got imported.
+DRIVER = (
+    "import sys; sys.argv = ['raft'] + sys.argv[1:]\n"
+    "from raft.cli import main\n"
+    "try:\n"
+    "    main()\n"
+    "except SystemExit:\n"
+    "    pass\n"
+    "sys.stderr.write('\\ntiktoken loaded: %s\\n' % ('tiktoken' in sys.modules))\n"
+)
+
+COMMANDS = {
+    "help": ["--help"],
+    "serve": ["serve", "bench", "--model", "ft:bench"],
+}
+
+
+def run(args: List[str], cwd: str) -> Tuple[float, bool]:
+    """Wall seconds of one CLI run, and whether it loaded tiktoken."""
+    env = dict(os.environ, PYTHONPATH=SRC + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    started = time.perf_counter()
+    done = subprocess.run(
+        [sys.executable, "-c", DRIVER, *args],
+        cwd=cwd,
+        env=env,
+        input="\n",
+        capture_output=True,
+        text=True,
+    )
+    elapsed = time.perf_counter() - started
+    if "tiktoken loaded" not in done.stderr:
+        sys.exit(f"raft {' '.join(args)} failed:\n{done.stderr}")
+    return elapsed, "tiktoken loaded: True" in done.stderr
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rounds", type=int, default=7)
+    parser.add_argument("--max-help-ms", type=float, default=0, help="fail above this")
+    parser.add_argument("--max-serve-ms", type=float, default=0, help="fail above this")
+    args = parser.parse_args()
+    budgets = {"help": args.max_help_ms, "serve": args.max_serve_ms}
+
+    over = []
+    with tempfile.TemporaryDirectory() as cwd:
+        print(f"{'command':<12} {'best ms':>8} {'median ms':>10} {'tokenizer':>10}")
+        for label, command in COMMANDS.items():
+            run(command, cwd)  # warm the OS file cache and the .pyc files
+            results = [run(command, cwd) for _ in range(args.rounds)]
+            timings = [seconds * 1000 for seconds, _ in results]
+            best = min(timings)
+            print(
+                f"raft {label:<7} {best:>8.0f} {statistics.median(timings):>10.0f} "
+                f"{'loaded' if any(loaded for _, loaded in results) else 'no':>10}"
+            )
+            if budgets[label] and best > budgets[label]:
+                over.append(f"raft {label}: {best:.0f} ms > {budgets[label]:.0f} ms")
+    if over:
+        sys.exit("over budget: " + "; ".join(over))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+The event loop raft's concurrent API calls run on, and the AsyncOpenAI
+client they share.
+
+The summarizer and answer calls are coroutines (see
+memories.AsyncMemoryManager): many exchanges or chat turns can be in
+flight on one thread, over one HTTP connection pool of at most
+MAX_CONNECTIONS connections. Synchronous callers -- the CLI, ft:gen's
+worker threads -- go through run(), which hands the coroutine to a
+single background loop and waits for it. That way every caller in the
+process shares the same client, pool and rate limits, whichever thread
+it calls from.
+"""
+
+import asyncio
+import os
+import threading
+import weakref
+from typing import Any, Awaitable, Callable, Coroutine, Iterable, List, Optional, TypeVar
+
+from openai import DEFAULT_CONNECTION_LIMITS, AsyncOpenAI, DefaultAsyncHttpxClient
+
+T = TypeVar("T")
+U = TypeVar("U")
+
+# Connections the shared client keeps open to the API at most.
+MAX_CONNECTIONS = int(os.environ.get("RAFT_MAX_CONNECTIONS", "64"))
+
+_lock = threading.Lock()
+_loop: Optional[asyncio.AbstractEventLoop] = None
+# One client per event loop: the background loop's lives as long as the
+# process, those of loops callers run themselves (asyncio.run) go with
+# their loop (see client).
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI]" = weakref.WeakKeyDictionary()
+
+
+def loop() -> asyncio.AbstractEventLoop:
+    """The background event loop run() uses, started on first use."""
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="raft-aio", daemon=True).start()
+        return _loop
+
+
+def run(coroutine: Coroutine[Any, Any, T]) -> T:
+    """
+    Run a coroutine on the background loop and wait for its result,
+    from any thread but the loop's own.
+    """
+    background = loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is background:
+        coroutine.close()
+        raise RuntimeError("aio.run() called from a coroutine: await it instead")
+    return asyncio.run_coroutine_threadsafe(coroutine, background).result()
+
+
+def client() -> AsyncOpenAI:
+    """
+    The AsyncOpenAI client of the running event loop, created on first
+    use: its calls share one connection pool. Synchronous callers all
+    share the background loop's (see run). It does not retry:
+    callers do (see ratelimit.call_with_retries_async), outside any
+    concurrency slot, and see every 429.
+    """
+    running = asyncio.get_running_loop()
+    with _lock:
+        # a client's open connections keep its loop alive: drop those of
+        # closed loops (whose connections died with them) rather than
+        # holding on to a client, pool and loop per asyncio.run
+        for closed in [other for other in list(_clients) if other.is_closed()]:
+            _clients.pop(closed, None)
+        if running not in _clients:
+            # the Limits of the HTTP library the SDK is built on (httpx or,
+            # in later majors, httpx2), not one raft would have to pin
+            limits = type(DEFAULT_CONNECTION_LIMITS)(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_CONNECTIONS,
+                keepalive_expiry=DEFAULT_CONNECTION_LIMITS.keepalive_expiry,
+            )
+            _clients[running] = AsyncOpenAI(max_retries=0, http_client=DefaultAsyncHttpxClient(limits=limits))
+        return _clients[running]
+
+
+async def bounded_map(
+    fn: Callable[[U], Awaitable[T]], items: Iterable[U], limit: int
+) -> List[T]:
+    """fn over the items, at most `limit` of them in flight; results in order."""
+    slots = asyncio.Semaphore(max(1, limit))
+
+    async def one(item: U) -> T:
+        async with slots:
+            return await fn(item)
+
+    return list(await asyncio.gather(*(one(item) for item in items)))
@@ -0,0 +1,125 @@
+"""
+A size-capped, least-recently-used key/value cache in a local SQLite file.
+
+Used for results that cost an API call to recompute (embeddings): a
+re-run of the pipeline then only pays for what it has not seen before.
+Each entry remembers when it was last read or written; once the values
+exceed the byte cap, the least recently used ones are evicted.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+
+class SqliteLRUCache:
+    """Bytes keyed by strings, persisted in SQLite, LRU-evicted by size."""
+
+    def __init__(self, path: str, max_bytes: int):
+        """
+        Open (or create) the cache file.
+
+        Args:
+            path (str): The SQLite file.
+            max_bytes (int): Cap on the summed size of stored values.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # One connection shared across threads; sqlite3 objects are not
+        # thread-safe by themselves, so every use holds the lock.
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+            "size INTEGER NOT NULL, used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+        self._db.commit()
+        self._size = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()[0]
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, bytes]:
+        """The cached values for those keys that are present."""
+        keys = list(dict.fromkeys(keys))
+        found: Dict[str, bytes] = {}
+        with self._lock:
+            # SQLite caps bound parameters per statement (999 on old builds).
+            for start in range(0, len(keys), 500):
+                part = keys[start : start + 500]
+                marks = ",".join("?" * len(part))
+                for key, value in self._db.execute(
+                    f"SELECT key, value FROM entries WHERE key IN ({marks})", part
+                ):
+                    found[key] = value
+                if found:
+                    hit_keys = [k for k in part if k in found]
+                    self._db.executemany(
+                        "UPDATE entries SET used = ? WHERE key = ?",
+                        [(time.time(), k) for k in hit_keys],
+                    )
+            self._db.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def get(self, key: str) -> Optional[bytes]:
+        """The cached value, or None."""
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items: Dict[str, bytes]) -> None:
+        """Store values, evicting the least recently used over the cap."""
+        if not items:
+            return
+        with self._lock:
+            now = time.time()
+            for key, value in items.items():
+                old = self._db.execute(
+                    "SELECT size FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                if old:
+                    self._size -= old[0]
+                self._db.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, size, used) "
+                    "VALUES (?, ?, ?, ?)",
+                    (key, value, len(value), now),
+                )
+                self._size += len(value)
+            self._evict()
+            self._db.commit()
+
+    def put(self, key: str, value: bytes) -> None:
+        """Store one value."""
+        self.put_many({key: value})
+
+    def _evict(self) -> None:
+        """Drop least recently used entries until under the cap (lock held)."""
+        while self._size > self.max_bytes:
+            rows: List[tuple] = self._db.execute(
+                "SELECT key, size FROM entries ORDER BY used LIMIT 100"
+            ).fetchall()
+            if not rows:
+                self._size = 0
+                return
+            for key, size in rows:
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._size -= size
+                if self._size <= self.max_bytes:
+                    return
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._db.close()
@@ -1,138 +1,592 @@
 """
-This module contains the chunker function, which splits blog posts into chunks
-of a maximum length.
+This module contains the chunking engine, which splits blog posts into
+chunks of a maximum length.
+
+data/{name}.jsonl is read line by line and chunks are yielded as each
+post is split, so memory stays flat whatever the size of the corpus.
+`raft chunk` (files_helper.chunker, re-exported from here) and the
+streaming `raft embed --chunk` both run on it; `raft chunk --workers N`
+splits the posts in N processes and still writes them in corpus order.
 """
 
+import functools
+import hashlib
 import json
-from typing import List, Dict, Tuple, Generator
-import tiktoken
-import pandas as pd
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Deque, Dict, Generator, Iterable, List, Optional, Tuple, Union
+
+from . import hx, state, tokenizers
+from .embedding_backends import get_backend
+
+# Its encoding (cl100k_base) is also ada-002's: chunk sizes are in the
+# tokens the embedding model counts. Loaded on first use (see
+# tokenizers), and still available as chunker.encoding.
+TOKENIZER_MODEL = "gpt-3.5-turbo"
+
+# Chunk size and overlap, in tokens, for datasets that set none (see
+# chunk_settings and `raft chunk --chunk-tokens N --overlap M`).
+DEFAULT_CHUNK_TOKENS = 2048
+DEFAULT_OVERLAP_TOKENS = 0
+
+# Bumped whenever the same settings would cut a corpus differently;
+# recorded with them, so `raft embed` sees older chunk files as stale.
+CHUNKER_VERSION = 2
+
+# What the "\n" joining two lines of a chunk is counted as.
+SEPARATOR_TOKENS = 1
+
+# Documents with at least this many characters are tokenized on
+# TOKENIZER_THREADS threads (see token_lengths).
+PARALLEL_MIN_CHARS = 256 * 1024
+TOKENIZER_THREADS = min(8, os.cpu_count() or 1)
+
+# Corpus bytes handed to a chunking process at a time (`raft chunk
+# --workers N`): big enough to amortise the pickling, small enough to
+# keep 2 x N batches in memory.
+CHUNK_BATCH_BYTES = 1024 * 1024
+
+# Seconds between progress lines.
+PROGRESS_SECONDS = 5.0
+
+# Bytes read at a time when checking a corpus against its watermark.
+HASH_BLOCK_BYTES = 1024 * 1024
+
+_pool: Optional[ThreadPoolExecutor] = None
+
+Chunk = Tuple[Dict[str, str], str]
+# (number of the first line, raw lines, bytes)
+LineBatch = Tuple[int, List[bytes], int]
+
+
+def __getattr__(name: str) -> Any:
+    if name == "encoding":
+        return _encoding()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _encoding() -> Any:
+    return tokenizers.encoding_for_model(TOKENIZER_MODEL)
+
+
+def _tokenizer_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(TOKENIZER_THREADS, thread_name_prefix="raft-tokenize")
+    return _pool
+
+
+def token_lengths(lines: List[str]) -> List[int]:
+    """
+    The token count of each line, encoding every line once.
+
+    A large document's lines are encoded in a few contiguous slices on
+    a shared thread pool (tiktoken releases the GIL while encoding).
+    tiktoken's own encode_ordinary_batch starts a pool per call and a
+    task per line, which costs more than it saves on the short lines of
+    an ordinary post, so those are encoded inline.
+    """
+    encode = _encoding().encode_ordinary
+
+    def lengths(part: List[str]) -> List[int]:
+        # encode_ordinary: scraped text may contain "<|endoftext|>" and
+        # friends, which plain encode() refuses.
+        return [len(encode(line)) for line in part]
+
+    if TOKENIZER_THREADS < 2 or sum(map(len, lines)) < PARALLEL_MIN_CHARS:
+        return lengths(lines)
+    step = -(-len(lines) // TOKENIZER_THREADS)
+    parts = [lines[i : i + step] for i in range(0, len(lines), step)]
+    return [n for part in _tokenizer_pool().map(lengths, parts) for n in part]
+
+
+def _pieces(line: str, size: int) -> List[Tuple[str, int]]:
+    """
+    A line of more than `size` tokens, cut at token boundaries into
+    pieces of at most `size` tokens each (with their token counts).
+    """
+    encoding = _encoding()
+    tokens = encoding.encode_ordinary(line)
+    pieces = []
+    start = 0
+    while start < len(tokens):
+        end = min(start + size, len(tokens))
+        # Tokens are bytes: never cut inside a multi-byte character.
+        while end < len(tokens) and end > start + 1 and not _whole_characters(tokens[start:end]):
+            end -= 1
+        pieces.append((encoding.decode(tokens[start:end]), end - start))
+        start = end
+    return pieces
+
+
+def _whole_characters(tokens: List[int]) -> bool:
+    try:
+        _encoding().decode_bytes(tokens).decode("utf-8")
+        return True
+    except UnicodeDecodeError:
+        return False
 
-MAX_EMBEDDING_LENGTH = 2048
-encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
 
+def _date(value: Any) -> Any:
+    """A post's date as stored in chunk metadata: ISO text when possible."""
+    isoformat = getattr(value, "isoformat", None)
+    return isoformat() if isoformat is not None else value
 
-def map_line(line: str) -> Tuple[str, str, int]:
+
+def split_post(
+    post: Dict[str, Any],
+    chunk_tokens: int = DEFAULT_CHUNK_TOKENS,
+    overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+) -> Generator[Chunk, None, None]:
     """
-    Encode and potentially truncate a line of text.
+    Split one blog post into chunks of at most chunk_tokens tokens.
+
+    Lines are packed whole, counting the newlines that join them; a line
+    longer than a chunk is cut at token boundaries. Each chunk after the
+    first starts with the last lines of the one before, up to
+    overlap_tokens. The post's chunks are buffered, so total_parts is
+    known without a second pass.
 
     Args:
-        line (str): The input line of text.
+        post (Dict[str, Any]): A post: title, link, date and content.
+        chunk_tokens (int): The chunk size in tokens.
+        overlap_tokens (int): Tokens of context repeated between chunks.
 
-    Returns:
-        Tuple[str, str, int]: A tuple containing:
-            - the original or truncated line,
-            - the decoded version, and
-            - the length of the encoded line.
+    Yields:
+        Tuple[Dict[str, str], str]: A tuple containing metadata
+            and the chunked content.
     """
-    encoded = encoding.encode(line)
-    if len(encoded) < MAX_EMBEDDING_LENGTH:
-        return (line, encoding.decode(encoded), len(encoded))
-    else:
-        truncated_encoded = encoded[:MAX_EMBEDDING_LENGTH]
-        return (
-            line[:MAX_EMBEDDING_LENGTH],
-            encoding.decode(truncated_encoded),
-            MAX_EMBEDDING_LENGTH,
-        )
+    lines = post["content"].split("\n")
+
+    chunks: List[List[str]] = []
+    chunk: List[Tuple[str, int]] = []
+    used = 0
+    for line, length in zip(lines, token_lengths(lines)):
+        pieces = _pieces(line, chunk_tokens) if length > chunk_tokens else [(line, length)]
+        for piece, length in pieces:
+            if chunk and used + SEPARATOR_TOKENS + length > chunk_tokens:
+                chunks.append([text for text, _ in chunk])
+                chunk, used = _overlap(chunk, overlap_tokens, chunk_tokens - length)
+            used += (SEPARATOR_TOKENS if chunk else 0) + length
+            chunk.append((piece, length))
+    if chunk:
+        chunks.append([text for text, _ in chunk])
+
+    for part, texts in enumerate(chunks, 1):
+        metadata = {
+            "title": post.get("title"),
+            "url": post.get("link"),
+            "date": _date(post.get("date")),
+            "total_parts": str(len(chunks)),
+            "part": str(part),
+        }
+        yield metadata, "\n".join(texts)
+
+
+def _overlap(
+    chunk: List[Tuple[str, int]], overlap_tokens: int, room: int
+) -> Tuple[List[Tuple[str, int]], int]:
+    """
+    The trailing lines of a finished chunk that open the next one: as
+    many as fit in overlap_tokens, leaving `room` for the line that
+    did not fit. Returns them and their token count.
+    """
+    kept: List[Tuple[str, int]] = []
+    used = 0
+    for text, length in reversed(chunk):
+        cost = length + (SEPARATOR_TOKENS if kept else 0)
+        if used + cost > overlap_tokens or used + cost + SEPARATOR_TOKENS > room:
+            break
+        kept.insert(0, (text, length))
+        used += cost
+    return kept, used
 
 
 def split_into_chunks(
-    blog_posts: pd.DataFrame,
-) -> Generator[Tuple[Dict[str, str], str], None, None]:
+    blog_posts: Iterable[Dict[str, Any]],
+    chunk_tokens: int = DEFAULT_CHUNK_TOKENS,
+    overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+) -> Generator[Chunk, None, None]:
     """
-    Split blog posts into chunks of a maximum length.
+    Split blog posts into chunks of a maximum length, lazily.
 
     Args:
-        blog_posts (pd.DataFrame): DataFrame containing blog post data.
+        blog_posts (Iterable[Dict[str, Any]]): The posts (see read_posts).
+        chunk_tokens (int): The chunk size in tokens.
+        overlap_tokens (int): Tokens of context repeated between chunks.
 
     Yields:
         Tuple[Dict[str, str], str]: A tuple containing metadata
             and the chunked content.
     """
-    for _, post in blog_posts.iterrows():
-        print(f"Splitting {post['title']}")
-        lines = list(map(map_line, post["content"].split("\n")))
-
-        # Calculate total parts
-        total_parts = 0
-        temp_chunk_length = 0
-        for _, _, length in lines:
-            if temp_chunk_length + length > MAX_EMBEDDING_LENGTH:
-                total_parts += 1
-                temp_chunk_length = length
-            else:
-                temp_chunk_length += length
-        total_parts += 1  # for the last chunk
-
-        chunk: List[str] = []
-        chunk_length = 0
-        part = 1
-
-        for line, _, length in lines:
-            if chunk_length + length > MAX_EMBEDDING_LENGTH:
-                metadata = {
-                    "title": post["title"],
-                    "url": post["link"],
-                    "date": (
-                        post["date"].isoformat()
-                        if isinstance(post["date"], pd.Timestamp)
-                        else post["date"]
-                    ),
-                    "total_parts": str(total_parts),
-                    "part": str(part),
-                }
-                yield metadata, "\n".join(chunk)
-                chunk = []
-                chunk_length = 0
-                part += 1
-            chunk.append(line)
-            chunk_length += length
-
-        if chunk:
-            metadata = {
-                "title": post["title"],
-                "url": post["link"],
-                "date": (
-                    post["date"].isoformat()
-                    if isinstance(post["date"], pd.Timestamp)
-                    else post["date"]
-                ),
-                "total_parts": str(total_parts),
-                "part": str(part),
-            }
-            yield metadata, "\n".join(chunk)
-
-
-def chunker(name: str) -> None:
+    for post in blog_posts:
+        yield from split_post(post, chunk_tokens, overlap_tokens)
+
+
+def _parse(sourcefile: str, lineno: int, line: Union[str, bytes]) -> Dict[str, Any]:
+    """One JSONL line as a post; a ValueError naming the line otherwise."""
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError as e:
+        text = line.decode("utf-8", "replace") if isinstance(line, bytes) else line
+        raise ValueError(
+            f"Error decoding JSON at {sourcefile} line {lineno}: {e}\n"
+            f"Problematic line: {text.rstrip()[:200]}"
+        ) from e
+
+
+@functools.lru_cache(maxsize=None)
+def _warn_capped(size: int, limit: int) -> None:
+    """Warn that chunks are capped, once per size and limit: settings are read often."""
+    hx.warn(f"{size}-token chunks exceed the embedding model's {limit}; using {limit}")
+
+
+def chunk_settings(name: str) -> Dict[str, int]:
     """
-    Process a JSONL file of blog posts, split them into chunks,
-    and save the results.
+    The dataset's chunk_tokens and overlap_tokens, from its meta (see
+    configure), with the size capped at what its embedding model takes.
+    """
+    meta = state.load_meta(name)
+    size = int(meta.get("chunk_tokens") or DEFAULT_CHUNK_TOKENS)
+    limit = get_backend(state.embedding_backend(name)).max_tokens
+    if limit and size > limit:
+        _warn_capped(size, limit)
+        size = limit
+    overlap = int(meta.get("overlap_tokens") or DEFAULT_OVERLAP_TOKENS)
+    return {"chunk_tokens": size, "overlap_tokens": min(overlap, size // 2)}
+
+
+def configure(name: str, chunk_tokens: int = 0, overlap_tokens: Optional[int] = None) -> None:
+    """
+    Record chunk size and/or overlap (tokens) for a dataset; the next
+    chunking run uses them, and `raft embed` re-chunks until then.
+    """
+    fields: Dict[str, int] = {}
+    if chunk_tokens:
+        if chunk_tokens < 16:
+            raise ValueError(f"chunk size {chunk_tokens} is too small (min 16 tokens)")
+        fields["chunk_tokens"] = chunk_tokens
+    if overlap_tokens is not None:
+        size = chunk_tokens or chunk_settings(name)["chunk_tokens"]
+        if not 0 <= overlap_tokens <= size // 2:
+            raise ValueError(f"overlap must be 0 to {size // 2} tokens (half a chunk)")
+        fields["overlap_tokens"] = overlap_tokens
+    if fields:
+        state.update_meta(name, **fields)
+
+
+def _recorded(settings: Dict[str, int]) -> Dict[str, Any]:
+    """What chunked_with records: the settings and what cut with them."""
+    return dict(settings, tokenizer=tokenizers.encoding_name(TOKENIZER_MODEL), version=CHUNKER_VERSION)
+
+
+def chunks_stale(name: str) -> bool:
+    """
+    Whether data/{name}_chunked.jsonl should be redone before embedding:
+    it is missing, or was cut with other settings than the dataset's
+    now. Only when there is a corpus to redo it from.
+
+    Chunk files from before settings were recorded count as current
+    while the dataset keeps the default settings. A corpus that changed
+    size since it was chunked (chunked_corpus_bytes; the watermark's
+    bytes before that was recorded) has new posts to chunk -- also when
+    its unfinished last line left no watermark.
+    """
+    if not os.path.exists(f"data/{name}.jsonl"):
+        return False
+    if not os.path.exists(f"data/{name}_chunked.jsonl"):
+        return True
+    meta = state.load_meta(name)
+    mark = meta.get("chunk_watermark")
+    chunked = meta.get("chunked_corpus_bytes", mark["bytes"] if mark else None)
+    if chunked is not None and os.path.getsize(f"data/{name}.jsonl") != chunked:
+        return True
+    settings = chunk_settings(name)
+    recorded = meta.get("chunked_with")
+    if recorded is None:
+        return settings != {
+            "chunk_tokens": DEFAULT_CHUNK_TOKENS,
+            "overlap_tokens": DEFAULT_OVERLAP_TOKENS,
+        }
+    return recorded != _recorded(settings)
+
+
+def read_posts(sourcefile: str) -> Generator[Dict[str, Any], None, None]:
+    """
+    The posts of a JSONL file, one line at a time.
+
+    Raises:
+        ValueError: On a line that is not JSON, naming the line.
+    """
+    with open(sourcefile, "r") as f:
+        for lineno, line in enumerate(f, 1):
+            if line.strip():
+                yield _parse(sourcefile, lineno, line)
+
+
+def _line_batches(
+    sourcefile: str, start: int = 0, first_line: int = 1, digest: Optional[Any] = None
+) -> Generator[LineBatch, None, None]:
+    """
+    The raw lines of a JSONL file in batches of about CHUNK_BATCH_BYTES:
+    (number of the first line, lines, bytes). Reading starts at byte
+    `start`, which is line `first_line`; every line read is also fed to
+    `digest`, if given.
+    """
+    with open(sourcefile, "rb") as f:
+        f.seek(start)
+        lines: List[bytes] = []
+        first = size = 0
+        for lineno, line in enumerate(f, first_line):
+            if not lines:
+                first = lineno
+            lines.append(line)
+            size += len(line)
+            if digest is not None:
+                digest.update(line)
+            if size >= CHUNK_BATCH_BYTES:
+                yield first, lines, size
+                lines, size = [], 0
+        if lines:
+            yield first, lines, size
+
+
+def _split_lines(
+    sourcefile: str, first: int, lines: List[bytes], settings: Dict[str, int]
+) -> List[Chunk]:
+    """The chunks of a batch of raw JSONL lines (runs in pool processes)."""
+    chunks: List[Chunk] = []
+    for lineno, line in enumerate(lines, first):
+        if line.strip():
+            post = _parse(sourcefile, lineno, line)
+            chunks.extend(
+                split_post(post, settings["chunk_tokens"], settings["overlap_tokens"])
+            )
+    return chunks
+
+
+def _chunk_batches(
+    sourcefile: str, workers: int, settings: Dict[str, int], batches: Iterable[LineBatch]
+) -> Generator[Tuple[int, int, List[Chunk]], None, None]:
+    """
+    (lines, bytes, chunks) per line batch of the file (see _line_batches),
+    in file order. With several workers the batches are split in a
+    process pool, at most 2 x workers of them in flight, and still come
+    back in order.
+    """
+    if workers <= 1:
+        for first, lines, size in batches:
+            yield len(lines), size, _split_lines(sourcefile, first, lines, settings)
+        return
+
+    in_flight: Deque[Tuple[int, int, Future]] = deque()
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        for first, lines, size in batches:
+            future = pool.submit(_split_lines, sourcefile, first, lines, settings)
+            in_flight.append((len(lines), size, future))
+            if len(in_flight) >= 2 * workers:
+                read, size, future = in_flight.popleft()
+                yield read, size, future.result()
+        while in_flight:
+            read, size, future = in_flight.popleft()
+            yield read, size, future.result()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+class _Progress:
+    """Chunking progress and throughput, through hx every few seconds."""
+
+    def __init__(self, sourcefile: str, start: int = 0):
+        self.sourcefile = sourcefile
+        self.total = os.path.getsize(sourcefile) - start
+        self.done = 0
+        self.started = self.reported = time.monotonic()
+
+    def rate(self) -> float:
+        return self.done / 1e6 / max(time.monotonic() - self.started, 1e-9)
+
+    def update(self, size: int) -> None:
+        self.done += size
+        if time.monotonic() - self.reported >= PROGRESS_SECONDS:
+            self.reported = time.monotonic()
+            hx.say(
+                f"chunked {self.done / 1e6:.1f} of {self.total / 1e6:.1f} MB "
+                f"({self.rate():.1f} MB/s)"
+            )
+
+    def finish(self, chunks: int, appended: bool = False) -> None:
+        what = "new chunks appended" if appended else "chunks"
+        hx.ok(
+            f"{self.sourcefile}: {chunks} {what} from {self.done / 1e6:.1f} MB "
+            f"({self.rate():.1f} MB/s)"
+        )
+
+
+def _prefix_digest(sourcefile: str, size: int) -> Any:
+    """The sha256 of a file's first `size` bytes, open for more updates."""
+    digest = hashlib.sha256()
+    with open(sourcefile, "rb") as f:
+        remaining = size
+        while remaining:
+            block = f.read(min(HASH_BLOCK_BYTES, remaining))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+    return digest
+
+
+def _ends_line(sourcefile: str, size: int) -> bool:
+    """Whether the first `size` bytes of a file end with a whole line."""
+    if not size:
+        return True
+    with open(sourcefile, "rb") as f:
+        f.seek(size - 1)
+        return f.read(1) == b"\n"
+
+
+def _resume_point(name: str, settings: Dict[str, int]) -> Optional[Tuple[Dict[str, Any], Any]]:
+    """
+    Where chunking data/{name}.jsonl can pick up: the dataset's
+    chunk_watermark and the running sha256 of the corpus up to it -- or
+    None when the corpus has to be chunked whole.
+
+    Corpora only grow by appending (sources.append_corpus_records), so
+    the watermark holds while the corpus is at least as long as it was,
+    its first watermark bytes hash the same, the chunk file is the one
+    written then, and the settings have not changed.
+    """
+    meta = state.load_meta(name)
+    mark = meta.get("chunk_watermark")
+    if not mark or meta.get("chunked_with") != _recorded(settings):
+        return None
+    sourcefile = f"data/{name}.jsonl"
+    try:
+        shrunk = os.path.getsize(sourcefile) < mark["bytes"]
+        replaced = os.path.getsize(f"data/{name}_chunked.jsonl") != mark["chunked_bytes"]
+    except OSError:
+        return None
+    if replaced:
+        return None
+    digest = None if shrunk else _prefix_digest(sourcefile, mark["bytes"])
+    if digest is None or digest.hexdigest() != mark["sha256"]:
+        hx.warn(f"{sourcefile} was rewritten since it was chunked; chunking it whole")
+        return None
+    return mark, digest
+
+
+def read_chunks(outputfile: str) -> Generator[Chunk, None, None]:
+    """The (metadata, document) chunks of a _chunked.jsonl file."""
+    with open(outputfile, "r") as f:
+        for line in f:
+            metadata, document = json.loads(line)
+            yield metadata, document
+
+
+def stream_chunks(
+    name: str, workers: int = 1, rebuild: bool = False, existing: bool = True
+) -> Generator[Chunk, None, None]:
+    """
+    Chunk data/{name}.jsonl, yielding the chunks in corpus order as they
+    are made and writing them to data/{name}_chunked.jsonl on the way.
+    The settings they were cut with (see chunk_settings) are then
+    recorded in the dataset meta as chunked_with.
+
+    Runs are incremental: each records a chunk_watermark (bytes and
+    lines of the corpus chunked, their sha256, and the size of the
+    chunk file), and the next one splits only the posts appended since,
+    appending their chunks. Anything else -- a corpus that shrank or
+    hashes differently, another chunk file, other settings -- chunks
+    the corpus whole into a new file, swapped in once every post is
+    chunked. An appending run that fails truncates the file back.
 
     Args:
         name (str): The name of the file to process (without extension).
+        workers (int): Processes to split posts in; the output is the
+            same for any number.
+        rebuild (bool): Chunk the whole corpus even if it only grew.
+        existing (bool): On an incremental run, yield the chunks already
+            in the file first, so the stream is the whole dataset's.
+
+    Yields:
+        Tuple[Dict[str, str], str]: Metadata and content for each chunk.
     """
     sourcefile = f"data/{name}.jsonl"
     outputfile = f"data/{name}_chunked.jsonl"
+    partial = f"{outputfile}.partial"
 
-    try:
-        # Read the JSONL file line by line
-        with open(sourcefile, "r") as f:
-            data = [json.loads(line) for line in f]
+    settings = chunk_settings(name)
+    resume = None if rebuild else _resume_point(name, settings)
+    if resume is None:
+        mark: Dict[str, Any] = {"bytes": 0, "lines": 0, "chunked_bytes": 0}
+        digest = hashlib.sha256()
+        target = partial
+    else:
+        mark, digest = resume
+        target = outputfile
+        hx.say(
+            f"{sourcefile}: {mark['lines']} lines ({mark['bytes'] / 1e6:.1f} MB) "
+            "already chunked; chunking what was appended"
+        )
+        if existing:
+            yield from read_chunks(outputfile)
 
-        blog_posts: pd.DataFrame = pd.DataFrame(data)
-        print(f"Splitting {len(blog_posts)} blog posts into chunks")
+    progress = _Progress(sourcefile, mark["bytes"])
+    batches = _line_batches(sourcefile, mark["bytes"], mark["lines"] + 1, digest)
+    count = 0
+    lines, size = mark["lines"], mark["bytes"]
+    try:
+        with open(target, "a" if resume else "w") as output:
+            for read, batch_size, chunks in _chunk_batches(sourcefile, workers, settings, batches):
+                for item in chunks:
+                    output.write(json.dumps(item) + "\n")
+                    yield item
+                count += len(chunks)
+                lines += read
+                size += batch_size
+                progress.update(batch_size)
+    except BaseException:
+        if resume is None:
+            if os.path.exists(partial):
+                os.remove(partial)
+        else:
+            os.truncate(outputfile, mark["chunked_bytes"])
+        raise
+    if resume is None:
+        os.replace(partial, outputfile)
+    watermark = None
+    # a last line still being written is chunked, but not built on
+    if _ends_line(sourcefile, size):
+        watermark = {
+            "bytes": size,
+            "lines": lines,
+            "sha256": digest.hexdigest(),
+            "chunked_bytes": os.path.getsize(outputfile),
+        }
+    state.update_meta(
+        name, chunked_with=_recorded(settings), chunk_watermark=watermark, chunked_corpus_bytes=size
+    )
+    progress.finish(count, appended=resume is not None)
 
-        with open(outputfile, "w") as f:
-            for item in split_into_chunks(blog_posts):
-                f.write(json.dumps(item) + "\n")
 
-    except json.JSONDecodeError as e:
-        print(f"Error decoding JSON: {e}")
-        print(f"Error occurred at line {e.lineno}")
-        with open(sourcefile, "r") as f:
-            problematic_line = f.readlines()[e.lineno - 1]
-        print(f"Problematic line: {problematic_line}")
+def chunker(name: str, workers: int = 1, rebuild: bool = False) -> None:
+    """
+    Process a JSONL file of blog posts, split them into chunks,
+    and save the results to data/{name}_chunked.jsonl -- only the
+    posts appended since the last run, unless the corpus changed
+    otherwise (see stream_chunks).
 
+    Args:
+        name (str): The name of the file to process (without extension).
+        workers (int): Processes to split posts in.
+        rebuild (bool): Chunk the whole corpus regardless.
+    """
+    try:
+        for _ in stream_chunks(name, workers, rebuild=rebuild, existing=False):
+            pass
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -3,14 +3,11 @@ This module contains the main CLI functionality for the RAFT project.
 """
 
 import argparse
-from raft import (
-    files_helper,
-    embeddings_helpers,
-    substack_embeddings,
-    generate_finetune,
-    oai_finetune,
-    memories,
-)
+from typing import Union
+
+# The raft modules are imported by the actions that use them: chroma,
+# openai and the tokenizers take most of a second to load, which
+# `raft --help` and a typo should not pay for.
 
 
 def action_doc() -> str:
@@ -26,8 +23,12 @@ The following actions are available:
 - interactive: Guided session in five phases: gather, prep, train, eval, serve.
 - tweets: Build a dataset from tweets via ariadne interactive.
 - fetch: Fetch the blog from Substack and store it in the data directory.
-- chunk: Chunk the blog into 4096 token pieces and store them in /data.
-- embed: Create embeddings for the chunks and store them.
+- chunk: Chunk the blog into 2048-token pieces (--chunk-tokens, --overlap)
+  and store them in /data; later runs only chunk appended posts (--rebuild:
+  all of them).
+- embed: Create embeddings for the chunks and store them (--chunk:
+  chunk the blog on the fly, streaming chunks into embedding; --dedup T:
+  skip near-duplicate chunks).
 - ft:gen: Generate finetune files for the blog.
 - ft:run: Run the finetune job (OpenAI, or huggingface via opbdh).
 - bench:setup: Setup the benchmark for the blog.
@@ -41,6 +42,21 @@ opbdh; unknown flags after the name are forwarded verbatim to
 """
 
 
+def max_distance(value: str) -> Union[float, str]:
+    """--max-distance: "auto", "off" (0) or a distance >= 0."""
+    if value == "auto":
+        return value
+    if value == "off":
+        return 0.0
+    try:
+        distance = float(value)
+    except ValueError:
+        distance = -1.0
+    if not distance >= 0:
+        raise argparse.ArgumentTypeError(f"expected auto, off or a distance >= 0, not {value!r}")
+    return distance
+
+
 cmds = [
     "interactive",
     "tweets",
@@ -105,6 +121,77 @@ def main() -> None:
             huggingface org/name id trained via opbdh.",
         default="",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="embed: embedding requests in flight at once \
+            (default: RAFT_EMBED_WORKERS, or 4); chunk: processes to \
+            split posts in (default: 1).",
+    )
+    parser.add_argument(
+        "--backend",
+        help="embed: embedding backend for the dataset (openai, or \
+            hashing: local, offline); recorded in the dataset meta.",
+        default="",
+    )
+    parser.add_argument(
+        "--chunk",
+        action="store_true",
+        help="embed: chunk data/{name}.jsonl on the fly and stream the \
+            chunks into embedding (still writing _chunked.jsonl).",
+    )
+    parser.add_argument(
+        "--chunk-tokens",
+        type=int,
+        default=0,
+        help="chunk/embed: chunk size in tokens for the dataset (default \
+            2048, capped at the embedding model's limit); recorded in \
+            the dataset meta.",
+    )
+    parser.add_argument(
+        "--overlap",
+        type=int,
+        default=None,
+        help="chunk/embed: tokens of context repeated between a post's \
+            chunks (default 0); recorded in the dataset meta.",
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="chunk: chunk the whole corpus, not only the posts appended \
+            since the last run.",
+    )
+    parser.add_argument(
+        "--index",
+        help="embed: retrieval backend for the dataset (chroma, or flat: \
+            a memory-mapped exact index); recorded in the dataset meta.",
+        default="",
+    )
+    parser.add_argument(
+        "--precision",
+        help="embed: how the flat index stores vectors (float32, or \
+            float16 / int8 with exact float32 re-scoring); recorded in \
+            the dataset meta.",
+        default="",
+    )
+    parser.add_argument(
+        "--dedup",
+        type=float,
+        default=None,
+        help="embed: collapse chunks at least this similar (0-1, e.g. \
+            0.9; MinHash over word shingles) before embedding; 0 keeps \
+            them all; recorded in the dataset meta.",
+    )
+    parser.add_argument(
+        "--max-distance",
+        type=max_distance,
+        default=None,
+        help="ft:gen/serve/ask: only summarize extracts within this \
+            (squared L2) distance of the question; auto calibrates it on \
+            the interview questions, off summarizes them all; recorded in \
+            the dataset meta.",
+    )
     parser.add_argument(
         "--no-interactive",
         action="store_true",
@@ -120,6 +207,21 @@ def main() -> None:
     if needs_name and not args.name:
         parser.error(f"the '{args.action}' action requires a dataset name")
 
+    if args.max_distance is not None and args.name:
+        from .state import update_meta
+
+        update_meta(args.name, max_distance=args.max_distance)
+
+    if args.action in ("chunk", "embed"):
+        from . import chunker, dedup
+
+        try:
+            chunker.configure(args.name, args.chunk_tokens, args.overlap)
+            if args.dedup:
+                dedup.Deduplicator(args.dedup)  # validates the threshold
+        except ValueError as e:
+            parser.error(str(e))
+
     if args.action == "interactive":
         from .flows import run_interactive
 
@@ -129,12 +231,32 @@ def main() -> None:
 
         run_tweet_mode(args.name)
     elif args.action == "fetch":
+        from . import substack_embeddings
+
         substack_embeddings.main(args.name)
     elif args.action == "chunk":
-        files_helper.chunker(args.name)
+        from . import files_helper
+
+        files_helper.chunker(args.name, workers=args.workers or 1, rebuild=args.rebuild)
     elif args.action == "embed":
-        embeddings_helpers.store_grounding_embeddings(args.name)
+        from . import embeddings_helpers
+
+        embed = (
+            embeddings_helpers.chunk_and_embed
+            if args.chunk
+            else embeddings_helpers.store_grounding_embeddings
+        )
+        embed(
+            args.name,
+            workers=args.workers or embeddings_helpers.EMBED_WORKERS,
+            backend=args.backend,
+            index=args.index,
+            precision=args.precision,
+            dedup_threshold=args.dedup,
+        )
     elif args.action == "ft:gen":
+        from . import generate_finetune, oai_finetune
+
         if args.oai:
             oai_finetune.create_openai_finetune_file(args.name)
         elif args.generic:
@@ -143,6 +265,7 @@ def main() -> None:
             generate_finetune.generate_finetune(args.name)
             oai_finetune.create_openai_finetune_file(args.name)
     elif args.action == "ft:run":
+        from . import oai_finetune
         from .hf_finetune import is_openai_finetunable, run_hf_finetune
         from .interactive import ask
 
@@ -172,6 +295,8 @@ def main() -> None:
             )
             record_finetuned_model(args.name, adapter, "hf")
     elif args.action == "bench:setup":
+        from . import generate_finetune, oai_finetune
+
         if args.oai:
             oai_finetune.create_openai_finetune_file(args.name, "benchmark")
         elif args.generic:
@@ -187,6 +312,8 @@ def main() -> None:
         if args.question is None:
             print("Please provide a question using the --question argument.")
         else:
+            from . import memories
+
             memory_manager = memories.MemoryManager(
                 args.name, {}
             )  # Empty metadata for now
@@ -0,0 +1,148 @@
+"""
+Near-duplicate chunks, found by MinHash before they are embedded.
+
+Tweet threads, substack posts and their RSS re-posts repeat the same
+passages, and every copy used to be embedded, stored, retrieved and
+summarized. With a threshold set (`raft embed <name> --dedup 0.9`),
+each chunk gets a MinHash signature over its word 5-gram shingles. The
+signatures are banded into an LSH table, and a chunk whose estimated
+Jaccard similarity to an earlier one reaches the threshold is collapsed
+into it: only the first copy, in corpus order, is embedded, and it
+records the urls of all the copies (see Deduplicator.sources).
+
+Signatures are deterministic (crc32 shingles, fixed seeds), so a corpus
+collapses the same way on every run. Memory is one 512-byte signature
+per kept chunk.
+"""
+
+import re
+import zlib
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# MinHash functions per signature: the similarity estimate is good to
+# about 1 / sqrt(SIGNATURE_SIZE).
+SIGNATURE_SIZE = 128
+
+# Words per shingle.
+SHINGLE_WORDS = 5
+
+_WORDS = re.compile(r"\w+")
+
+_rng = np.random.default_rng(0x5EED)
+# multiply-shift hashing: (a * x + b) mod 2^64, top 32 bits
+_A = _rng.integers(1, 2**63, SIGNATURE_SIZE, dtype=np.uint64) | np.uint64(1)
+_B = _rng.integers(0, 2**63, SIGNATURE_SIZE, dtype=np.uint64)
+
+
+def shingles(text: str) -> np.ndarray:
+    """The distinct crc32 hashes of a text's lowercased word n-grams."""
+    words = _WORDS.findall(text.lower())
+    grams = [
+        " ".join(words[i : i + SHINGLE_WORDS])
+        for i in range(max(1, len(words) - SHINGLE_WORDS + 1))
+    ]
+    return np.unique(
+        np.fromiter(
+            (zlib.crc32(gram.encode("utf-8")) for gram in grams),
+            dtype=np.uint64,
+            count=len(grams),
+        )
+    )
+
+
+def signature(text: str) -> np.ndarray:
+    """The MinHash signature of a text: SIGNATURE_SIZE uint32 minima."""
+    hashed = (shingles(text)[:, None] * _A + _B) >> np.uint64(32)
+    return hashed.min(axis=0).astype(np.uint32)
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """The Jaccard similarity two signatures estimate."""
+    return float((a == b).mean())
+
+
+def rows_per_band(threshold: float) -> int:
+    """
+    LSH rows per band for a threshold: the most (fewest false
+    candidates) that still make chunks a little below the threshold
+    likely candidates.
+    """
+    rows = 1
+    for candidate in (2, 4, 8, 16, 32):
+        bands = SIGNATURE_SIZE // candidate
+        if (1 / bands) ** (1 / candidate) <= threshold - 0.05:
+            rows = candidate
+    return rows
+
+
+class Deduplicator:
+    """
+    Collapses near-duplicate chunks as they stream past: add() each
+    chunk in order, and it answers whether an earlier one is (nearly)
+    the same.
+    """
+
+    def __init__(self, threshold: float):
+        """
+        Args:
+            threshold (float): Estimated Jaccard similarity (0 to 1] of
+                word shingles at which two chunks count as one.
+
+        Raises:
+            ValueError: For a threshold outside (0, 1].
+        """
+        if not 0 < threshold <= 1:
+            raise ValueError(f"dedup threshold must be in (0, 1], not {threshold}")
+        self.threshold = threshold
+        self.rows = rows_per_band(threshold)
+        self.collapsed = 0
+        self._buckets: List[Dict[bytes, List[int]]] = [
+            {} for _ in range(SIGNATURE_SIZE // self.rows)
+        ]
+        self._signatures: List[np.ndarray] = []
+        self._ids: List[str] = []
+        self._urls: List[str] = []
+        # surviving id -> the urls of its copies, its own first
+        self._sources: Dict[str, List[str]] = {}
+
+    def add(self, record_id: str, document: str, url: str = "") -> Optional[str]:
+        """
+        The id of the earlier chunk this one duplicates (which then
+        records url among its sources), or None if the chunk is kept.
+        """
+        found = signature(document)
+        keys = [
+            found[band * self.rows : (band + 1) * self.rows].tobytes()
+            for band in range(len(self._buckets))
+        ]
+        checked = set()
+        for band, key in enumerate(keys):
+            for row in self._buckets[band].get(key, ()):
+                if row in checked:
+                    continue
+                checked.add(row)
+                if similarity(self._signatures[row], found) >= self.threshold:
+                    survivor = self._ids[row]
+                    urls = self._sources.setdefault(survivor, [self._urls[row]])
+                    if url and url not in urls:
+                        urls.append(url)
+                    self.collapsed += 1
+                    return survivor
+
+        row = len(self._ids)
+        self._signatures.append(found)
+        self._ids.append(record_id)
+        self._urls.append(url)
+        for band, key in enumerate(keys):
+            self._buckets[band].setdefault(key, []).append(row)
+        return None
+
+    def sources(self, record_id: str) -> str:
+        """
+        The urls of a kept chunk and of the copies collapsed into it,
+        one per line -- or "" when no copy came from another url.
+        """
+        urls = self._sources.get(record_id, [])
+        return "\n".join(urls) if len(urls) > 1 else ""
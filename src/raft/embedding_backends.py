@@ -0,0 +1,149 @@
+"""
+Embedding backends: what turns text into vectors for a dataset.
+
+- "openai": text-embedding-ada-002 through the OpenAI API (the default,
+  and what every dataset embedded before 2.4 used).
+- "hashing": a deterministic feature-hashing embedder that runs locally
+  on the CPU -- no network, no key, sub-millisecond for a query. Its
+  retrieval is lexical rather than semantic, which is enough for
+  offline work, tests, and corpora where word overlap is what matters.
+
+The backend is chosen per dataset and recorded in data/{name}_meta.json
+(see state.embedding_backend); vectors from different backends are not
+comparable, so switching means re-embedding the corpus.
+"""
+
+import math
+import os
+import re
+import zlib
+from abc import ABC, abstractmethod
+from collections import Counter
+from typing import Dict, List
+
+from openai import OpenAI
+
+from . import tokenizers
+from .ratelimit import AdaptiveConcurrency, call_with_retries
+
+DEFAULT_BACKEND = "openai"
+
+# Embedding requests in flight at once, whichever threads make them (see
+# ratelimit.AdaptiveConcurrency): it starts at the maximum, so the
+# workers of `raft embed` set the pace until the API pushes back, then
+# drops on 429s and recovers as requests succeed.
+EMBED_MAX_CONCURRENCY = int(os.environ.get("RAFT_EMBED_MAX_CONCURRENCY", "16"))
+
+_client = None
+
+
+def _get_client() -> OpenAI:
+    global _client
+    if _client is None:
+        # Retries are ours (see ratelimit.call_with_retries), so the
+        # client's own would only multiply them.
+        _client = OpenAI(max_retries=0)
+    return _client
+
+
+class EmbeddingBackend(ABC):
+    """The interface every backend implements."""
+
+    # Registry name, recorded in the dataset meta.
+    name = ""
+    # Identifies the vector space: cache keys and collections carry it.
+    model = ""
+    # Remote backends are worth caching, batching concurrently and
+    # rate-limiting; local ones are cheaper to recompute than to look up.
+    remote = False
+    # The longest input the model embeds, in tokens (0: no limit).
+    max_tokens = 0
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """One vector per text, in input order."""
+
+    def count_tokens(self, text: str) -> int:
+        """The size of a text as the backend's request budgets count it."""
+        return len(text.split())
+
+
+class OpenAIEmbeddingBackend(EmbeddingBackend):
+    """text-embedding-ada-002 via the OpenAI embeddings API."""
+
+    name = "openai"
+    model = "text-embedding-ada-002"
+    remote = True
+    max_tokens = 8191
+
+    def __init__(self) -> None:
+        self.concurrency = AdaptiveConcurrency(
+            minimum=1, maximum=EMBED_MAX_CONCURRENCY, initial=EMBED_MAX_CONCURRENCY
+        )
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        # each attempt in a slot: the limit sees every 429, and the
+        # backoff between attempts holds none
+        response = call_with_retries(
+            self.concurrency.call, _get_client().embeddings.create, input=texts, model=self.model
+        )
+        # The API tags each vector with its input index; don't rely on
+        # the order of `data`.
+        ordered = sorted(response.data, key=lambda item: item.index)
+        return [item.embedding for item in ordered]
+
+    def count_tokens(self, text: str) -> int:
+        # encode_ordinary: scraped text may contain "<|endoftext|>" and
+        # friends, which plain encode() refuses.
+        return len(tokenizers.encoding_for_model(self.model).encode_ordinary(text))
+
+
+class HashingEmbeddingBackend(EmbeddingBackend):
+    """
+    Feature hashing of words and word bigrams into a fixed number of
+    signed buckets, log-scaled term frequencies, L2-normalised.
+
+    crc32 rather than hash(): the vectors must not change between
+    processes (PYTHONHASHSEED) or they could not be stored.
+    """
+
+    name = "hashing"
+    dimensions = 512
+    model = f"hashing-{dimensions}"
+
+    _words = re.compile(r"\w+")
+
+    def _vector(self, text: str) -> List[float]:
+        words = self._words.findall(text.lower())
+        features = Counter(words)
+        features.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+        vector = [0.0] * self.dimensions
+        for feature, count in features.items():
+            h = zlib.crc32(feature.encode("utf-8"))
+            sign = 1.0 if h & 0x80000000 else -1.0
+            vector[h % self.dimensions] += sign * (1.0 + math.log(count))
+        norm = math.sqrt(sum(v * v for v in vector))
+        return [v / norm for v in vector] if norm else vector
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        return [self._vector(text) for text in texts]
+
+
+BACKENDS: Dict[str, type] = {
+    OpenAIEmbeddingBackend.name: OpenAIEmbeddingBackend,
+    HashingEmbeddingBackend.name: HashingEmbeddingBackend,
+}
+
+_instances: Dict[str, EmbeddingBackend] = {}
+
+
+def get_backend(backend: str = DEFAULT_BACKEND) -> EmbeddingBackend:
+    """The (shared) backend instance registered under a name."""
+    if backend not in BACKENDS:
+        raise ValueError(
+            f"unknown embedding backend {backend!r} "
+            f"(available: {', '.join(sorted(BACKENDS))})"
+        )
+    if backend not in _instances:
+        _instances[backend] = BACKENDS[backend]()
+    return _instances[backend]
@@ -2,42 +2,298 @@
 This module provides helper functions for working with embeddings.
 """
 
+import hashlib
 import json
-from typing import Dict, Any, List
-from chromadb import PersistentClient
-from openai import OpenAI
+import os
+import queue
+import threading
+from array import array
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Deque, Dict, Any, Generator, Iterable, List, Optional, Tuple, TypeVar, Union
 
+from . import dedup, flat_index, hx, state, store
+from .cache import SqliteLRUCache
+from .embedding_backends import EmbeddingBackend, get_backend
+from .ratelimit import RateLimiter
 from .sources import date_num
 
-_client = None
+# Per-request budgets for embeddings.create. The API takes at most 2048
+# inputs and 300k tokens per call; staying well under both keeps each
+# request (and what a failure costs) reasonably small.
+BATCH_MAX_ITEMS = 512
+BATCH_MAX_TOKENS = 100_000
 
+# Embeddings already paid for, shared by every caller (embed, ft:gen,
+# serve, eval). RAFT_EMBEDDING_CACHE_MB=0 turns the cache off.
+EMBEDDING_CACHE_PATH = "data/embedding_cache.sqlite3"
+EMBEDDING_CACHE_MB = int(os.environ.get("RAFT_EMBEDDING_CACHE_MB", "1024"))
 
-def _get_client() -> OpenAI:
-    global _client
-    if _client is None:
-        _client = OpenAI()
-    return _client
+# Embedding requests in flight at once, and the account's limits for
+# the embedding model (the defaults are OpenAI's tier-1 limits).
+EMBED_WORKERS = int(os.environ.get("RAFT_EMBED_WORKERS", "4"))
+EMBED_RPM = float(os.environ.get("RAFT_EMBED_RPM", "3000"))
+EMBED_TPM = float(os.environ.get("RAFT_EMBED_TPM", "1000000"))
 
+# Chunks the chunker may run ahead of embedding in a streaming embed
+# (see chunk_and_embed): enough to keep the workers fed, bounded so
+# memory does not grow with the corpus.
+CHUNK_QUEUE_SIZE = 2048
 
-def get_embedding(text: str) -> List[float]:
+T = TypeVar("T")
+
+# Guards the singletons below: their first callers are often
+# embed_in_batches' workers, starting at once.
+_lock = threading.Lock()
+_limiter = None
+_caches: Dict[str, SqliteLRUCache] = {}
+
+
+def backend_for(name: str = "") -> EmbeddingBackend:
+    """
+    The embedding backend recorded for a dataset (OpenAI unless the
+    dataset chose otherwise, or when no dataset is given).
+    """
+    return get_backend(state.embedding_backend(name) if name else "openai")
+
+
+def rate_limiter() -> RateLimiter:
+    """The process-wide limiter for embedding requests."""
+    global _limiter
+    with _lock:
+        if _limiter is None:
+            _limiter = RateLimiter(EMBED_RPM, EMBED_TPM)
+        return _limiter
+
+
+def embedding_cache() -> Union[SqliteLRUCache, None]:
     """
-    Get the embedding for a given text using OpenAI's API.
+    The on-disk embedding cache under the current data/ directory, or
+    None when disabled.
+    """
+    if EMBEDDING_CACHE_MB <= 0:
+        return None
+    # Keyed by absolute path: the cache lives in the working directory's
+    # data/, and that can change within one process (tests do).
+    path = os.path.abspath(EMBEDDING_CACHE_PATH)
+    with _lock:
+        if path not in _caches:
+            _caches[path] = SqliteLRUCache(path, EMBEDDING_CACHE_MB * 1024 * 1024)
+        return _caches[path]
+
+
+def _cache_key(model: str, text: str) -> str:
+    return f"{model}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+
+def get_embeddings(
+    texts: List[str], backend: Optional[EmbeddingBackend] = None
+) -> List[List[float]]:
+    """
+    Embed several texts, with at most one backend request.
+
+    For remote backends, texts already in the embedding cache are
+    served from it; the rest (deduplicated) go out in a single request
+    -- retried with backoff on rate limits and transient errors -- and
+    are cached.
+
+    Args:
+        texts (List[str]): The texts to embed; callers keep them within
+            the per-request budgets (see batch_by_budget).
+        backend (EmbeddingBackend): Defaults to OpenAI.
+
+    Returns:
+        List[List[float]]: One embedding vector per text, in input order.
+    """
+    if not texts:
+        return []
+    backend = backend or get_backend()
+    cache = embedding_cache() if backend.remote else None
+    if cache is None:
+        return backend.embed(texts)
+
+    keys = [_cache_key(backend.model, text) for text in texts]
+    found: Dict[str, List[float]] = {}
+    for key, blob in cache.get_many(keys).items():
+        found[key] = array("f", blob).tolist()
+
+    missing = {key: text for key, text in zip(keys, texts) if key not in found}
+    if missing:
+        fresh = dict(zip(missing, backend.embed(list(missing.values()))))
+        found.update(fresh)
+        # float32 is what the API computes in; nothing is lost.
+        cache.put_many(
+            {key: array("f", vector).tobytes() for key, vector in fresh.items()}
+        )
+    return [found[key] for key in keys]
+
+
+def get_embedding(text: str, backend: Optional[EmbeddingBackend] = None) -> List[float]:
+    """
+    Get the embedding for a given text.
 
     Args:
         text (str): The text to embed.
+        backend (EmbeddingBackend): Defaults to OpenAI.
 
     Returns:
         List[float]: The embedding vector.
     """
-    embedding_object = _get_client().embeddings.create(
-        input=text, model="text-embedding-ada-002"
-    )
-    embedding_vector = embedding_object.data[0].embedding
-    return embedding_vector
+    return get_embeddings([text], backend)[0]
+
+
+def _budgeted_batches(
+    items: Iterable[Tuple[T, str]],
+    max_tokens: int,
+    max_items: int,
+    backend: EmbeddingBackend,
+) -> Generator[Tuple[List[Tuple[T, str]], int], None, None]:
+    """batch_by_budget's batches, each with its token count."""
+    batch: List[Tuple[T, str]] = []
+    batch_tokens = 0
+    for key, text in items:
+        tokens = backend.count_tokens(text)
+        if batch and (
+            batch_tokens + tokens > max_tokens or len(batch) >= max_items
+        ):
+            yield batch, batch_tokens
+            batch = []
+            batch_tokens = 0
+        batch.append((key, text))
+        batch_tokens += tokens
+    if batch:
+        yield batch, batch_tokens
+
+
+def batch_by_budget(
+    items: Iterable[Tuple[T, str]],
+    max_tokens: int = BATCH_MAX_TOKENS,
+    max_items: int = BATCH_MAX_ITEMS,
+    backend: Optional[EmbeddingBackend] = None,
+) -> Generator[List[Tuple[T, str]], None, None]:
+    """
+    Group (key, text) pairs into batches within a token and item budget.
+
+    A text that alone exceeds the token budget gets a batch of its own
+    (the API is then the judge of whether it fits the model).
+
+    Yields:
+        List[Tuple[T, str]]: The next batch, in input order.
+    """
+    backend = backend or get_backend()
+    for batch, _ in _budgeted_batches(items, max_tokens, max_items, backend):
+        yield batch
+
+
+def embed_in_batches(
+    items: Iterable[Tuple[T, str]],
+    max_tokens: int = BATCH_MAX_TOKENS,
+    max_items: int = BATCH_MAX_ITEMS,
+    workers: int = EMBED_WORKERS,
+    limiter: Optional[RateLimiter] = None,
+    backend: Optional[EmbeddingBackend] = None,
+) -> Generator[List[Tuple[T, List[float]]], None, None]:
+    """
+    Embed (key, text) pairs, one backend request per budgeted batch.
+
+    For a remote backend, up to `workers` requests run concurrently,
+    each admitted by the rate limiter (requests/min and tokens/min).
+    Batches are yielded in input order whatever order they complete in,
+    so writes downstream stay ordered; at most 2 x workers batches are
+    held in memory. Local backends embed inline.
+
+    Yields:
+        List[Tuple[T, List[float]]]: Each batch's keys paired with their
+        embeddings, in input order.
+    """
+    backend = backend or get_backend()
+    batches = _budgeted_batches(items, max_tokens, max_items, backend)
+    if not backend.remote:
+        for batch, _ in batches:
+            embeddings = get_embeddings([text for _, text in batch], backend)
+            yield [(key, embedding) for (key, _), embedding in zip(batch, embeddings)]
+        return
+
+    limiter = limiter or rate_limiter()
+
+    def job(batch: List[Tuple[T, str]], tokens: int) -> List[List[float]]:
+        limiter.acquire(tokens)
+        return get_embeddings([text for _, text in batch], backend)
+
+    in_flight: Deque[Tuple[List[Tuple[T, str]], Future]] = deque()
+
+    def done() -> List[Tuple[T, List[float]]]:
+        batch, future = in_flight.popleft()
+        return [(key, embedding) for (key, _), embedding in zip(batch, future.result())]
+
+    pool = ThreadPoolExecutor(max_workers=max(1, workers))
+    try:
+        for batch, tokens in batches:
+            in_flight.append((batch, pool.submit(job, batch, tokens)))
+            if len(in_flight) >= 2 * max(1, workers):
+                yield done()
+        while in_flight:
+            yield done()
+    finally:
+        # On an error (or an abandoned generator) queued batches are
+        # dropped rather than paid for.
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def prefetch(items: Iterable[T], maxsize: int) -> Generator[T, None, None]:
+    """
+    Iterate `items` on a background thread, at most `maxsize` items
+    ahead of the consumer.
+
+    The producer's errors are re-raised to the consumer; a consumer
+    that stops early (error, interrupt, abandoned generator) stops the
+    producer and closes `items`.
+    """
+    buffer: "queue.Queue[Tuple[bool, Any]]" = queue.Queue(maxsize=max(1, maxsize))
+    stop = threading.Event()
+
+    def put(entry: Tuple[bool, Any]) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce() -> None:
+        try:
+            for item in items:
+                if not put((False, item)):
+                    return
+            put((True, None))
+        except BaseException as e:
+            put((True, e))
+        finally:
+            close = getattr(items, "close", None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=produce, name="raft-prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            finished, value = buffer.get()
+            if finished:
+                if value is not None:
+                    raise value
+                return
+            yield value
+    finally:
+        stop.set()
+        thread.join()
 
 
 def get_and_store_embedding(
-    exchange: Dict[str, Any], name: str, metadata: Dict[str, Any]
+    exchange: Dict[str, Any],
+    name: str,
+    metadata: Dict[str, Any],
+    writer: Optional[store.UpsertBuffer] = None,
 ) -> List[float]:
     """
     Get and store the embedding for a given exchange.
@@ -46,27 +302,61 @@ def get_and_store_embedding(
         exchange (Dict[str, Any]): The exchange data.
         name (str): The name of the collection.
         metadata (Dict[str, Any]): Metadata for the embedding.
+        writer (store.UpsertBuffer): Buffer the record here instead of
+            upserting it right away.
 
     Returns:
         List[float]: The embedding vector.
     """
+    return get_and_store_embeddings([exchange], name, metadata, writer)[0]
+
+
+def get_and_store_embeddings(
+    exchanges: List[Dict[str, Any]],
+    name: str,
+    metadata: Dict[str, Any],
+    writer: Optional[store.UpsertBuffer] = None,
+) -> List[List[float]]:
+    """
+    Get and store the embeddings of an interview's exchanges: the
+    stored ones are looked up in one get, the rest embedded in as few
+    requests as the budgets allow and stored (see
+    get_and_store_embedding).
+
+    Returns:
+        List[List[float]]: One embedding vector per exchange, in order.
+    """
     print("Metadata:", metadata)
-    qs = exchange.get("question", "") or exchange.get("human", "")
+    questions = [exchange.get("question", "") or exchange.get("human", "") for exchange in exchanges]
 
     url = metadata.get("url", "")
-    id = "".join(c for c in f"{url}{qs[:20]}" if c.isalnum()).lower()
+    ids = ["".join(c for c in f"{url}{qs[:20]}" if c.isalnum()).lower() for qs in questions]
 
-    chroma_client = PersistentClient(path=f"data/{name}")
-    collection = chroma_client.get_or_create_collection(name)
+    backend = backend_for(name)
+    collection = store.writable_collection(name, backend)
 
-    stored_embedding = collection.get(ids=id).get("embeddings")
+    found: Dict[str, List[float]] = {}
+    for record_id in ids:
+        buffered = writer.pending(record_id) if writer else None
+        if buffered is not None:
+            found[record_id] = buffered
+    unknown = [record_id for record_id in dict.fromkeys(ids) if record_id not in found]
+    if unknown:
+        stored = collection.get(ids=unknown, include=["embeddings"])
+        stored_embeddings = stored.get("embeddings")
+        if stored_embeddings is not None and len(stored_embeddings):
+            print(f"{len(stored['ids'])} embedding(s) found in db")
+            for record_id, embedding in zip(stored["ids"], stored_embeddings):
+                found[record_id] = [float(v) for v in embedding]
 
-    if stored_embedding and len(stored_embedding):
-        print("Embedding found in db")
-        return list(stored_embedding[0])
+    # the first exchange of each id not stored yet
+    missing = {record_id: qs for record_id, qs in zip(ids, questions) if record_id not in found}
+    if not missing:
+        return [found[record_id] for record_id in ids]
 
     print("getting embeddings")
-    embedding = get_embedding(qs)
+    for batch in batch_by_budget(missing.items(), backend=backend):
+        found.update(zip([record_id for record_id, _ in batch], get_embeddings([qs for _, qs in batch], backend)))
 
     meta: Dict[str, Any] = (
         {
@@ -81,35 +371,275 @@ def get_and_store_embedding(
 
     # upsert, not add: add silently keeps the old record for an existing
     # id, which would leave pre-2.3 entries without date_num forever.
-    collection.upsert(ids=id, embeddings=embedding, documents=qs, metadatas=meta)
+    if writer:
+        for record_id, qs in missing.items():
+            writer.add(record_id, found[record_id], qs, meta)
+    else:
+        collection.upsert(
+            ids=list(missing),
+            embeddings=[found[record_id] for record_id in missing],
+            documents=list(missing.values()),
+            metadatas=[meta] * len(missing),
+        )
+
+    return [found[record_id] for record_id in ids]
 
-    return embedding
 
+ChunkRecord = Tuple[str, Dict[str, Any], str]
 
-def store_grounding_embeddings(name: str) -> None:
+# Page size when listing a collection's stored chunk ids.
+LIST_PAGE_SIZE = 5000
+
+
+def chunk_id(metadata: Dict[str, Any], document: str) -> str:
     """
-    Store grounding embeddings for a given name.
+    The content-hash id of a grounding chunk.
 
-    Args:
-        name (str): The name of the collection and file to process.
+    Derived from the source url and the chunk text, so posts sharing a
+    title no longer overwrite each other, and an unchanged chunk keeps
+    its id across runs (which is what lets `raft embed` skip it).
     """
-    chroma_client = PersistentClient(path=f"data/{name}")
-    collection = chroma_client.get_or_create_collection(name)
+    source = metadata.get("url") or metadata.get("title", "")
+    digest = hashlib.sha256(f"{source}\n{document}".encode("utf-8")).hexdigest()
+    return f"chunk-{digest[:32]}"
 
-    sourcefile = f"data/{name}_chunked.jsonl"
 
+def _chunk_records(
+    chunks: Iterable[Tuple[Dict[str, Any], str]],
+) -> Generator[Tuple[ChunkRecord, str], None, None]:
+    """
+    ((id, metadata, document), document) for each (metadata, document)
+    chunk -- the document travels with its key, so an embedded batch
+    can be upserted without a second pass over the chunks.
+    """
+    for metadata, document in chunks:
+        metadata["date_num"] = date_num(metadata.get("date"))
+        yield (chunk_id(metadata, document), metadata, document), document
+
+
+def _read_chunks(sourcefile: str) -> Generator[Tuple[Dict[str, Any], str], None, None]:
+    """The (metadata, document) chunks of a _chunked.jsonl file."""
     with open(sourcefile, "r") as f:
         for line in f:
             metadata, document = json.loads(line)
-            print(f"Storing {metadata['title']}")
-            metadata["date_num"] = date_num(metadata.get("date"))
-
-            embeddings = get_embedding(document)
-            # upsert so re-running embed refreshes existing chunks (and
-            # backfills date_num on collections from before 2.3).
-            collection.upsert(
-                ids=f"{metadata['title']}_part_{metadata['part']}",
-                embeddings=embeddings,
-                documents=document,
-                metadatas=metadata,
+            yield metadata, document
+
+
+def _stored_chunks(collection: Any) -> Dict[str, Dict[str, Any]]:
+    """
+    The grounding chunks in a collection: id -> its stored metadata,
+    the sources recorded for it by dedup included.
+
+    The collection also holds the interview questions ft:gen stores;
+    chunks are the records carrying chunker metadata (total_parts),
+    whatever their id scheme -- so pre-2.4 `{title}_part_{n}` ids are
+    found too, and replaced by their content-hash equivalents.
+    """
+    chunks = {}
+    offset = 0
+    while True:
+        page = collection.get(
+            include=["metadatas"], limit=LIST_PAGE_SIZE, offset=offset
+        )
+        for record_id, metadata in zip(page["ids"], page["metadatas"] or []):
+            if metadata and "total_parts" in metadata:
+                chunks[record_id] = metadata
+        if len(page["ids"]) < LIST_PAGE_SIZE:
+            return chunks
+        offset += LIST_PAGE_SIZE
+
+
+def store_grounding_embeddings(
+    name: str,
+    max_tokens: int = BATCH_MAX_TOKENS,
+    max_items: int = BATCH_MAX_ITEMS,
+    workers: int = EMBED_WORKERS,
+    backend: str = "",
+    write_batch_size: int = store.WRITE_BATCH_SIZE,
+    index: str = "",
+    precision: str = "",
+    chunks: Optional[Iterable[Tuple[Dict[str, Any], str]]] = None,
+    dedup_threshold: Optional[float] = None,
+) -> Dict[str, int]:
+    """
+    Sync a dataset's grounding collection with its _chunked.jsonl (or
+    with the (metadata, document) chunks given). A chunk file that is
+    missing or stale (see chunker.chunks_stale) is redone on the way,
+    as in chunk_and_embed.
+
+    Chunks are identified by content hash (see chunk_id): those already
+    stored are skipped, new ones are embedded in batches by concurrent
+    workers (see embed_in_batches) and upserted in file order, in write
+    batches of their own size, and stored chunks no longer in the file
+    are deleted. Interview questions stored by ft:gen are left alone.
+
+    With a dedup threshold, near-duplicate chunks are collapsed into
+    the first copy before embedding (see dedup.Deduplicator); the copy
+    kept records every copy's url in its "sources" metadata.
+
+    Written batches survive an interrupted run, and the next run only
+    embeds what is still missing.
+
+    Args:
+        name (str): The name of the collection and file to process.
+        max_tokens (int): Token budget per embeddings request.
+        max_items (int): Input count budget per embeddings request.
+        workers (int): Embedding requests in flight at once.
+        backend (str): Embedding backend to switch the dataset to (and
+            record in its meta); by default the recorded one is kept.
+        write_batch_size (int): Records per chroma upsert.
+        index (str): Retrieval backend to switch the dataset to ("chroma"
+            or "flat", see flat_index); the flat snapshot is rebuilt
+            after every sync of a dataset that uses it.
+        precision (str): Vector precision of the flat index to switch
+            the dataset to (float32, float16 or int8).
+        chunks (Iterable): The dataset's chunks, instead of reading
+            them from _chunked.jsonl (see chunk_and_embed).
+        dedup_threshold (float): Near-duplicate threshold to switch the
+            dataset to (0 < t <= 1, or 0 to keep every chunk).
+
+    Returns:
+        Dict[str, int]: Chunk counts: added, unchanged, removed, and
+            collapsed when deduplicating.
+    """
+    if backend:
+        get_backend(backend)  # unknown names fail before anything is written
+        state.update_meta(name, embedding_backend=backend)
+    if index:
+        if index not in store.RETRIEVAL_BACKENDS:
+            raise ValueError(
+                f"unknown retrieval backend {index!r} "
+                f"(available: {', '.join(store.RETRIEVAL_BACKENDS)})"
+            )
+        state.update_meta(name, retrieval_backend=index)
+    if precision:
+        if precision not in flat_index.PRECISIONS:
+            raise ValueError(
+                f"unknown precision {precision!r} "
+                f"(available: {', '.join(flat_index.PRECISIONS)})"
+            )
+        state.update_meta(name, index_precision=precision)
+    if dedup_threshold is not None:
+        if dedup_threshold:
+            dedup.Deduplicator(dedup_threshold)  # a bad threshold fails here
+        state.update_meta(name, dedup_threshold=dedup_threshold)
+    threshold = state.dedup_threshold(name)
+    duplicates = dedup.Deduplicator(threshold) if threshold else None
+    embedder = backend_for(name)
+    collection = store.writable_collection(name, embedder)
+
+    if chunks is None:
+        from .chunker import chunks_stale, stream_chunks
+
+        if chunks_stale(name):
+            hx.warn(
+                f"data/{name}_chunked.jsonl is missing, was cut with other "
+                f"chunk settings or misses new posts -- chunking "
+                f"data/{name}.jsonl first"
             )
+            chunks = prefetch(stream_chunks(name), CHUNK_QUEUE_SIZE)
+        else:
+            chunks = _read_chunks(f"data/{name}_chunked.jsonl")
+
+    existing = _stored_chunks(collection)
+    current: set = set()
+    # unchanged chunks whose metadata (a date, a title) changed: updated
+    # in place, without embedding them again
+    retagged: Dict[str, Dict[str, Any]] = {}
+    counts = {"added": 0, "unchanged": 0, "removed": 0}
+
+    def pending() -> Generator[Tuple[ChunkRecord, str], None, None]:
+        for record, document in _chunk_records(chunks):
+            if record[0] in current:
+                continue  # the same chunk twice in the file
+            if duplicates is not None and duplicates.add(
+                record[0], document, record[1].get("url") or ""
+            ):
+                continue
+            current.add(record[0])
+            if record[0] in existing:
+                counts["unchanged"] += 1
+                stored = {k: v for k, v in existing[record[0]].items() if k != "sources"}
+                if stored != {k: v for k, v in record[1].items() if v is not None}:
+                    retagged[record[0]] = record[1]
+            else:
+                yield record, document
+
+    with store.upsert_buffer(name, embedder, write_batch_size) as writer:
+        for batch in embed_in_batches(
+            pending(), max_tokens, max_items, workers, backend=embedder
+        ):
+            for (record_id, metadata, document), embedding in batch:
+                writer.add(record_id, embedding, document, metadata)
+            counts["added"] += len(batch)
+            hx.say(f"embedded {counts['added']} new chunk(s)")
+
+    stale = sorted(set(existing) - current)
+    step = store.client(name).get_max_batch_size()
+    for start in range(0, len(stale), step):
+        collection.delete(ids=stale[start : start + step])
+    counts["removed"] = len(stale)
+
+    # sources change after the kept copy is written: its duplicates
+    # come later in the stream
+    sources = {
+        record_id: duplicates.sources(record_id) if duplicates is not None else ""
+        for record_id in current
+    }
+    changed = sorted(
+        r for r in current
+        if r in retagged or sources[r] != existing.get(r, {}).get("sources", "")
+    )
+
+    def updated(record_id: str) -> Dict[str, Any]:
+        metadata: Dict[str, Any] = {}
+        if record_id in retagged:
+            # chroma merges metadata on update: None drops a key
+            metadata = {k: None for k in existing[record_id]}
+            metadata.update(retagged[record_id])
+        metadata["sources"] = sources[record_id] or None
+        return metadata
+
+    for start in range(0, len(changed), step):
+        part = changed[start : start + step]
+        collection.update(ids=part, metadatas=[updated(r) for r in part])
+    if retagged:
+        hx.say(f"updated the metadata of {len(retagged)} unchanged chunk(s)")
+    if duplicates is not None:
+        counts["collapsed"] = duplicates.collapsed
+
+    if state.retrieval_backend(name) == "flat":
+        indexed = store.rebuild_flat_index(name)
+        hx.say(
+            f"flat index: {indexed} record(s) in data/{name}/flat "
+            f"({state.index_precision(name)})"
+        )
+
+    collapsed = f", {counts['collapsed']} near-duplicate(s) collapsed" if "collapsed" in counts else ""
+    hx.ok(
+        f"data/{name}: {counts['added']} chunk(s) added, "
+        f"{counts['unchanged']} unchanged, {counts['removed']} removed{collapsed}"
+    )
+    cache = embedding_cache() if embedder.remote else None
+    if cache is not None:
+        hx.say(f"embedding cache: {cache.hits} hit(s), {cache.misses} miss(es)")
+    return counts
+
+
+def chunk_and_embed(name: str, **kwargs: Any) -> Dict[str, int]:
+    """
+    `raft chunk` and `raft embed` in one streaming pass.
+
+    Chunks of data/{name}.jsonl flow through a bounded queue straight
+    into embedding and upserts, so the tokenizer works while requests
+    are in flight; data/{name}_chunked.jsonl is still written on the
+    way, and a later plain `raft embed` reads it as before. Memory stays
+    bounded by the queue, the in-flight batches and the write buffer,
+    whatever the size of the corpus.
+
+    Takes the keyword arguments of store_grounding_embeddings.
+    """
+    from .chunker import stream_chunks
+
+    chunks = prefetch(stream_chunks(name), CHUNK_QUEUE_SIZE)
+    return store_grounding_embeddings(name, chunks=chunks, **kwargs)
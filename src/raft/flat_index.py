@@ -0,0 +1,417 @@
+"""
+An exact, brute-force retrieval index over a snapshot of a dataset's
+collection, memory-mapped from NumPy files.
+
+For personas up to a few hundred thousand chunks, one matrix-vector
+product over a float32 matrix beats chroma's cold start and per-query
+overhead, and answers exactly rather than approximately. The files are
+opened with mmap, so any number of serve processes share the same pages
+through the OS cache instead of each loading the vectors.
+
+Vectors can be stored at reduced precision (`raft embed --precision`):
+float16 halves them, int8 -- scalar quantization with one scale per
+vector -- quarters them. The scan then runs over the compact matrix,
+and the best candidates are re-scored exactly against a float32 copy
+that stays on disk: only their rows are ever paged in.
+
+Layout of data/{name}/flat/:
+
+- vectors.npy   (N, D) embeddings, in the index's precision
+- scales.npy    float32 (N,) int8 only: vector = codes * scale
+- full.npy      float32 (N, D) reduced precision only: for re-scoring
+- norms.npy     float32 (N,) squared norms of vectors.npy as searched
+- date_num.npy  int32 (N,) the earlier-writings filter key; -1 where a
+                record has no date_num at all (pre-2.3 embeddings)
+- records.jsonl one [id, document, metadata] per row, read on demand
+- offsets.npy   int64 (N + 1,) byte offsets of the rows in records.jsonl
+- index.json    count, dimensions, precision, embedding model, date_sorted
+
+Rows are sorted by date_num (undated ones first). The earlier-writings
+filter, date_num < before, is then a contiguous run of rows found by
+binary search, and a date-bounded query scans only the eligible vectors
+instead of scoring every row and masking most of them out. Snapshots
+built before that (no date_sorted in index.json) are still read, with
+the mask.
+
+The snapshot is rebuilt by `raft embed` for datasets that use it, and
+by ft:gen when it is behind the collection. ft:gen writes its questions
+into the collection; the FlatIndex it queries also searches them (see
+extend) until the snapshot is rebuilt at the end of the run.
+"""
+
+import json
+import mmap
+import os
+import shutil
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Page size when reading the collection into a snapshot.
+SNAPSHOT_PAGE_SIZE = 5000
+
+PRECISIONS = ("float32", "float16", "int8")
+
+# Reduced precision: candidates re-scored in float32, per result wanted.
+RESCORE_FACTOR = 4
+
+# Rows dequantized at a time while scanning, bounding the float32
+# temporaries to SCAN_BLOCK x D.
+SCAN_BLOCK = 65536
+
+
+def index_dir(name: str) -> str:
+    """The dataset's snapshot directory."""
+    return os.path.abspath(f"data/{name}/flat")
+
+
+def quantize(matrix: np.ndarray, precision: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    The stored form of float32 vectors: (values, per-vector scales). For
+    int8 each row is scaled so its largest component maps to 127.
+    """
+    if precision == "float32":
+        return matrix, None
+    if precision == "float16":
+        return matrix.astype(np.float16), None
+    # int8
+    scales = np.abs(matrix).max(axis=1) / 127.0 if matrix.size else np.zeros(len(matrix))
+    scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+    codes = np.rint(matrix / scales[:, None]).clip(-127, 127).astype(np.int8)
+    return codes, scales
+
+
+def build_flat_index(
+    name: str, collection: Any, precision: str = "float32", path: str = ""
+) -> int:
+    """
+    Snapshot a collection into data/{name}/flat/ (or path), storing the
+    vectors at the given precision (see PRECISIONS).
+
+    The new snapshot is written beside the old one and swapped in when
+    complete; processes still mapping the old files keep reading them.
+
+    Returns:
+        int: The number of records indexed.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(
+            f"unknown precision {precision!r} (available: {', '.join(PRECISIONS)})"
+        )
+    target = path or index_dir(name)
+    building = f"{target}.building"
+    shutil.rmtree(building, ignore_errors=True)
+    os.makedirs(building)
+
+    # Pass one: records and raw float32 rows, in collection order,
+    # streamed to disk a page at a time.
+    dimensions = 0
+    dates: List[int] = []
+    offsets: List[int] = []
+    unsorted = os.path.join(building, "records.unsorted")
+    unsorted_vectors = os.path.join(building, "vectors.unsorted")
+    with open(unsorted, "wb") as records, open(unsorted_vectors, "wb") as raw:
+        offset = 0
+        while True:
+            page = collection.get(
+                include=["embeddings", "documents", "metadatas"],
+                limit=SNAPSHOT_PAGE_SIZE,
+                offset=offset,
+            )
+            ids = page["ids"]
+            if not ids:
+                break
+            page_vectors = np.asarray(page["embeddings"], dtype=np.float32)
+            dimensions = page_vectors.shape[1]
+            raw.write(page_vectors.tobytes())
+            for record_id, document, metadata in zip(
+                ids, page["documents"], page["metadatas"]
+            ):
+                metadata = metadata or {}
+                dates.append(int(metadata.get("date_num", -1)))
+                offsets.append(records.tell())
+                line = json.dumps([record_id, document, metadata]) + "\n"
+                records.write(line.encode("utf-8"))
+            if len(ids) < SNAPSHOT_PAGE_SIZE:
+                break
+            offset += SNAPSHOT_PAGE_SIZE
+        offsets.append(records.tell())
+
+    # rows (and so records.jsonl) in date_num order; see the module doc
+    order = np.argsort(np.asarray(dates, dtype=np.int32), kind="stable")
+    sorted_offsets = [0]
+    with open(unsorted, "rb") as source, open(os.path.join(building, "records.jsonl"), "wb") as records:
+        for row in order:
+            source.seek(offsets[row])
+            records.write(source.read(offsets[row + 1] - offsets[row]))
+            sorted_offsets.append(records.tell())
+    os.remove(unsorted)
+    offsets = sorted_offsets
+    dates = [dates[row] for row in order]
+
+    # Pass two: the sorted rows, a page at a time, into memory-mapped
+    # .npy files -- only a page of the corpus is ever in memory.
+    count = len(dates)
+    shape = (count, dimensions)
+
+    def create(file: str, dtype: Any, file_shape: Tuple[int, ...]) -> np.ndarray:
+        path = os.path.join(building, f"{file}.npy")
+        return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=file_shape)
+
+    stored_type = {"float32": np.float32, "float16": np.float16, "int8": np.int8}[precision]
+    outputs = {"vectors": create("vectors", stored_type, shape)}
+    if precision == "int8":
+        outputs["scales"] = create("scales", np.float32, (count,))
+    if precision != "float32":
+        outputs["full"] = create("full", np.float32, shape)
+    outputs["norms"] = create("norms", np.float32, (count,))
+    if count:
+        source_rows = np.memmap(unsorted_vectors, dtype=np.float32, mode="r", shape=shape)
+        for start in range(0, count, SNAPSHOT_PAGE_SIZE):
+            end = min(start + SNAPSHOT_PAGE_SIZE, count)
+            page_vectors = np.asarray(source_rows[order[start:end]])
+            stored, scales = quantize(page_vectors, precision)
+            searched = _dequantize(stored, scales)
+            outputs["vectors"][start:end] = stored
+            if scales is not None:
+                outputs["scales"][start:end] = scales
+            if precision != "float32":
+                outputs["full"][start:end] = page_vectors
+            outputs["norms"][start:end] = np.einsum("ij,ij->i", searched, searched)
+        del source_rows
+    for output in outputs.values():
+        output.flush()
+    del outputs
+    os.remove(unsorted_vectors)
+    np.save(os.path.join(building, "date_num.npy"), np.asarray(dates, dtype=np.int32))
+    np.save(os.path.join(building, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+    with open(os.path.join(building, "index.json"), "w") as f:
+        json.dump(
+            {
+                "count": count,
+                "dimensions": int(dimensions),
+                "precision": precision,
+                "embedding_model": (collection.metadata or {}).get("embedding_model", ""),
+                "date_sorted": True,
+            },
+            f,
+        )
+
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(building, target)
+    return len(dates)
+
+
+def _dequantize(values: np.ndarray, scales: Optional[np.ndarray]) -> np.ndarray:
+    """Stored rows back as float32."""
+    matrix = np.asarray(values, dtype=np.float32)
+    return matrix * scales[:, None] if scales is not None else matrix
+
+
+class FlatIndex:
+    """
+    A read-only snapshot, answering the subset of chroma's
+    Collection.query that retrieval uses.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "index.json")) as f:
+            self.info: Dict[str, Any] = json.load(f)
+        self.precision: str = self.info.get("precision", "float32")
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.scales = (
+            np.load(os.path.join(path, "scales.npy"), mmap_mode="r")
+            if self.precision == "int8"
+            else None
+        )
+        self.full = (
+            np.load(os.path.join(path, "full.npy"), mmap_mode="r")
+            if self.precision != "float32"
+            else self.vectors
+        )
+        self.norms = np.load(os.path.join(path, "norms.npy"), mmap_mode="r")
+        self.date_num = np.load(os.path.join(path, "date_num.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        # Mapped like the arrays, and the file closed right away: the
+        # index holds no descriptor, so a replaced snapshot (see
+        # store.reader) is released with the last reference to it.
+        self._records: Any = b""
+        with open(os.path.join(path, "records.jsonl"), "rb") as f:
+            if os.fstat(f.fileno()).st_size:
+                self._records = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # Re-score reduced-precision candidates in float32 (the recall
+        # benchmark turns this off to measure what it buys).
+        self.rescore = True
+        self.date_sorted = bool(self.info.get("date_sorted"))
+        # Records written to the collection after the snapshot (see
+        # extend): float32 vectors, their squared norms, date_num and
+        # [id, document, metadata].
+        self._tail_lock = threading.Lock()
+        self._tail_vectors = np.zeros((0, int(self.info.get("dimensions") or 0)), dtype=np.float32)
+        self._tail_norms = np.zeros(0, dtype=np.float32)
+        self._tail_dates = np.zeros(0, dtype=np.int64)
+        self._tail_records: List[List[Any]] = []
+
+    @property
+    def dated(self) -> bool:
+        """Whether any record carries date_num (see MemoryManager)."""
+        return bool(len(self.date_num) and (self.date_num >= 0).any())
+
+    def count(self) -> int:
+        return int(self.info["count"])
+
+    @property
+    def appended(self) -> int:
+        """Records added since the snapshot (see extend)."""
+        return len(self._tail_records)
+
+    def _record(self, row: int) -> List[Any]:
+        # a slice: no shared file position, so threads can query at once
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return json.loads(self._records[start:end])
+
+    def _bounds(
+        self, where: Optional[Dict[str, Any]]
+    ) -> Tuple[int, int, Optional[np.ndarray]]:
+        """
+        The rows a {"date_num": {"$lt": n}} filter leaves: a [start,
+        end) run of a date-sorted snapshot, or all rows and a mask of
+        those passing in an older one. As in chroma, records without
+        date_num never pass it.
+        """
+        count = self.count()
+        if not where:
+            return 0, count, None
+        bound = where["date_num"]["$lt"]
+        if self.date_sorted:
+            # undated rows (-1) sort first
+            start = int(np.searchsorted(self.date_num, 0, side="left"))
+            end = int(np.searchsorted(self.date_num, bound, side="left"))
+            return start, max(start, end), None
+        return 0, count, (self.date_num >= 0) & (self.date_num < bound)
+
+    def extend(
+        self,
+        ids: List[str],
+        embeddings: List[List[float]],
+        documents: List[str],
+        metadatas: List[Dict[str, Any]],
+    ) -> None:
+        """
+        Also search records written to the collection since the
+        snapshot (ft:gen's questions), exactly and unsorted, until the
+        snapshot is rebuilt. Not persisted.
+        """
+        if not ids:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        dates = [int((metadata or {}).get("date_num", -1)) for metadata in metadatas]
+        with self._tail_lock:
+            if not len(self._tail_vectors):
+                self._tail_vectors = self._tail_vectors.reshape(0, vectors.shape[1])
+            self._tail_vectors = np.concatenate([self._tail_vectors, vectors])
+            self._tail_norms = np.concatenate([self._tail_norms, np.einsum("ij,ij->i", vectors, vectors)])
+            self._tail_dates = np.concatenate([self._tail_dates, np.asarray(dates, dtype=np.int64)])
+            self._tail_records.extend(
+                [record_id, document, metadata or {}]
+                for record_id, document, metadata in zip(ids, documents, metadatas)
+            )
+
+    def _tail(
+        self, queries: np.ndarray, where: Optional[Dict[str, Any]]
+    ) -> Tuple[np.ndarray, List[List[Any]]]:
+        """Squared L2 distances (queries x tail records) and the records; inf where filtered out."""
+        with self._tail_lock:
+            vectors, norms, dates = self._tail_vectors, self._tail_norms, self._tail_dates
+            records = list(self._tail_records)
+        # as in _scan: one matmul, no queries x records x dimensions temporary
+        query_norms = np.einsum("ij,ij->i", queries, queries)[:, None]
+        distances = norms - 2.0 * (queries @ vectors.T) + query_norms
+        if where:
+            bound = where["date_num"]["$lt"]
+            distances[:, ~((dates >= 0) & (dates < bound))] = np.inf
+        return distances, records
+
+    def query(
+        self,
+        query_embeddings: List[List[float]],
+        n_results: int = 10,
+        include: Optional[List[str]] = None,
+        where: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """
+        The nearest records by squared L2 distance (chroma's default
+        space), in chroma's result shape: one list per query embedding.
+        """
+        include = include or ["metadatas", "documents", "distances"]
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        start, end, mask = self._bounds(where)
+        results: Dict[str, List[List[Any]]] = {
+            "ids": [], "documents": [], "metadatas": [], "distances": []
+        }
+        distances = self._scan(queries, start, end)
+        if mask is not None:
+            distances[:, ~mask] = np.inf
+        tail_distances, tail_records = (
+            self._tail(queries, where) if self._tail_records else (None, [])
+        )
+        exact = self.precision == "float32" or not self.rescore
+        wanted = n_results if exact else n_results * RESCORE_FACTOR
+        for i, query in enumerate(queries):
+            row_distances = distances[i]
+            k = min(wanted, int(np.isfinite(row_distances).sum()))
+            rows = np.zeros(0, dtype=np.int64)
+            if k:
+                rows = np.argpartition(row_distances, k - 1)[:k]
+            if exact:
+                scores = row_distances[rows]
+            else:
+                # sorted rows: sequential reads of the float32 copy
+                rows = np.sort(rows)
+                difference = np.asarray(self.full[start + rows], dtype=np.float32) - query
+                scores = np.einsum("ij,ij->i", difference, difference)
+            # (distance, snapshot row or None, tail record)
+            found = [(float(scores[j]), start + int(rows[j]), None) for j in range(len(rows))]
+            if tail_distances is not None:
+                tail_row = tail_distances[i]
+                k = min(n_results, int(np.isfinite(tail_row).sum()))
+                if k:
+                    found += [
+                        (float(tail_row[j]), None, tail_records[j])
+                        for j in np.argpartition(tail_row, k - 1)[:k]
+                    ]
+            found.sort(key=lambda hit: hit[0])
+            found = found[:n_results]
+            records = [record if row is None else self._record(row) for _, row, record in found]
+            results["ids"].append([r[0] for r in records])
+            results["documents"].append([r[1] for r in records])
+            results["metadatas"].append([r[2] for r in records])
+            results["distances"].append([distance for distance, _, _ in found])
+        return {
+            key: value
+            for key, value in results.items()
+            if key == "ids" or key in include
+        }
+
+    def _scan(self, queries: np.ndarray, first: int, last: int) -> np.ndarray:
+        """
+        Squared L2 distances (queries x rows first to last) over the
+        stored vectors; column j is row first + j.
+        """
+        distances = np.empty((len(queries), last - first), dtype=np.float32)
+        query_norms = np.einsum("ij,ij->i", queries, queries)[:, None]
+        for start in range(first, last, SCAN_BLOCK):
+            end = min(start + SCAN_BLOCK, last)
+            # ||q - x||^2 = ||x||^2 - 2 q.x + ||q||^2, for the block's
+            # rows and every query in one matmul
+            products = queries @ np.asarray(self.vectors[start:end], dtype=np.float32).T
+            if self.scales is not None:
+                products *= self.scales[start:end]
+            distances[:, start - first : end - first] = self.norms[start:end] - 2.0 * products + query_norms
+        return distances
+
+    def close(self) -> None:
+        if isinstance(self._records, mmap.mmap):
+            self._records.close()
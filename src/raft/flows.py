@@ -28,7 +28,7 @@ from typing import List
 
 import requests
 
-from . import embeddings_helpers, files_helper, generate_finetune, hx, oai_finetune
+from . import embeddings_helpers, generate_finetune, hx, oai_finetune
 from . import serve, sources, state, substack_embeddings
 from .convo_structurer import import_conversation_file, import_text_source_file
 from .hf_finetune import (
@@ -234,8 +234,7 @@ def phase_prep(name: str) -> None:
 
     if status["corpus_docs"]:
         if confirm("Chunk + embed the grounding corpus?"):
-            files_helper.chunker(name)
-            embeddings_helpers.store_grounding_embeddings(name)
+            embeddings_helpers.chunk_and_embed(name)
     else:
         hx.warn("no grounding corpus -- the finetune examples will carry no memories")
 
@@ -388,8 +387,7 @@ def phase_eval(name: str) -> None:
         manager = MemoryManager(name, {})
         for question in questions:
             hx.step(question)
-            serve.show_context(name, question)
-            answer = manager.ask_question(question, model=model)
+            answer = serve.answer_turn(manager, name, question, model)
             print(f"\nQ: {question}\nA: {answer}\n")
         ran_something = True
 
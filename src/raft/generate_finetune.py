@@ -1,7 +1,7 @@
 import json
-import time
 from typing import Any
-from .memories import MemoryManager, MetaDataKeyEnum
+from . import store
+from .memories import MemoryManager, MetaDataKeyEnum, summary_cache
 from .files_helper import begin_json_file, end_json_file, write_context_to_file
 
 
@@ -23,28 +23,36 @@ def process_transcripts(name: str, suffix: str, is_benchmark: bool) -> None:
     target_file = f"{name}_{'benchmark' if is_benchmark else 'finetune'}.json"
     index = suffix if isinstance(suffix, int) else 1
     metadata: dict[MetaDataKeyEnum, Any] = {
-        MetaDataKeyEnum[key]: interview_data[key]
+        MetaDataKeyEnum(key): interview_data[key]
         for key in ["participants", "date", "url"]
     }
     memory_manager = MemoryManager(name, metadata)
 
-    write_context_to_file(target_file, {"metadata": metadata}, index, 0)
-    prev_answer = ""
+    write_context_to_file(
+        target_file, {"metadata": {k.value: v for k, v in metadata.items()}}, index, 0
+    )
 
-    for j, exchange in enumerate(interview_data["exchanges"]):
-        question, answer = exchange
+    # Retrieval (which stores each question) runs in order; the
+    # exchanges' summaries are made concurrently (see
+    # AsyncMemoryManager.summarize_exchanges) and written in order.
+    exchanges = interview_data["exchanges"]
+    try:
+        summaries = memory_manager.summarize_exchanges(exchanges)
+        for j, (exchange, similar_memories) in enumerate(zip(exchanges, summaries)):
+            question, answer = exchange
 
-        context = {"question": question, "answer": answer}
+            context = {"question": question, "answer": answer}
 
-        similar_memories = memory_manager.get_similar_and_summarize(
-            exchange, prev_answer
-        )
-        if len(similar_memories) > 0:
-            context["similar_memories"] = similar_memories
+            if len(similar_memories) > 0:
+                context["similar_memories"] = similar_memories
 
-        write_context_to_file(target_file, {"example": context}, index, j + 1)
-
-        prev_answer = answer
+            write_context_to_file(target_file, {"example": context}, index, j + 1)
+    finally:
+        # the transcript's questions are written in one batch, also when
+        # generation stops halfway
+        memory_manager.flush()
+    if memory_manager.gated:
+        print(f"similarity gate: {memory_manager.gated} distant extract(s) not summarized")
 
 
 def generate_finetune(name: str) -> None:
@@ -54,6 +62,9 @@ def generate_finetune(name: str) -> None:
     Args:
         name (str): The name of the dataset.
     """
+    # a flat index holding the whole collection serves retrieval; the
+    # questions stored along the way are snapshotted at the end
+    store.refresh_flat_index(name)
     begin_json_file(f"{name}_finetune")
     i = 1
     while True:
@@ -63,11 +74,14 @@ def generate_finetune(name: str) -> None:
         except FileNotFoundError:
             print(f"file #{i} not found")
             break
-        time.sleep(2)
         i += 1
 
-    end_json_file(name)
+    end_json_file(f"{name}_finetune")
+    store.refresh_flat_index(name)
     print(f"Generic finetune file generated in: data/{name}_finetune.json")
+    cache = summary_cache()
+    if cache is not None:
+        print(f"summary cache: {cache.hits} hit(s), {cache.misses} miss(es)")
 
 
 def generate_benchmark(name: str) -> None:
@@ -77,7 +91,9 @@ def generate_benchmark(name: str) -> None:
     Args:
         name (str): The name of the dataset.
     """
+    store.refresh_flat_index(name)
     begin_json_file(f"{name}_benchmark")
     process_transcripts(name, "benchmark", True)
     end_json_file(f"{name}_benchmark")
+    store.refresh_flat_index(name)
     print("Done!")
@@ -1,14 +1,18 @@
 from typing import List, Dict, Union, Any
 from enum import Enum
+import asyncio
+import glob
+import hashlib
+import json
+import math
 import os
-import time
 import re
+import threading
+import weakref
 from datetime import datetime
 
-from concurrent.futures import ThreadPoolExecutor
-from chromadb import PersistentClient
-import tiktoken
-from openai import OpenAI
+import numpy as np
+from openai import AsyncOpenAI
 from openai.types.chat import (
     ChatCompletionMessageParam,
     ChatCompletionSystemMessageParam,
@@ -16,13 +20,215 @@ from openai.types.chat import (
     ChatCompletionFunctionMessageParam,
 )
 
+from . import aio
 from . import hx
-from .prompt_manager import PromptManager
-from .embeddings_helpers import get_and_store_embedding, get_embedding
+from . import state
+from . import store as vector_store
+from .cache import SqliteLRUCache
+from .ratelimit import AsyncAdaptiveConcurrency, call_with_retries_async
+from .prompt_manager import SUMMARY_MODEL, SUMMARY_PROMPT_VERSION, AsyncPromptManager
+from .embeddings_helpers import backend_for, get_and_store_embeddings, get_embedding, get_embeddings
+from .flat_index import FlatIndex
 from .sources import date_num
 
-MAX_EMBEDDING_LENGTH = 2048
-encoding = tiktoken.encoding_for_model("gpt-4-turbo")
+# Memory summaries already paid for, keyed by everything the summarizer
+# sees (see summary_key), "skip" verdicts included: regenerating a
+# dataset only asks about new or changed combinations.
+# RAFT_SUMMARY_CACHE_MB=0 turns the cache off.
+SUMMARY_CACHE_PATH = "data/summary_cache.sqlite3"
+SUMMARY_CACHE_MB = int(os.environ.get("RAFT_SUMMARY_CACHE_MB", "256"))
+
+# Summarizer calls in flight: adapted between the bounds by how the API
+# copes (see ratelimit.AdaptiveConcurrency), starting from the initial.
+SUMMARY_MIN_CONCURRENCY = int(os.environ.get("RAFT_SUMMARY_MIN_CONCURRENCY", "1"))
+SUMMARY_MAX_CONCURRENCY = int(os.environ.get("RAFT_SUMMARY_MAX_CONCURRENCY", "16"))
+SUMMARY_CONCURRENCY = int(os.environ.get("RAFT_SUMMARY_CONCURRENCY", "4"))
+
+# Summarize an exchange's memories in one request returning a JSON array
+# (see AsyncPromptManager.summarize_memories) rather than one request each.
+# RAFT_SUMMARY_BATCH=0 goes back to a request per memory.
+SUMMARY_BATCHED = os.environ.get("RAFT_SUMMARY_BATCH", "1") != "0"
+
+# Exchanges (ft:gen) or questions (AsyncMemoryManager.answer_questions)
+# summarized or answered at once; the summarizer calls they make are
+# paced by summary_limiter.
+EXCHANGES_IN_FLIGHT = int(os.environ.get("RAFT_EXCHANGES_IN_FLIGHT", "8"))
+
+# Extracts farther from the question than the dataset's max distance
+# (`--max-distance`, squared L2 as the store reports it) are not
+# summarized: they would come back "skip" anyway. "auto" calibrates it
+# on the dataset's own interview questions (up to GATE_QUESTIONS of
+# them): the GATE_PERCENTILE-th percentile of the distances to the
+# extracts retrieval returns for them. Questions sit much farther from
+# chunks than chunks from each other, so only questions measure the
+# distances the gate is applied to. An auto gate always keeps the
+# nearest extract.
+GATE_PERCENTILE = float(os.environ.get("RAFT_GATE_PERCENTILE", "75"))
+GATE_QUESTIONS = 64
+
+_summary_caches: Dict[str, SqliteLRUCache] = {}
+_summary_caches_lock = threading.Lock()
+_summary_limiters: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+_summary_limiters_lock = threading.Lock()
+
+
+def summary_limiter() -> AsyncAdaptiveConcurrency:
+    """
+    The concurrency limit for summarizer calls on the running event
+    loop -- outside one, on the aio loop every synchronous caller
+    shares. Its slots can only be awaited on the loop they belong to,
+    so a caller running its own loop (asyncio.run) gets its own limit.
+    """
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = aio.loop()
+    with _summary_limiters_lock:
+        if running not in _summary_limiters:
+            _summary_limiters[running] = AsyncAdaptiveConcurrency(
+                SUMMARY_MIN_CONCURRENCY, SUMMARY_MAX_CONCURRENCY, SUMMARY_CONCURRENCY
+            )
+        return _summary_limiters[running]
+
+
+def summary_cache() -> Union[SqliteLRUCache, None]:
+    """
+    The on-disk summary cache under the current data/ directory, or
+    None when disabled.
+    """
+    if SUMMARY_CACHE_MB <= 0:
+        return None
+    path = os.path.abspath(SUMMARY_CACHE_PATH)
+    with _summary_caches_lock:
+        if path not in _summary_caches:
+            _summary_caches[path] = SqliteLRUCache(path, SUMMARY_CACHE_MB * 1024 * 1024)
+        return _summary_caches[path]
+
+
+def summary_key(
+    document: str,
+    question: str,
+    prev_answer: str,
+    author: str,
+    useful_check: bool,
+    batched: bool = False,
+) -> str:
+    """
+    The cache key of one memory's summary, by the single-memory prompt
+    or the batched one (which word it differently).
+    """
+    fields = [
+        SUMMARY_MODEL, SUMMARY_PROMPT_VERSION, author, useful_check,
+        question, prev_answer, document,
+    ]
+    if batched:
+        fields.append("batched")
+    digest = hashlib.sha256(json.dumps(fields).encode("utf-8")).hexdigest()
+    return f"{SUMMARY_MODEL}:{digest}"
+
+
+def _summarized(memory: Dict[str, Any], summary: str) -> Dict[str, str]:
+    """A memory's {"date", "memory"} entry: empty when the verdict is skip."""
+    if re.sub(r"\W+", "", summary).lower() != "skip":
+        return {"date": memory["date"], "memory": summary}
+    return {"date": memory["date"], "memory": ""}
+
+
+def _useful_memories(summaries: List[Dict[str, str]]) -> str:
+    """The summaries worth passing on, dated, as one text."""
+    useful_memories = ""
+    for summary in summaries:
+        if len(summary["memory"]):
+            useful_memories += (
+                f"""from {summary['date']}: \n {summary["memory"]}\n\n"""
+            )
+    return useful_memories
+
+
+def calibration_questions(name: str) -> List[str]:
+    """
+    Up to GATE_QUESTIONS of a dataset's interview questions (from its
+    transcripts and test questions), spread evenly over them.
+    """
+    questions: List[str] = []
+    for path in sorted(glob.glob(f"data/{name}_transcript_*.json")):
+        try:
+            with open(path) as f:
+                exchanges = json.load(f).get("exchanges") or []
+        except (OSError, ValueError, AttributeError):
+            continue
+        questions.extend(exchange[0] for exchange in exchanges if exchange and exchange[0])
+    questions.extend(state.test_questions(name))
+    questions = list(dict.fromkeys(questions))
+    if len(questions) <= GATE_QUESTIONS:
+        return questions
+    picks = np.unique(np.linspace(0, len(questions) - 1, GATE_QUESTIONS).astype(np.int64))
+    return [questions[i] for i in picks]
+
+
+def calibrate_max_distance(
+    source: Any, embeddings: List[List[float]], percentile: float = GATE_PERCENTILE
+) -> float:
+    """
+    The percentile of the squared L2 distances from the question
+    embeddings to the extracts a store (a chroma collection or a
+    FlatIndex) returns for them; inf without questions or records. A
+    question already stored is not counted as its own extract.
+    """
+    if not embeddings or not source.count():
+        return math.inf
+    # one more than retrieval's five, for the question itself
+    results = source.query(
+        query_embeddings=embeddings, n_results=min(6, source.count()), include=["distances"]
+    )
+    distances = [
+        d for row in results["distances"] for d in [d for d in row if d > 1e-9][:5]
+    ]
+    if not distances:
+        return math.inf
+    return float(np.percentile(np.asarray(distances, dtype=np.float64), percentile))
+
+
+def gate_distance(name: str, source: Any, embedder: Any = None) -> float:
+    """
+    The distance beyond which a dataset's extracts are not summarized
+    (inf: no gate). An "auto" gate is calibrated once per store size and
+    question count, and recorded in the meta; until the dataset has
+    interview questions it does not gate.
+    """
+    setting = state.max_distance(name)
+    if setting != "auto":
+        return float(setting) or math.inf
+    if source is None:
+        return math.inf
+    questions = calibration_questions(name)
+    count = source.count()
+    recorded = state.load_meta(name).get("max_distance_calibration") or {}
+    if (
+        recorded.get("count") == count
+        and recorded.get("questions") == len(questions)
+        and recorded.get("percentile") == GATE_PERCENTILE
+    ):
+        return float(recorded["distance"])
+    embeddings = get_embeddings(questions, embedder or backend_for(name)) if questions else []
+    distance = calibrate_max_distance(source, embeddings)
+    if math.isinf(distance):
+        return distance
+    state.update_meta(
+        name,
+        max_distance_calibration={
+            "count": count,
+            "questions": len(questions),
+            "percentile": GATE_PERCENTILE,
+            "distance": distance,
+        },
+    )
+    hx.say(
+        f"similarity gate calibrated: max distance {distance:.4g} "
+        f"({GATE_PERCENTILE:g}th percentile from {len(questions)} interview "
+        f"question(s) to their extracts)"
+    )
+    return distance
 
 
 class MetaDataKeyEnum(Enum):
@@ -37,7 +243,10 @@ ExtractedDataType = List[Dict[str, Union[str, datetime, int, float, bool]]]
 
 
 class MemoryManager:
-    """Manages the retrieval and summarization of memories."""
+    """
+    Manages the retrieval and summarization of memories. Retrieval runs
+    here; summarizing and answering wait for AsyncMemoryManager.
+    """
 
     def __init__(self, name: str, metadata: Dict[MetaDataKeyEnum, Any]):
         """
@@ -48,15 +257,7 @@ class MemoryManager:
             metadata (Dict[MetaDataKeyEnum, Any]): Metadata for the collection.
         """
         self.name = name
-        # The existence check keeps a missing dataset missing: merely
-        # constructing a PersistentClient would create the chroma dir.
-        self.collection = None
-        if os.path.exists(f"data/{name}/chroma.sqlite3"):
-            try:
-                chroma_client = PersistentClient(path=f"data/{name}")
-                self.collection = chroma_client.get_collection(name)
-            except Exception:
-                pass
+        self.collection = vector_store.collection(name)
         if self.collection is None:
             # Degrade to no memories rather than not running at all, but
             # never silently: ungrounded output looks just like grounded.
@@ -64,44 +265,96 @@ class MemoryManager:
                 f"no grounding collection for {name} -- proceeding without "
                 f"memories (chunk + embed the corpus to enable retrieval)"
             )
+        # What store=False retrieval queries: the flat index when the
+        # dataset uses one (see store.reader), else the same collection.
+        self.reader = vector_store.reader(name) if self.collection is not None else None
         self._dated: Union[bool, None] = None
-        self.encoder = encoding.encode
+        self._current: Union[bool, None] = None
+        self.embedder = backend_for(name)
+        # Questions stored while generating are written in batches;
+        # see flush().
+        self.writer: Union[vector_store.UpsertBuffer, None] = None
+        # Storing a question and retrieving for it happen together, one
+        # caller at a time, whichever thread or event loop it runs on.
+        self._storing = threading.Lock()
         self.metadata = metadata
-        self.openai_client = OpenAI()
+        self._aio: Union["AsyncMemoryManager", None] = None
+        self._max_distance: Union[float, None] = None
+        self._gate_lock = threading.Lock()
+        # Extracts the similarity gate kept from the summarizer.
+        self.gated = 0
+
+    @property
+    def aio(self) -> "AsyncMemoryManager":
+        """
+        The coroutine side of this manager, sharing its retrieval: the
+        summarizing and answering methods here wait for it (see aio.run).
+        """
+        if self._aio is None:
+            self._aio = AsyncMemoryManager(self.name, self.metadata, manager=self)
+        return self._aio
+
+    def flush(self) -> None:
+        """Write the buffered question embeddings to the collection."""
+        with self._storing:
+            if self.writer is not None:
+                self.writer.flush()
+
+    def max_distance(self) -> float:
+        """The dataset's similarity gate (see gate_distance), looked up once."""
+        with self._gate_lock:
+            if self._max_distance is None:
+                self._max_distance = gate_distance(self.name, self.reader, self.embedder)
+            return self._max_distance
+
+    def gate(self, similar: ExtractedDataType) -> ExtractedDataType:
+        """
+        The extracts within max_distance of the question. Extracts
+        without a distance are kept, and so is the nearest one when the
+        gate is calibrated ("auto"): a calibration is a statistic, and
+        must not leave a question without context.
+        """
+        limit = self.max_distance()
+        kept = [m for m in similar if float(m.get("distance") or 0.0) <= limit]
+        if similar and not kept and state.max_distance(self.name) == "auto":
+            kept = [min(similar, key=lambda m: float(m.get("distance") or 0.0))]
+        with self._gate_lock:
+            self.gated += len(similar) - len(kept)
+        return kept
 
     def get_similar_and_summarize(
-        self, exchange: List[str], prev_answer: str, store: bool = True
+        self,
+        exchange: List[str],
+        prev_answer: str,
+        store: bool = True,
+        similar: Union[ExtractedDataType, None] = None,
     ) -> str:
         """
-        Get similar extracts and summarize them.
+        Get similar extracts and summarize those passing the similarity
+        gate (see gate).
 
         Args:
             exchange (List[str]): The current exchange (question and answer).
             prev_answer (str): The previous answer.
             store (bool): Also store the question's embedding (see
                 get_similar_extracts).
+            similar (ExtractedDataType): The extracts already retrieved
+                for the question, to summarize instead of retrieving.
 
         Returns:
             str: Summarized useful memories.
         """
-        question, _ = exchange
-
-        similar: ExtractedDataType = self.get_similar_extracts(exchange, store=store)
-        if not similar:
-            return ""
-        print(question)
-        time.sleep(3)
-        summaries: List[Dict[str, str]] = self.summarize_helpful_memories(
-            question, similar, prev_answer
+        return aio.run(
+            self.aio.get_similar_and_summarize(exchange, prev_answer, store=store, similar=similar)
         )
 
-        useful_memories = ""
-        for summary in summaries:
-            if len(summary["memory"]):
-                useful_memories += (
-                    f"""from {summary['date']}: \n {summary["memory"]}\n\n"""
-                )
-        return useful_memories
+    def summarize_exchanges(self, exchanges: List[List[str]], store: bool = True) -> List[str]:
+        """
+        The summarized memories of each exchange of a transcript, the
+        previous answer as context (see
+        AsyncMemoryManager.summarize_exchanges).
+        """
+        return aio.run(self.aio.summarize_exchanges(exchanges, store=store))
 
     def _collection_is_dated(self) -> bool:
         """
@@ -112,8 +365,11 @@ class MemoryManager:
         upserts date_num everywhere and activates it).
         """
         if self._dated is None:
-            got = self.collection.get(where={"date_num": {"$gte": 0}}, limit=1)
-            self._dated = bool(got.get("ids"))
+            if isinstance(self.reader, FlatIndex):
+                self._dated = self.reader.dated
+            else:
+                got = self.collection.get(where={"date_num": {"$gte": 0}}, limit=1)
+                self._dated = bool(got.get("ids"))
             if not self._dated:
                 hx.warn(
                     "the embedding store predates date filtering; retrieval "
@@ -121,11 +377,31 @@ class MemoryManager:
                 )
         return self._dated
 
-    def get_similar_extracts(
-        self, exchange: List[str], store: bool = True
-    ) -> ExtractedDataType:
+    def _snapshot_is_current(self) -> bool:
+        """
+        Whether retrieval that stores questions (ft:gen) can query the
+        flat index: the dataset uses one and it holds every record of
+        the collection (see store.refresh_flat_index). Its date-sorted
+        rows make the earlier-writings filter a prefix scan, where
+        chroma filters its HNSW search.
         """
-        Get similar extracts from the collection.
+        if self._current is None:
+            self._current = isinstance(self.reader, FlatIndex) and (
+                self.reader.count() + self.reader.appended == self.collection.count()
+            )
+        return self._current
+
+    def query_memories(
+        self,
+        exchange: List[str],
+        store: bool = True,
+        embedding: Union[List[float], None] = None,
+    ) -> Union[Dict[str, Any], None]:
+        """
+        Query the collection for the extracts nearest an exchange's
+        question, as raw query results (one row per query; None without
+        a collection). Embeds the question unless its embedding is
+        given.
 
         When the interview's date is known, only *earlier* writings are
         retrieved (date_num < the interview's day) -- the target cannot
@@ -138,32 +414,101 @@ class MemoryManager:
             store (bool): Also store the question's embedding in the
                 collection (dataset generation does; serving must not,
                 or chat questions would contaminate the corpus).
+            embedding (List[float]): The question's embedding, if the
+                caller already has it.
 
         Returns:
-            ExtractedDataType: List of similar extracts with metadata.
+            Dict[str, Any]: Ids, metadatas, documents and distances.
         """
         if self.collection is None:
-            return []
+            return None
+        if store:
+            with self._storing:
+                return self._query(self._store_questions([exchange[0]]), store)
+        if embedding is None:
+            embedding = get_embedding(exchange[0], self.embedder)
+        return self._query([embedding], store)
 
-        # Convert MetaDataKeyEnum keys to strings
-        string_metadata = {k.value: v for k, v in self.metadata.items()}
+    def query_many(self, exchanges: List[List[str]], store: bool = True) -> List[Union[Dict[str, Any], None]]:
+        """
+        query_memories for each of a transcript's exchanges, in one
+        batched embedding pass and one multi-query search instead of a
+        round trip (or two) per exchange.
 
+        Returns:
+            List[Dict[str, Any]]: One single-row result per exchange, in
+            order (None each without a collection).
+        """
+        if self.collection is None:
+            return [None] * len(exchanges)
+        if not exchanges:
+            return []
+        questions = [exchange[0] for exchange in exchanges]
         if store:
-            embedding = get_and_store_embedding(
-                {"question": exchange[0]}, self.name, string_metadata
-            )
+            with self._storing:
+                results = self._query(self._store_questions(questions), store)
         else:
-            embedding = get_embedding(exchange[0])
-        before = date_num(string_metadata.get("date"))
+            results = self._query(get_embeddings(questions, self.embedder), store)
+        return [
+            {key: [results[key][i]] for key in ("ids", "documents", "metadatas", "distances")}
+            for i in range(len(exchanges))
+        ]
+
+    def _store_questions(self, questions: List[str]) -> List[List[float]]:
+        """Embed the questions and buffer them for the collection."""
+        if self.writer is None:
+            self.writer = vector_store.upsert_buffer(self.name, self.embedder)
+            if self._snapshot_is_current():
+                # questions written from here on are searched too
+                self.writer.on_write = self.reader.extend
+        return get_and_store_embeddings(
+            [{"question": question} for question in questions], self.name, self._string_metadata(), self.writer
+        )
+
+    def _string_metadata(self) -> Dict[str, Any]:
+        # Convert MetaDataKeyEnum keys to strings
+        return {k.value: v for k, v in self.metadata.items()}
+
+    def _query(self, embeddings: List[List[float]], store: bool) -> Dict[str, Any]:
+        """One search for the extracts nearest each embedding (see query_memories)."""
+        before = date_num(self._string_metadata().get("date"))
         query_args = {
-            "query_embeddings": [embedding],
+            "query_embeddings": embeddings,
             "n_results": 5,
             "include": ["metadatas", "documents", "distances"],
         }
         if before and self._collection_is_dated():
             query_args["where"] = {"date_num": {"$lt": before}}
-        results = self.collection.query(**query_args)
+        source = self.reader if not store or self._snapshot_is_current() else self.collection
+        return source.query(**query_args)
+
+    def get_similar_extracts(
+        self,
+        exchange: List[str],
+        store: bool = True,
+        results: Union[Dict[str, Any], None] = None,
+    ) -> ExtractedDataType:
+        """
+        Get similar extracts from the collection (see query_memories).
 
+        Args:
+            exchange (List[str]): The current exchange (question and answer).
+            store (bool): Also store the question's embedding in the
+                collection (see query_memories).
+            results (Dict[str, Any]): query_memories results already
+                fetched for the question, to use instead of querying.
+
+        Returns:
+            ExtractedDataType: List of similar extracts with metadata and
+            their distance from the question, nearest first.
+        """
+        if results is None:
+            results = self.query_memories(exchange, store=store)
+        if results is None:
+            return []
+
+        metadatas = results["metadatas"][0] if results["metadatas"] else []
+        distances = results["distances"][0] if results.get("distances") else []
         extracted_data: ExtractedDataType = [
             {
                 "date": metadata.get("date", "Unknown date"),
@@ -172,10 +517,12 @@ class MemoryManager:
                 "url": metadata.get("url", ""),
             }
             for metadata, document in zip(
-                results["metadatas"][0] if results["metadatas"] else [],
+                metadatas,
                 results["documents"][0] if results["documents"] else [],
             )
         ]
+        for extract, distance in zip(extracted_data, distances):
+            extract["distance"] = float(distance)
 
         return extracted_data
 
@@ -187,7 +534,8 @@ class MemoryManager:
         no_useful_check: bool = False,
     ) -> Dict[str, str]:
         """
-        Summarize a single memory.
+        Summarize a single memory, from the summary cache when the same
+        memory was summarized for the same question before.
 
         Args:
             memory (Dict[str, str]): The memory to summarize.
@@ -198,24 +546,14 @@ class MemoryManager:
         Returns:
             Dict[str, str]: Summarized memory with date.
         """
-        prompt_manager = PromptManager()
-        summary = prompt_manager.summarize_memory(
-            memory["document"],
-            question,
-            prev_answer,
-            author=self.name,
-            useful_check=not no_useful_check,
-        )
-        if re.sub(r"\W+", "", summary).lower() != "skip":
-            return {"date": memory["date"], "memory": summary}
-        else:
-            return {"date": memory["date"], "memory": ""}
+        return aio.run(self.aio.summarize_memory(memory, question, prev_answer, no_useful_check))
 
     def summarize_helpful_memories(
         self,
         question: str,
         similar: ExtractedDataType,
         prev_answer: str,
+        batched: Union[bool, None] = None,
     ) -> List[Dict[str, str]]:
         """
         Summarize helpful memories from similar extracts.
@@ -224,38 +562,257 @@ class MemoryManager:
             question (str): The current question.
             similar (ExtractedDataType): List of similar extracts.
             prev_answer (str): The previous answer.
-            no_useful_check (bool): Whether to skip the usefulness check.
+            batched (bool): Summarize them all in one request (see
+                summarize_memories); SUMMARY_BATCHED by default.
 
         Returns:
             List[Dict[str, str]]: List of summarized memories.
         """
-        with ThreadPoolExecutor() as executor:
-            summaries = list(
-                executor.map(
-                    lambda x: self.summarize_memory(x, question, prev_answer),
-                    similar,
-                )
-            )
-        return summaries
+        return aio.run(self.aio.summarize_helpful_memories(question, similar, prev_answer, batched))
 
-    def ask_question(self, question: str, model: str = "gpt-4-turbo") -> str:
+    def summarize_memories(
+        self,
+        similar: ExtractedDataType,
+        question: str,
+        prev_answer: str,
+    ) -> List[Dict[str, str]]:
+        """
+        Summarize an exchange's memories in a single request, asking
+        only about those not in the summary cache.
+
+        Raises:
+            ValueError: When the reply cannot be mapped back to the
+                memories (see prompt_manager.parse_memory_verdicts).
+        """
+        return aio.run(self.aio.summarize_memories(similar, question, prev_answer))
+
+    def ask_question(
+        self,
+        question: str,
+        model: str = "gpt-4-turbo",
+        results: Union[Dict[str, Any], None] = None,
+    ) -> str:
         """
         Ask a question and get an answer based on similar extracts.
 
+        The question is embedded and the collection queried once; the
+        same extracts are the context and what gets summarized.
+
         Args:
             question (str): The question to ask.
             model (str): The model that answers -- typically the
                 finetuned persona model.
+            results (Dict[str, Any]): query_memories results already
+                fetched for the question (see serve.answer_turn).
 
         Returns:
             str: The generated answer.
         """
+        return aio.run(self.aio.ask_question(question, model=model, results=results))
+
+
+class AsyncMemoryManager:
+    """
+    MemoryManager's summarize and answer pipeline as coroutines, on the
+    shared AsyncOpenAI client and connection pool (see aio): many
+    exchanges or chat turns can be in flight at once, at most
+    `concurrency` of them, their summarizer calls paced by
+    summary_limiter. Retrieval -- embedding the question and querying
+    the store -- is MemoryManager's, run in a worker thread.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        metadata: Dict[MetaDataKeyEnum, Any],
+        concurrency: int = EXCHANGES_IN_FLIGHT,
+        manager: Union[MemoryManager, None] = None,
+    ):
+        """
+        Args:
+            name (str): The name of the collection.
+            metadata (Dict[MetaDataKeyEnum, Any]): Metadata for the collection.
+            concurrency (int): Exchanges or questions in flight at once.
+            manager (MemoryManager): The manager to retrieve with, when
+                it exists already.
+        """
+        self.name = name
+        self.manager = manager if manager is not None else MemoryManager(name, metadata)
+        self.concurrency = concurrency
+        self._openai_client: Union[AsyncOpenAI, None] = None
+
+    @property
+    def openai_client(self) -> AsyncOpenAI:
+        """The chat client answers go through: the shared one by default."""
+        return self._openai_client or aio.client()
+
+    async def query_memories(
+        self,
+        exchange: List[str],
+        store: bool = True,
+        embedding: Union[List[float], None] = None,
+    ) -> Union[Dict[str, Any], None]:
+        """MemoryManager.query_memories, in a worker thread."""
+        return await asyncio.to_thread(self.manager.query_memories, exchange, store, embedding)
+
+    async def get_similar_extracts(
+        self,
+        exchange: List[str],
+        store: bool = True,
+        results: Union[Dict[str, Any], None] = None,
+    ) -> ExtractedDataType:
+        """MemoryManager.get_similar_extracts, querying in a worker thread."""
+        if results is None:
+            results = await self.query_memories(exchange, store=store)
+        if results is None:
+            return []
+        return self.manager.get_similar_extracts(exchange, store=store, results=results)
+
+    async def _cached(self, keys: List[str]) -> Dict[str, str]:
+        """The summaries the summary cache holds for these keys."""
+        cache = summary_cache()
+        if cache is None:
+            return {}
+        found = await asyncio.to_thread(cache.get_many, keys)
+        return {key: value.decode("utf-8") for key, value in found.items()}
+
+    async def _remember(self, summaries: Dict[str, str]) -> None:
+        """Store fresh summaries in the summary cache."""
+        cache = summary_cache()
+        if cache is not None and summaries:
+            await asyncio.to_thread(
+                cache.put_many, {key: summary.encode("utf-8") for key, summary in summaries.items()}
+            )
+
+    async def summarize_memory(
+        self,
+        memory: Dict[str, Any],
+        question: str,
+        prev_answer: str,
+        no_useful_check: bool = False,
+    ) -> Dict[str, str]:
+        """See MemoryManager.summarize_memory."""
+        key = summary_key(
+            str(memory["document"]), question, prev_answer, self.name, not no_useful_check
+        )
+        found = await self._cached([key])
+        if key not in found:
+            # retried outside the slot: a backing-off call does not hold one
+            found[key] = await call_with_retries_async(
+                summary_limiter().call_async,
+                AsyncPromptManager().summarize_memory,
+                memory["document"],
+                question,
+                prev_answer,
+                author=self.name,
+                useful_check=not no_useful_check,
+            )
+            await self._remember({key: found[key]})
+        return _summarized(memory, found[key])
+
+    async def summarize_memories(
+        self,
+        similar: ExtractedDataType,
+        question: str,
+        prev_answer: str,
+    ) -> List[Dict[str, str]]:
+        """See MemoryManager.summarize_memories."""
+        keys = [
+            summary_key(str(m["document"]), question, prev_answer, self.name, True, batched=True)
+            for m in similar
+        ]
+        found = await self._cached(keys)
+        missing = [i for i, key in enumerate(keys) if key not in found]
+        if missing:
+            replies = await call_with_retries_async(
+                summary_limiter().call_async,
+                AsyncPromptManager().summarize_memories,
+                [str(similar[i]["document"]) for i in missing],
+                question,
+                prev_answer,
+                author=self.name,
+            )
+            fresh = {keys[i]: reply for i, reply in zip(missing, replies)}
+            await self._remember(fresh)
+            found.update(fresh)
+        return [_summarized(memory, found[key]) for memory, key in zip(similar, keys)]
+
+    async def summarize_helpful_memories(
+        self,
+        question: str,
+        similar: ExtractedDataType,
+        prev_answer: str,
+        batched: Union[bool, None] = None,
+    ) -> List[Dict[str, str]]:
+        """See MemoryManager.summarize_helpful_memories."""
+        if batched is None:
+            batched = SUMMARY_BATCHED
+        if batched and len(similar) > 1:
+            try:
+                return await self.summarize_memories(similar, question, prev_answer)
+            except ValueError as e:
+                hx.warn(f"batched summary unusable ({e}); summarizing one by one")
+        # all at once: the summary limiter decides how many are calling
+        return list(
+            await asyncio.gather(
+                *(self.summarize_memory(memory, question, prev_answer) for memory in similar)
+            )
+        )
+
+    async def get_similar_and_summarize(
+        self,
+        exchange: List[str],
+        prev_answer: str,
+        store: bool = True,
+        similar: Union[ExtractedDataType, None] = None,
+    ) -> str:
+        """See MemoryManager.get_similar_and_summarize."""
+        question, _ = exchange
+
+        if similar is None:
+            similar = await self.get_similar_extracts(exchange, store=store)
+        similar = await asyncio.to_thread(self.manager.gate, similar)
+        if not similar:
+            return ""
+        print(question)
+        summaries = await self.summarize_helpful_memories(question, similar, prev_answer)
+        return _useful_memories(summaries)
+
+    async def summarize_exchanges(self, exchanges: List[List[str]], store: bool = True) -> List[str]:
+        """
+        The summarized memories of each of a transcript's exchanges, the
+        previous exchange's answer as context.
+
+        The questions are embedded and searched for together (see
+        MemoryManager.query_many); the summaries then run `concurrency`
+        exchanges at a time.
+        """
+        results = await asyncio.to_thread(self.manager.query_many, exchanges, store)
+        similar = [await self.get_similar_extracts(e, store=store, results=r) for e, r in zip(exchanges, results)]
+        prev_answers = [""] + [answer for _, answer in exchanges[:-1]]
+        return await aio.bounded_map(
+            lambda i: self.get_similar_and_summarize(
+                exchanges[i], prev_answers[i], store=store, similar=similar[i]
+            ),
+            range(len(exchanges)),
+            self.concurrency,
+        )
+
+    async def ask_question(
+        self,
+        question: str,
+        model: str = "gpt-4-turbo",
+        results: Union[Dict[str, Any], None] = None,
+    ) -> str:
+        """See MemoryManager.ask_question."""
         # store=False: asking must never write the question into the
         # grounding collection it retrieves from.
-        similar = self.get_similar_extracts([question, ""], store=False)
+        similar = await self.get_similar_extracts([question, ""], store=False, results=results)
         context = "\n\n".join([str(x.get("document", "")) for x in similar])
 
-        memories = self.get_similar_and_summarize([question, ""], "", store=False)
+        memories = await self.get_similar_and_summarize(
+            [question, ""], "", store=False, similar=similar
+        )
 
         messages: List[ChatCompletionMessageParam] = [
             ChatCompletionSystemMessageParam(
@@ -271,39 +828,55 @@ class MemoryManager:
             ChatCompletionUserMessageParam(role="user", content=question),
         ]
 
-        response = self.openai_client.chat.completions.create(
-            model=model, messages=messages
+        response = await call_with_retries_async(
+            self.openai_client.chat.completions.create, model=model, messages=messages
         )
 
         return response.choices[0].message.content or ""
 
+    async def answer_questions(self, questions: List[str], model: str = "gpt-4-turbo") -> List[str]:
+        """Answers to many questions (see ask_question), `concurrency` at a time."""
+        return await aio.bounded_map(
+            lambda question: self.ask_question(question, model=model), questions, self.concurrency
+        )
+
 
-def preview_context(name: str, question: str, n_results: int = 5) -> List[Dict[str, str]]:
+def preview_context(
+    name: str,
+    question: str,
+    n_results: int = 5,
+    results: Union[Dict[str, Any], None] = None,
+) -> List[Dict[str, Any]]:
     """
     What retrieval would put in the persona's context for a question --
     without storing the question or calling the summarizer.
 
+    Args:
+        name (str): Dataset name.
+        question (str): The question.
+        n_results (int): Rows to show.
+        results (Dict[str, Any]): Query results already fetched for the
+            question (MemoryManager.query_memories), shown instead of
+            embedding and querying again.
+
     Returns:
-        List[Dict[str, str]]: {"title", "date", "url", "snippet"} rows,
-        best match first; empty if nothing is embedded yet.
+        List[Dict[str, Any]]: {"title", "date", "url", "snippet",
+        "distance"} rows, best match first; empty if nothing is embedded
+        yet.
     """
-    # Existence check first: constructing a PersistentClient would
-    # create data/{name}/ and make an unembedded dataset look embedded.
-    if not os.path.exists(f"data/{name}/chroma.sqlite3"):
-        return []
-    try:
-        collection = PersistentClient(path=f"data/{name}").get_collection(name)
-    except Exception:
-        return []
-
-    results = collection.query(
-        query_embeddings=[get_embedding(question)],
-        n_results=n_results,
-        include=["metadatas", "documents"],
-    )
+    if results is None:
+        source = vector_store.reader(name)
+        if source is None:
+            return []
+        results = source.query(
+            query_embeddings=[get_embedding(question, backend_for(name))],
+            n_results=n_results,
+            include=["metadatas", "documents", "distances"],
+        )
     rows = []
     for metadata, document in zip(
-        (results["metadatas"] or [[]])[0], (results["documents"] or [[]])[0]
+        (results["metadatas"] or [[]])[0][:n_results],
+        (results["documents"] or [[]])[0][:n_results],
     ):
         rows.append(
             {
@@ -315,6 +888,9 @@ def preview_context(name: str, question: str, n_results: int = 5) -> List[Dict[s
                 "date": str(metadata.get("date", "")),
                 "url": str(metadata.get("url") or metadata.get("link") or ""),
                 "snippet": " ".join(str(document).split())[:140],
+                "distance": None,
             }
         )
+    for row, distance in zip(rows, (results.get("distances") or [[]])[0]):
+        row["distance"] = float(distance)
     return rows
@@ -1,15 +1,14 @@
 from openai import OpenAI
 import time
 import json
-import tiktoken
 from typing import List, Dict, Any, Tuple, Union
+from . import tokenizers
 from .prompt_manager import PromptManager
 from openai.types.chat import ChatCompletionSystemMessageParam as SystemMessageParam
 
 prompt_manager = PromptManager()
 
 MAX_FINETUNE_LENGTH = 4096
-encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
 _client = None
 
 
@@ -30,7 +29,7 @@ def count_tokens(prompt: object) -> int:
     Returns:
         int: The number of tokens.
     """
-    return len(encoding.encode(json.dumps(prompt)))
+    return len(tokenizers.encoding_for_model("gpt-3.5-turbo").encode(json.dumps(prompt)))
 
 
 def oaify_example(
@@ -71,7 +70,7 @@ def oaify_example(
             "name": a_name.replace(" ", ""),
         }
     )
-    return result, len(encoding.encode(json.dumps(result)))
+    return result, count_tokens(result)
 
 
 def create_finetune_job(name: str, file: Any, model: str) -> Any:
@@ -1,25 +1,25 @@
+import json
+import re
 from typing import Dict, List
 
-from openai import OpenAI
 from openai.types.chat import (
     ChatCompletionMessageParam,
     ChatCompletionSystemMessageParam,
     ChatCompletionUserMessageParam,
 )
 
+from . import aio
 
-class PromptManager:
-    """Manages prompts for the RAFT project."""
 
-    def __init__(self):
-        """Initialize the PromptManager (the API client is created lazily)."""
-        self._client = None
+# The model summarize_memory asks, and the version of its prompt: bump
+# it whenever the prompt changes, so cached summaries (see
+# memories.summary_cache) of the old one are not reused.
+SUMMARY_MODEL = "gpt-4"
+SUMMARY_PROMPT_VERSION = 1
+
 
-    @property
-    def client(self) -> OpenAI:
-        if self._client is None:
-            self._client = OpenAI()
-        return self._client
+class PromptManager:
+    """Manages prompts for the RAFT project."""
 
     def get_interview_system_message(
         self, questioner: str, answerer: str, date: str
@@ -52,48 +52,23 @@ class PromptManager:
         author: str,
         useful_check: bool = True,
     ) -> str:
-        """
-        Summarize a memory.
-
-        Args:
-            memory (str): The memory to summarize.
-            question (str): The current question.
-            prev_answer (str): The previous answer.
-            author (str): The author's name.
-            useful_check (bool, optional): Whether to check for usefulness.\
-                Defaults to True.
+        """See AsyncPromptManager.summarize_memory; waits for it (see aio.run)."""
+        return aio.run(
+            AsyncPromptManager().summarize_memory(memory, question, prev_answer, author, useful_check)
+        )
 
-        Returns:
-            str: The summarized memory.
-        """
-        if useful_check:
-            instruction = (
-                "Decide whether the quote from his blog, or extract"
-                + " from previous interview presented here is helpful"
-                + " in answering the question. If it is, rephrase it"
-            )
-        else:
-            instruction = "Read this quote and"
-
-        messages: List[ChatCompletionMessageParam] = [
-            ChatCompletionSystemMessageParam(
-                role="system",
-                content=f"""\
-                    You are helping {author} prepare for an interview.\n \
-                    {instruction} from his perspective, in a way that \
-                    would be helpful for answering, in one or two \
-                    sentences - type it directly, without intro. \
-                    If it is not helpful, simply type 'skip'""",
-            ),
-            ChatCompletionUserMessageParam(
-                role="user",
-                content=f"Previous answer, for context:\n {prev_answer}\n\n \
-                    Question: {question}\n\n \
-                    Memory: {memory}",
-            ),
-        ]
-        response = self.client.chat.completions.create(model="gpt-4", messages=messages)
-        return str(response.choices[0].message.content).strip()
+    def summarize_memories(
+        self,
+        memories: List[str],
+        question: str,
+        prev_answer: str,
+        author: str,
+        useful_check: bool = True,
+    ) -> List[str]:
+        """See AsyncPromptManager.summarize_memories; waits for it (see aio.run)."""
+        return aio.run(
+            AsyncPromptManager().summarize_memories(memories, question, prev_answer, author, useful_check)
+        )
 
     def contextualise_memories_for_prompt(
         self, memories: List[Dict[str, str]]
@@ -120,3 +95,172 @@ class PromptManager:
             ]
         else:
             return []
+
+
+class AsyncPromptManager:
+    """
+    The summarizer prompts, as coroutines on the shared AsyncOpenAI
+    client (see aio). Retrying and pacing them is the caller's (see
+    memories.AsyncMemoryManager).
+    """
+
+    async def summarize_memory(
+        self,
+        memory: str,
+        question: str,
+        prev_answer: str,
+        author: str,
+        useful_check: bool = True,
+    ) -> str:
+        """
+        Summarize a memory.
+
+        Args:
+            memory (str): The memory to summarize.
+            question (str): The current question.
+            prev_answer (str): The previous answer.
+            author (str): The author's name.
+            useful_check (bool, optional): Whether to check for usefulness.\
+                Defaults to True.
+
+        Returns:
+            str: The summarized memory.
+        """
+        messages = summary_messages(memory, question, prev_answer, author, useful_check)
+        response = await aio.client().chat.completions.create(model=SUMMARY_MODEL, messages=messages)
+        return str(response.choices[0].message.content).strip()
+
+    async def summarize_memories(
+        self,
+        memories: List[str],
+        question: str,
+        prev_answer: str,
+        author: str,
+        useful_check: bool = True,
+    ) -> List[str]:
+        """
+        Summarize several memories for the same question in one request.
+
+        The instructions, question and previous answer are sent once,
+        the memories numbered after them, and the model answers with a
+        JSON array of {"memory": n, "helpful": bool, "summary": str}.
+
+        Args:
+            memories (List[str]): The memories to summarize.
+            question (str): The current question.
+            prev_answer (str): The previous answer.
+            author (str): The author's name.
+            useful_check (bool, optional): Whether to check for usefulness.\
+                Defaults to True.
+
+        Returns:
+            List[str]: A summary per memory, in order: 'skip' for those
+                that are not helpful (as summarize_memory answers).
+
+        Raises:
+            ValueError: When the reply is not such an array, or misses
+                a memory (see parse_memory_verdicts).
+        """
+        messages = batched_summary_messages(memories, question, prev_answer, author, useful_check)
+        response = await aio.client().chat.completions.create(model=SUMMARY_MODEL, messages=messages)
+        return parse_memory_verdicts(str(response.choices[0].message.content), len(memories))
+
+
+def summary_messages(
+    memory: str, question: str, prev_answer: str, author: str, useful_check: bool = True
+) -> List[ChatCompletionMessageParam]:
+    """The chat messages of AsyncPromptManager.summarize_memory."""
+    if useful_check:
+        instruction = (
+            "Decide whether the quote from his blog, or extract"
+            + " from previous interview presented here is helpful"
+            + " in answering the question. If it is, rephrase it"
+        )
+    else:
+        instruction = "Read this quote and"
+
+    messages: List[ChatCompletionMessageParam] = [
+        ChatCompletionSystemMessageParam(
+            role="system",
+            content=f"""\
+                You are helping {author} prepare for an interview.\n \
+                {instruction} from his perspective, in a way that \
+                would be helpful for answering, in one or two \
+                sentences - type it directly, without intro. \
+                If it is not helpful, simply type 'skip'""",
+        ),
+        ChatCompletionUserMessageParam(
+            role="user",
+            content=f"Previous answer, for context:\n {prev_answer}\n\n \
+                Question: {question}\n\n \
+                Memory: {memory}",
+        ),
+    ]
+    return messages
+
+
+def batched_summary_messages(
+    memories: List[str], question: str, prev_answer: str, author: str, useful_check: bool = True
+) -> List[ChatCompletionMessageParam]:
+    """The chat messages of AsyncPromptManager.summarize_memories."""
+    if useful_check:
+        instruction = (
+            "For each quote from his blog, or extract from previous"
+            + " interview, decide whether it is helpful in answering"
+            + " the question. If it is, rephrase it"
+        )
+    else:
+        instruction = "Rephrase each quote"
+
+    numbered = "\n\n".join(
+        f"Memory {i}: {memory}" for i, memory in enumerate(memories, 1)
+    )
+    messages: List[ChatCompletionMessageParam] = [
+        ChatCompletionSystemMessageParam(
+            role="system",
+            content=f"""\
+                You are helping {author} prepare for an interview.\n \
+                {instruction} from his perspective, in a way that \
+                would be helpful for answering, in one or two \
+                sentences - without intro. Reply with a JSON array \
+                only, one object per memory: {{"memory": <number>, \
+                "helpful": true or false, "summary": "<the \
+                rephrasing, empty if not helpful>"}}""",
+        ),
+        ChatCompletionUserMessageParam(
+            role="user",
+            content=f"Previous answer, for context:\n {prev_answer}\n\n \
+                Question: {question}\n\n{numbered}",
+        ),
+    ]
+    return messages
+
+
+def parse_memory_verdicts(reply: str, count: int) -> List[str]:
+    """
+    The per-memory summaries in a summarize_memories reply ('skip' for
+    those not helpful), in memory order.
+
+    Raises:
+        ValueError: When the reply holds no JSON array of verdicts for
+            memories 1 to count, or a verdict for any other memory.
+    """
+    # tolerate a ```json fence or a sentence around the array
+    found = re.search(r"\[.*\]", reply, re.DOTALL)
+    if found is None:
+        raise ValueError(f"no JSON array in the summarizer's reply: {reply[:200]!r}")
+    verdicts = json.loads(found.group(0))
+    summaries: Dict[int, str] = {}
+    for verdict in verdicts:
+        if not isinstance(verdict, dict):
+            raise ValueError(f"not a memory verdict: {verdict!r}")
+        memory = verdict.get("memory")
+        if isinstance(memory, bool) or not isinstance(memory, int) or not 1 <= memory <= count:
+            raise ValueError(f"no memory {memory!r} among memories 1 to {count}")
+        summary = str(verdict.get("summary") or "").strip()
+        helpful = verdict.get("helpful") is True and bool(summary)
+        summaries[memory] = summary if helpful else "skip"
+    missing = [n for n in range(1, count + 1) if n not in summaries]
+    if missing:
+        raise ValueError(f"the summarizer's reply misses memories {missing}")
+    return [summaries[n] for n in range(1, count + 1)]
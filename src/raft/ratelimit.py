@@ -0,0 +1,292 @@
+"""
+Staying inside the OpenAI rate limits: a token-bucket limiter for
+requests/min and tokens/min, an adaptive (AIMD) limit on calls in
+flight, and retries with exponential backoff that honour the server's
+retry-after hints.
+
+A multi-hour `raft embed` used to die on its first 429; with these, a
+transient error costs a pause instead of the run.
+"""
+
+import asyncio
+import email.utils
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+import openai
+
+T = TypeVar("T")
+
+# Errors worth another attempt: rate limits, timeouts, dropped
+# connections and server-side failures. Anything else (bad request,
+# auth) will fail the same way again.
+RETRYABLE = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+class TokenBucket:
+    """
+    A bucket refilled continuously at `per_minute`, holding at most
+    `capacity` (one minute's worth by default).
+    """
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` is available (0 if it is now)."""
+        self._refill()
+        # A request larger than the bucket can ever hold waits for a
+        # full bucket instead of forever.
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """Requests/min and tokens/min buckets, shared by worker threads."""
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int = 0, sleep: Callable[[float], None] = time.sleep) -> None:
+        """Block until one request of `tokens` tokens fits both budgets."""
+        while True:
+            with self._lock:
+                wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                if wait <= 0:
+                    self.requests.take(1)
+                    self.tokens.take(tokens)
+                    return
+            sleep(wait)
+
+
+class AdaptiveConcurrency:
+    """
+    How many calls may be in flight at once, found the way TCP finds
+    its window (AIMD): every call that succeeds raises the limit by
+    `increase` / limit -- about `increase` per limit's worth of calls --
+    and a throttled or failed-on-overload call (see RETRYABLE), or one
+    slower than `latency_factor` times the running average, multiplies
+    it by `decrease`. Calls in flight together see the same congestion,
+    so the limit drops at most once per average latency.
+
+    Use call() from any number of threads; they wait for a free slot.
+    """
+
+    def __init__(
+        self,
+        minimum: int = 1,
+        maximum: int = 16,
+        initial: int = 4,
+        increase: float = 1.0,
+        decrease: float = 0.5,
+        latency_factor: float = 3.0,
+    ):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.in_flight = 0
+        # running average of call latency, in seconds
+        self.latency: Optional[float] = None
+        self._decreased = float("-inf")
+        self._cond = threading.Condition()
+
+    def acquire(self) -> None:
+        """Block until a call fits under the limit, and count it in."""
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency: Optional[float] = None, overloaded: bool = False) -> None:
+        """
+        Count a call out: it took `latency` seconds (None when it failed
+        for reasons that say nothing about load), or hit `overloaded`.
+        """
+        with self._cond:
+            self._settle(latency, overloaded)
+            self._cond.notify_all()
+
+    def _settle(self, latency: Optional[float], overloaded: bool) -> None:
+        """Count a call out and adjust the limit (the caller holds the lock)."""
+        self.in_flight -= 1
+        now = time.monotonic()
+        spike = (
+            latency is not None
+            and self.latency is not None
+            and latency > self.latency_factor * self.latency
+        )
+        if overloaded or spike:
+            if now - self._decreased >= (self.latency or 0.0):
+                self.limit = max(float(self.minimum), self.limit * self.decrease)
+                self._decreased = now
+        elif latency is not None:
+            self.limit = min(float(self.maximum), self.limit + self.increase / self.limit)
+        if latency is not None:
+            self.latency = latency if self.latency is None else 0.9 * self.latency + 0.1 * latency
+
+    def call(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Call fn in a slot, adjusting the limit by how it went."""
+        self.acquire()
+        started = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except RETRYABLE:
+            self.release(overloaded=True)
+            raise
+        except BaseException:
+            self.release()
+            raise
+        self.release(latency=time.monotonic() - started)
+        return result
+
+
+class AsyncAdaptiveConcurrency(AdaptiveConcurrency):
+    """
+    AdaptiveConcurrency for coroutines: the same limit, but calls wait
+    for a slot on the event loop instead of blocking a thread. Use it
+    from one event loop (see aio).
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._slots = asyncio.Condition()
+
+    async def acquire_async(self) -> None:
+        """Wait until a call fits under the limit, and count it in."""
+        async with self._slots:
+            await self._slots.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release_async(self, latency: Optional[float] = None, overloaded: bool = False) -> None:
+        """Count a call out (see AdaptiveConcurrency.release)."""
+        async with self._slots:
+            self._settle(latency, overloaded)
+            self._slots.notify_all()
+
+    async def call_async(self, fn: Callable[..., Awaitable[T]], *args: Any, **kwargs: Any) -> T:
+        """Await fn in a slot, adjusting the limit by how it went."""
+        await self.acquire_async()
+        started = time.monotonic()
+        try:
+            result = await fn(*args, **kwargs)
+        except RETRYABLE:
+            await self.release_async(overloaded=True)
+            raise
+        except BaseException:
+            await self.release_async()
+            raise
+        await self.release_async(latency=time.monotonic() - started)
+        return result
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """
+    The server's requested delay in seconds, from retry-after-ms or
+    retry-after (seconds or an HTTP date), or None.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    for header, divisor in (("retry-after-ms", 1000.0), ("retry-after", 1.0)):
+        value = headers.get(header)
+        if value is None:
+            continue
+        try:
+            return max(0.0, float(value) / divisor)
+        except ValueError:
+            pass
+    parsed = email.utils.parsedate_tz(headers.get("retry-after") or "")
+    if parsed is None:
+        return None
+    return max(0.0, email.utils.mktime_tz(parsed) - time.time())
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Exponential backoff with full jitter for the given attempt (0-based)."""
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+def call_with_retries(
+    fn: Callable[..., T],
+    *args: Any,
+    attempts: int = 6,
+    base_delay: float = 1.0,
+    max_delay: float = 60.0,
+    sleep: Callable[[float], None] = time.sleep,
+    **kwargs: Any,
+) -> T:
+    """
+    Call fn, retrying retryable API errors with backoff.
+
+    The wait is the larger of the jittered backoff and the server's
+    retry-after, so a 429 is never retried before the server allows.
+    The last error is re-raised once the attempts are used up.
+    """
+    attempt = 0
+    while True:
+        try:
+            return fn(*args, **kwargs)
+        except RETRYABLE as e:
+            attempt += 1
+            if attempt >= attempts:
+                raise
+            sleep(retry_delay(e, attempt, base_delay, max_delay))
+
+
+async def call_with_retries_async(
+    fn: Callable[..., Awaitable[T]],
+    *args: Any,
+    attempts: int = 6,
+    base_delay: float = 1.0,
+    max_delay: float = 60.0,
+    **kwargs: Any,
+) -> T:
+    """call_with_retries for coroutine functions: backs off with asyncio.sleep."""
+    attempt = 0
+    while True:
+        try:
+            return await fn(*args, **kwargs)
+        except RETRYABLE as e:
+            attempt += 1
+            if attempt >= attempts:
+                raise
+            await asyncio.sleep(retry_delay(e, attempt, base_delay, max_delay))
+
+
+def retry_delay(error: BaseException, attempt: int, base_delay: float, max_delay: float) -> float:
+    """
+    How long to wait before retrying after the attempt-th failure: the
+    larger of the jittered backoff and the server's retry-after.
+    """
+    delay = backoff_delay(attempt - 1, base_delay, max_delay)
+    hinted = retry_after(error)
+    if hinted is not None:
+        delay = max(delay, min(hinted, max_delay))
+    return delay
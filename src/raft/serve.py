@@ -11,7 +11,9 @@ be run from here without the training stack, so for those we print a
 short serving recipe instead.
 """
 
+import math
 import os
+from typing import Any, Dict, Optional
 
 from . import hx, state
 from .interactive import ask, bail
@@ -46,16 +48,40 @@ def is_local_adapter(name: str, model: str) -> bool:
     )
 
 
-def show_context(name: str, question: str) -> None:
-    """Print the retrieval preview for a question (chrome, stderr)."""
-    rows = preview_context(name, question)
+def show_context(
+    name: str,
+    question: str,
+    results: Optional[Dict[str, Any]] = None,
+    max_distance: float = math.inf,
+) -> None:
+    """
+    Print the retrieval preview for a question (chrome, stderr), from
+    query results already fetched for it if given, with each extract's
+    distance; those beyond max_distance are marked as not summarized.
+    """
+    rows = preview_context(name, question, results=results)
     if not rows:
         hx.say("(nothing embedded yet -- no retrieval context)")
         return
     hx.say("in context:")
     for row in rows:
         date = f" ({row['date']})" if row["date"] else ""
-        hx.say(f"  - {row['title']}{date}: {row['snippet']}")
+        distance = ""
+        if row["distance"] is not None:
+            gated = ", not summarized" if row["distance"] > max_distance else ""
+            distance = f" [{row['distance']:.3g}{gated}]"
+        hx.say(f"  - {row['title']}{date}{distance}: {row['snippet']}")
+
+
+def answer_turn(manager: MemoryManager, name: str, question: str, model: str) -> str:
+    """
+    One question: show what retrieval found, then the persona's answer.
+    The question is embedded and the store queried once, and the same
+    results serve the preview, the context and the summaries.
+    """
+    results = manager.query_memories([question, ""], store=False)
+    show_context(name, question, results=results, max_distance=manager.max_distance())
+    return manager.ask_question(question, model=model, results=results)
 
 
 def run_serve(name: str, model: str = "", standalone: bool = True) -> None:
@@ -90,6 +116,5 @@ def run_serve(name: str, model: str = "", standalone: bool = True) -> None:
         question = ask(f"To {target}", "").strip()
         if not question:
             return
-        show_context(name, question)
-        answer = manager.ask_question(question, model=model)
+        answer = answer_turn(manager, name, question, model)
         print(f"\n{answer}\n")
@@ -11,7 +11,7 @@ import glob
 import json
 import os
 from datetime import datetime, timezone
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Union
 
 # data/{name}<suffix> files that are pipeline artifacts, not corpora.
 ARTIFACT_SUFFIXES = (
@@ -91,6 +91,39 @@ def model_backend(name: str, model: str = "") -> str:
     return ""
 
 
+def embedding_backend(name: str) -> str:
+    """The dataset's embedding backend (see embedding_backends)."""
+    return load_meta(name).get("embedding_backend") or "openai"
+
+
+def retrieval_backend(name: str) -> str:
+    """Where read-only retrieval runs: "chroma", or "flat" (see flat_index)."""
+    return load_meta(name).get("retrieval_backend") or "chroma"
+
+
+def index_precision(name: str) -> str:
+    """How the flat index stores vectors: float32, float16 or int8."""
+    return load_meta(name).get("index_precision") or "float32"
+
+
+def dedup_threshold(name: str) -> float:
+    """
+    Similarity at which the dataset's chunks count as one copy before
+    embedding (see dedup); 0 when they are all kept.
+    """
+    return float(load_meta(name).get("dedup_threshold") or 0)
+
+
+def max_distance(name: str) -> Union[float, str]:
+    """
+    How far (squared L2) an extract may be from the question and still
+    be summarized: a distance, "auto" (calibrated on the interview
+    questions, see memories.gate_distance), or 0 when every extract is.
+    """
+    value = load_meta(name).get("max_distance") or 0
+    return value if value == "auto" else float(value)
+
+
 def test_questions(name: str) -> List[str]:
     """The test questions collected for this dataset."""
     return list(load_meta(name).get("test_questions", []))
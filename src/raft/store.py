@@ -0,0 +1,270 @@
+"""
+The vector store layer: one chroma client and collection per dataset,
+per process.
+
+Opening a PersistentClient means opening its SQLite database and
+loading the collection; ft:gen used to do that for every question and
+serve for every turn. Everything now asks this registry instead, which
+opens each dataset's store once, hands out the cached handle, and
+closes the clients at exit.
+"""
+
+import atexit
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from chromadb import PersistentClient
+
+from . import hx, state
+from .embedding_backends import EmbeddingBackend
+from .flat_index import FlatIndex, build_flat_index, index_dir
+
+# What collections embedded before 2.4 (which record no model) hold.
+LEGACY_EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# Records per chroma upsert: one SQLite transaction and one index update
+# per flush instead of per record. A crash loses at most one batch.
+WRITE_BATCH_SIZE = int(os.environ.get("RAFT_WRITE_BATCH_SIZE", "1000"))
+
+# Where read-only retrieval can run (see reader); recorded per dataset.
+RETRIEVAL_BACKENDS = ("chroma", "flat")
+
+_lock = threading.RLock()
+_clients: Dict[str, Any] = {}
+_collections: Dict[Tuple[str, str], Any] = {}
+# path -> (index.json mtime, FlatIndex)
+_flat: Dict[str, Tuple[float, FlatIndex]] = {}
+
+
+def store_path(name: str) -> str:
+    """
+    The absolute path of a dataset's chroma directory.
+
+    Absolute, because handles are cached per path and the relative
+    data/ resolves against whatever the working directory is.
+    """
+    return os.path.abspath(f"data/{name}")
+
+
+def exists(name: str) -> bool:
+    """
+    Whether the dataset has been embedded. Checked on disk: merely
+    constructing a PersistentClient would create the directory.
+    """
+    return os.path.exists(os.path.join(store_path(name), "chroma.sqlite3"))
+
+
+def client(name: str) -> Any:
+    """The dataset's chroma client, opened on first use."""
+    path = store_path(name)
+    with _lock:
+        if path not in _clients:
+            _clients[path] = PersistentClient(path=path)
+        return _clients[path]
+
+
+def collection(name: str) -> Optional[Any]:
+    """
+    The dataset's collection for reading, or None if it was never
+    embedded. Misses are not cached, so an embed later in the same
+    process is picked up.
+    """
+    key = (store_path(name), name)
+    with _lock:
+        if key in _collections:
+            return _collections[key]
+        if not exists(name):
+            return None
+        try:
+            found = client(name).get_collection(name)
+        except Exception:
+            return None
+        _collections[key] = found
+        return found
+
+
+def writable_collection(name: str, backend: EmbeddingBackend) -> Any:
+    """
+    The dataset's collection, created if needed, for writing vectors
+    from a backend.
+
+    The collection records the model its vectors come from. Vectors of
+    another model are incomparable (and usually of another dimension),
+    so if the dataset's backend changed, the old collection is dropped
+    and rebuilt from scratch.
+    """
+    key = (store_path(name), name)
+    with _lock:
+        found = _collections.get(key)
+        if found is None:
+            found = client(name).get_or_create_collection(
+                name, metadata={"embedding_model": backend.model}
+            )
+        stored = (found.metadata or {}).get("embedding_model", LEGACY_EMBEDDING_MODEL)
+        if stored != backend.model:
+            hx.warn(
+                f"data/{name} holds {stored} embeddings; rebuilding it for "
+                f"{backend.model}"
+            )
+            client(name).delete_collection(name)
+            found = client(name).create_collection(
+                name, metadata={"embedding_model": backend.model}
+            )
+        _collections[key] = found
+        return found
+
+
+def reader(name: str) -> Optional[Any]:
+    """
+    What read-only retrieval should query: the dataset's flat index
+    when it uses one and the snapshot exists, its collection otherwise
+    (None if never embedded). Both answer query() the same way.
+    """
+    if state.retrieval_backend(name) == "flat":
+        path = index_dir(name)
+        try:
+            mtime = os.path.getmtime(os.path.join(path, "index.json"))
+        except OSError:
+            mtime = None
+        if mtime is not None:
+            with _lock:
+                cached = _flat.get(path)
+                if cached is None or cached[0] != mtime:
+                    # A rebuilt snapshot replaces the old one. The old one
+                    # is not closed: a MemoryManager may still be querying
+                    # it. It holds no descriptor and is unmapped once the
+                    # last reference goes.
+                    _flat[path] = (mtime, FlatIndex(path))
+                return _flat[path][1]
+        hx.warn(f"no flat index for {name} yet -- querying chroma (re-run `raft embed`)")
+    return collection(name)
+
+
+def rebuild_flat_index(name: str) -> int:
+    """Snapshot the dataset's collection into its flat index."""
+    found = collection(name)
+    if found is None:
+        return 0
+    return build_flat_index(name, found, state.index_precision(name))
+
+
+def refresh_flat_index(name: str) -> bool:
+    """
+    Rebuild the dataset's flat index if it uses one and the snapshot
+    does not hold every record of the collection (ft:gen stored
+    questions since). Whether it was rebuilt.
+    """
+    if state.retrieval_backend(name) != "flat":
+        return False
+    found = collection(name)
+    if found is None:
+        return False
+    try:
+        with open(os.path.join(index_dir(name), "index.json")) as f:
+            indexed = json.load(f).get("count")
+    except (OSError, ValueError):
+        indexed = None
+    if indexed == found.count():
+        return False
+    rebuild_flat_index(name)
+    return True
+
+
+class UpsertBuffer:
+    """
+    Buffers records for a collection and upserts them in batches.
+
+    Use as a context manager: whatever is buffered is flushed on the way
+    out, also when leaving on an error or a KeyboardInterrupt.
+    """
+
+    def __init__(self, collection: Any, batch_size: int = WRITE_BATCH_SIZE):
+        self.collection = collection
+        self.batch_size = max(1, batch_size)
+        self.written = 0
+        # Called with (ids, embeddings, documents, metadatas) after each
+        # upsert (see FlatIndex.extend).
+        self.on_write: Optional[Callable[..., None]] = None
+        # id -> (embedding, document, metadata); a dict, so a record
+        # buffered twice is written once, last version wins (chroma
+        # rejects duplicate ids within one upsert).
+        self._pending: Dict[str, Tuple[List[float], str, Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def add(
+        self,
+        record_id: str,
+        embedding: List[float],
+        document: str,
+        metadata: Dict[str, Any],
+    ) -> None:
+        """Buffer a record, flushing once a batch is full."""
+        with self._lock:
+            self._pending[record_id] = (embedding, document, metadata)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self.flush()
+
+    def pending(self, record_id: str) -> Optional[List[float]]:
+        """The embedding of a buffered, not yet written record."""
+        with self._lock:
+            record = self._pending.get(record_id)
+        return record[0] if record else None
+
+    def flush(self) -> None:
+        """Upsert everything buffered, in one call per batch_size records."""
+        with self._lock:
+            records = list(self._pending.items())
+            self._pending = {}
+        for start in range(0, len(records), self.batch_size):
+            part = records[start : start + self.batch_size]
+            self.collection.upsert(
+                ids=[record_id for record_id, _ in part],
+                embeddings=[embedding for _, (embedding, _, _) in part],
+                documents=[document for _, (_, document, _) in part],
+                metadatas=[metadata for _, (_, _, metadata) in part],
+            )
+            self.written += len(part)
+            if self.on_write is not None:
+                self.on_write(
+                    [record_id for record_id, _ in part],
+                    [embedding for _, (embedding, _, _) in part],
+                    [document for _, (_, document, _) in part],
+                    [metadata for _, (_, _, metadata) in part],
+                )
+
+    def __enter__(self) -> "UpsertBuffer":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.flush()
+
+
+def upsert_buffer(
+    name: str, backend: EmbeddingBackend, batch_size: int = WRITE_BATCH_SIZE
+) -> UpsertBuffer:
+    """A write buffer for the dataset's collection (see UpsertBuffer)."""
+    # chroma caps the records per call, too
+    batch_size = min(batch_size, client(name).get_max_batch_size())
+    return UpsertBuffer(writable_collection(name, backend), batch_size)
+
+
+def close_all() -> None:
+    """Close every client opened by this process and forget the handles."""
+    with _lock:
+        _collections.clear()
+        clients = list(_clients.values())
+        _clients.clear()
+        for _, index in _flat.values():
+            index.close()
+        _flat.clear()
+    for opened in clients:
+        try:
+            opened.close()
+        except Exception:
+            pass
+
+
+atexit.register(close_all)
@@ -0,0 +1,42 @@
+"""
+The tiktoken encodings raft counts tokens with, loaded on first use and
+shared by every module.
+
+Loading an encoding means reading its BPE ranks and building the
+tokenizer, about a tenth of a second each. The chunker, ft file
+generation and the embedding backends used to do that at import time,
+so even `raft --help` paid for it; now only the first count does, once
+per process.
+"""
+
+import threading
+from typing import Any, Dict
+
+_lock = threading.Lock()
+# encoding name -> tiktoken.Encoding
+_encodings: Dict[str, Any] = {}
+
+
+def get_encoding(name: str) -> Any:
+    """A tiktoken encoding by name (cl100k_base, o200k_base, ...)."""
+    found = _encodings.get(name)
+    if found is None:
+        with _lock:
+            if name not in _encodings:
+                import tiktoken
+
+                _encodings[name] = tiktoken.get_encoding(name)
+            found = _encodings[name]
+    return found
+
+
+def encoding_name(model: str) -> str:
+    """The name of the encoding a model tokenizes with (nothing loaded)."""
+    from tiktoken.model import encoding_name_for_model
+
+    return encoding_name_for_model(model)
+
+
+def encoding_for_model(model: str) -> Any:
+    """The encoding a model tokenizes with, shared with its other users."""
+    return get_encoding(encoding_name(model))
@@ -290,7 +290,6 @@ def run_tweet_mode(name: str = "", target: str = "", standalone: bool = True) ->
     hx.say(f"  raft ft:gen {name}  # generate the finetune dataset")
     hx.say(f"  raft ft:run {name}  # run the finetune")
     if confirm("Run chunk + embed now?", default=False):
-        from . import embeddings_helpers, files_helper
+        from . import embeddings_helpers
 
-        files_helper.chunker(name)
-        embeddings_helpers.store_grounding_embeddings(name)
+        embeddings_helpers.chunk_and_embed(name)
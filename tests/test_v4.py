@@ -0,0 +1,1579 @@
+"""
+Tests for the 2.4 retrieval pipeline work: batched embedding, the
+embedding cache, the grounding store and the flat index.
+
+Everything here is offline -- the OpenAI client is replaced by
+FakeEmbeddingsClient, which embeds deterministically and counts calls.
+
+    python -m unittest discover tests
+"""
+
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+
+from raft import embedding_backends, embeddings_helpers, flat_index, ratelimit, state, store
+from raft.cache import SqliteLRUCache
+
+
+class FakeEmbeddingsClient:
+    """Stands in for OpenAI(): embeddings.create returns one 3-d vector
+    per input (derived from its length) and records every call."""
+
+    def __init__(self) -> None:
+        self.calls: list = []
+        self.embeddings = self
+
+    def create(self, input, model):
+        texts = [input] if isinstance(input, str) else list(input)
+        self.calls.append(texts)
+        data = [
+            SimpleNamespace(index=i, embedding=[float(len(t)), 1.0, 0.0])
+            for i, t in enumerate(texts)
+        ]
+        # out of order on purpose: callers must map by index
+        return SimpleNamespace(data=list(reversed(data)))
+
+
+class FakeOpenAIEndpoint:
+    """
+    A local HTTP server speaking just enough of POST /v1/embeddings and
+    /v1/chat/completions for the real OpenAI clients: random latency,
+    and the first `throttle` requests answered 429 with a retry-after-ms
+    hint.
+    """
+
+    def __init__(self, throttle: int = 0) -> None:
+        self.requests = 0
+        self.throttled = 0
+        self.lock = threading.Lock()
+        endpoint = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with endpoint.lock:
+                    endpoint.requests += 1
+                    limited = endpoint.throttled < throttle
+                    endpoint.throttled += limited
+                if limited:
+                    payload = {"error": {"message": "slow down", "type": "rate_limit"}}
+                    self.send_response(429)
+                    self.send_header("retry-after-ms", "20")
+                elif self.path.endswith("/chat/completions"):
+                    payload = {
+                        "id": "c", "object": "chat.completion", "created": 0, "model": body["model"],
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": "a memory"}}],
+                    }
+                    self.send_response(200)
+                else:
+                    time.sleep(random.uniform(0, 0.02))
+                    payload = {
+                        "object": "list",
+                        "model": body["model"],
+                        "usage": {"prompt_tokens": 0, "total_tokens": 0},
+                        "data": [
+                            {"object": "embedding", "index": i,
+                             "embedding": [float(len(t)), 1.0, 0.0]}
+                            for i, t in enumerate(body["input"])
+                        ],
+                    }
+                    self.send_response(200)
+                raw = json.dumps(payload).encode()
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def client(self):
+        from openai import OpenAI
+
+        host, port = self.server.server_address
+        return OpenAI(base_url=f"http://{host}:{port}/v1", api_key="test", max_retries=0)
+
+    def environ(self) -> dict:
+        """Points clients created from the environment at this server."""
+        host, port = self.server.server_address
+        return {"OPENAI_BASE_URL": f"http://{host}:{port}/v1", "OPENAI_API_KEY": "test"}
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TempCwdTestCase(unittest.TestCase):
+    """Run each test in a throwaway working directory (modules write to data/)."""
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.mkdtemp()
+        self.old_cwd = os.getcwd()
+        os.chdir(self.tmp)
+        os.makedirs("data", exist_ok=True)
+        self.client = FakeEmbeddingsClient()
+        patcher = mock.patch.object(
+            embedding_backends, "_get_client", return_value=self.client
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self) -> None:
+        store.close_all()
+        os.chdir(self.old_cwd)
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def write_corpus(self, name: str, posts: int, lines: int = 3) -> None:
+        with open(f"data/{name}.jsonl", "w") as f:
+            for i in range(posts):
+                content = "\n".join(f"post {i} line {j} " + "word " * (j * 40) for j in range(lines))
+                f.write(json.dumps({
+                    "title": f"post {i}", "link": f"https://x/{i}",
+                    "date": f"2024-01-{1 + i % 28:02d}", "content": content,
+                }) + "\n")
+
+    def write_chunks(self, name: str, chunks: list) -> None:
+        with open(f"data/{name}_chunked.jsonl", "w") as f:
+            for metadata, document in chunks:
+                f.write(json.dumps([metadata, document]) + "\n")
+
+
+def chunk(title: str, document: str, part: int = 1, date: str = "2024-01-01"):
+    return (
+        {
+            "title": title,
+            "url": f"https://x/{title}",
+            "date": date,
+            "total_parts": "1",
+            "part": str(part),
+        },
+        document,
+    )
+
+
+class TestBatchedEmbedding(TempCwdTestCase):
+    def test_batches_respect_item_and_token_budgets(self):
+        items = [(i, "word " * 10) for i in range(7)]
+        by_items = list(embeddings_helpers.batch_by_budget(items, 10_000, 3))
+        self.assertEqual([len(b) for b in by_items], [3, 3, 1])
+        by_tokens = list(embeddings_helpers.batch_by_budget(items, 25, 100))
+        self.assertEqual([len(b) for b in by_tokens], [2, 2, 2, 1])
+        # an over-budget text still goes out, alone
+        huge = list(embeddings_helpers.batch_by_budget([(0, "a " * 50), (1, "b")], 10, 5))
+        self.assertEqual([len(b) for b in huge], [1, 1])
+
+    def test_vectors_map_back_to_their_keys(self):
+        batches = list(
+            embeddings_helpers.embed_in_batches([("a", "x"), ("b", "xyz")], max_items=5)
+        )
+        self.assertEqual(len(self.client.calls), 1)
+        self.assertEqual(
+            batches, [[("a", [1.0, 1.0, 0.0]), ("b", [3.0, 1.0, 0.0])]]
+        )
+
+    def test_get_embedding_is_a_one_item_batch(self):
+        self.assertEqual(embeddings_helpers.get_embedding("abcd"), [4.0, 1.0, 0.0])
+        self.assertEqual(self.client.calls, [["abcd"]])
+
+    def test_store_grounding_embeddings_batches_requests(self):
+        self.write_chunks("ds1", [chunk(f"t{i}", f"doc {i}") for i in range(5)])
+        embeddings_helpers.store_grounding_embeddings("ds1", max_items=2)
+        self.assertEqual(sorted(len(c) for c in self.client.calls), [1, 2, 2])
+
+        collection = store.collection("ds1")
+        self.assertEqual(collection.count(), 5)
+        got = collection.get(
+            ids=embeddings_helpers.chunk_id(*chunk("t3", "doc 3")),
+            include=["documents", "metadatas"],
+        )
+        self.assertEqual(got["documents"], ["doc 3"])
+        self.assertEqual(got["metadatas"][0]["date_num"], 20240101)
+
+
+class TestIncrementalEmbed(TempCwdTestCase):
+    def collection(self):
+        return store.writable_collection("ds1", embedding_backends.get_backend())
+
+    def test_same_title_no_longer_collides(self):
+        self.write_chunks("ds1", [chunk("t", "one"), chunk("t", "two")])
+        counts = embeddings_helpers.store_grounding_embeddings("ds1")
+        self.assertEqual(counts["added"], 2)
+        self.assertEqual(self.collection().count(), 2)
+
+    def test_rerun_is_a_sync(self):
+        # a pre-2.4 chunk and an ft:gen question already in the store
+        self.collection().upsert(
+            ids=["old_part_1", "question1"],
+            embeddings=[[0.0, 1.0, 0.0], [0.0, 0.0, 1.0]],
+            documents=["old", "why?"],
+            metadatas=[
+                {"title": "old", "part": "1", "total_parts": "1"},
+                {"participants": "a, b", "date_num": 0},
+            ],
+        )
+        self.write_chunks("ds1", [chunk("a", "kept"), chunk("b", "dropped")])
+        first = embeddings_helpers.store_grounding_embeddings("ds1")
+        self.assertEqual(first, {"added": 2, "unchanged": 0, "removed": 1})
+
+        self.write_chunks("ds1", [chunk("a", "kept"), chunk("c", "new")])
+        calls = len(self.client.calls)
+        second = embeddings_helpers.store_grounding_embeddings("ds1")
+        self.assertEqual(second, {"added": 1, "unchanged": 1, "removed": 1})
+        self.assertEqual(self.client.calls[calls:], [["new"]])
+        self.assertEqual(
+            sorted(self.collection().get()["documents"]), ["kept", "new", "why?"]
+        )
+
+    def test_changed_metadata_is_updated_without_embedding(self):
+        self.write_chunks("ds1", [chunk("a", "kept"), chunk("b", "other")])
+        embeddings_helpers.store_grounding_embeddings("ds1", index="flat")
+        redated = chunk("a", "kept", date="2024-03-05")
+        redated[0]["title"] = "a, retitled"
+        self.write_chunks("ds1", [redated, chunk("b", "other")])
+        calls = len(self.client.calls)
+        again = embeddings_helpers.store_grounding_embeddings("ds1")
+        self.assertEqual(again, {"added": 0, "unchanged": 2, "removed": 0})
+        self.assertEqual(self.client.calls[calls:], [])
+        record_id = embeddings_helpers.chunk_id(*redated)
+        stored = self.collection().get(ids=[record_id], include=["metadatas"])["metadatas"][0]
+        self.assertEqual(
+            (stored["title"], stored["date"], stored["date_num"]), ("a, retitled", "2024-03-05", 20240305)
+        )
+        # and the flat snapshot rebuilt from the collection
+        found = store.reader("ds1").query(query_embeddings=[[4.0, 1.0, 0.0]], n_results=1)
+        self.assertEqual(found["metadatas"][0][0]["date_num"], 20240305)
+        # nothing left to update
+        with mock.patch.object(embeddings_helpers.hx, "say") as say:
+            embeddings_helpers.store_grounding_embeddings("ds1")
+        self.assertFalse(any("metadata" in c.args[0] for c in say.call_args_list))
+
+
+class TestRateLimitedWorkers(TempCwdTestCase):
+    def endpoint(self, throttle: int = 0) -> FakeOpenAIEndpoint:
+        endpoint = FakeOpenAIEndpoint(throttle)
+        self.addCleanup(endpoint.close)
+        patcher = mock.patch.object(
+            embedding_backends, "_get_client", return_value=endpoint.client()
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return endpoint
+
+    def test_concurrent_batches_come_back_in_order_through_429s(self):
+        endpoint = self.endpoint(throttle=3)
+        texts = [("k%d" % i, "x" * (i + 1)) for i in range(24)]
+        with mock.patch.object(ratelimit, "backoff_delay", return_value=0.0):
+            batches = list(
+                embeddings_helpers.embed_in_batches(
+                    texts, max_items=2, workers=4,
+                    limiter=ratelimit.RateLimiter(10_000, 10_000_000),
+                )
+            )
+        flat = [pair for batch in batches for pair in batch]
+        self.assertEqual([k for k, _ in flat], [k for k, _ in texts])
+        self.assertEqual([v[0] for _, v in flat], [float(i + 1) for i in range(24)])
+        self.assertEqual(endpoint.requests, 12 + 3)
+
+    def test_throttled_workers_lower_the_requests_in_flight(self):
+        endpoint = self.endpoint(throttle=3)
+        backend = embedding_backends.OpenAIEmbeddingBackend()
+        texts = [("k%d" % i, "x" * (i + 1)) for i in range(24)]
+        with mock.patch.object(ratelimit, "backoff_delay", return_value=0.0):
+            batches = list(embeddings_helpers.embed_in_batches(
+                texts, max_items=2, workers=4, limiter=ratelimit.RateLimiter(10_000, 10_000_000), backend=backend,
+            ))
+        self.assertEqual(len(batches), 12)
+        self.assertEqual(endpoint.requests, 12 + 3)
+        self.assertLess(backend.concurrency.limit, embedding_backends.EMBED_MAX_CONCURRENCY)
+        self.assertEqual(backend.concurrency.in_flight, 0)
+
+    def test_retry_honours_retry_after_over_backoff(self):
+        self.endpoint(throttle=1)
+        waits = []
+        with mock.patch.object(ratelimit, "backoff_delay", return_value=0.001):
+            ratelimit.call_with_retries(
+                embedding_backends._get_client().embeddings.create,
+                input=["a"], model="m", sleep=waits.append,
+            )
+        self.assertEqual(waits, [0.02])
+
+    def test_non_retryable_errors_are_not_retried(self):
+        calls = []
+
+        def bad():
+            calls.append(1)
+            raise ValueError("no")
+
+        with self.assertRaises(ValueError):
+            ratelimit.call_with_retries(bad, sleep=lambda _: None)
+        self.assertEqual(calls, [1])
+
+    def test_token_bucket_paces_requests(self):
+        limiter = ratelimit.RateLimiter(requests_per_minute=60, tokens_per_minute=600)
+        waits = []
+        limiter.acquire(600, sleep=waits.append)  # the whole first minute
+        self.assertEqual(waits, [])
+        with mock.patch.object(ratelimit.time, "monotonic", return_value=limiter.tokens.updated):
+            self.assertAlmostEqual(limiter.tokens.wait_time(100), 10.0)
+            self.assertAlmostEqual(limiter.requests.wait_time(1), 0.0)
+
+
+class TestAdaptiveConcurrency(TempCwdTestCase):
+    def throttled(self) -> Exception:
+        import httpx
+        import openai
+
+        response = httpx.Response(429, request=httpx.Request("POST", "http://x/v1/chat"))
+        return openai.RateLimitError("slow down", response=response, body=None)
+
+    def test_additive_increase_multiplicative_decrease(self):
+        limiter = ratelimit.AdaptiveConcurrency(minimum=1, maximum=8, initial=2)
+        for _ in range(60):
+            limiter.call(lambda: None)
+        self.assertEqual(limiter.limit, 8.0)
+
+        def throttled():
+            raise self.throttled()
+
+        with self.assertRaises(Exception):
+            limiter.call(throttled)
+        self.assertEqual(limiter.limit, 4.0)
+        limiter._decreased = float("-inf")
+        limiter.latency = 0.001
+        with mock.patch.object(ratelimit.time, "monotonic", side_effect=[0.0, 1.0, 1.0]):
+            limiter.call(lambda: None)  # a 1 s call: a latency spike
+        self.assertEqual(limiter.limit, 2.0)
+        for _ in range(5):
+            limiter._decreased = float("-inf")
+            limiter.acquire()
+            limiter.release(overloaded=True)
+        self.assertEqual(limiter.limit, 1.0)  # never below the minimum
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_calls_in_flight_stay_under_the_limit(self):
+        limiter = ratelimit.AdaptiveConcurrency(minimum=1, maximum=3, initial=3)
+        lock = threading.Lock()
+        running, peak = [0], [0]
+
+        def work():
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.005)
+            with lock:
+                running[0] -= 1
+
+        threads = [threading.Thread(target=limiter.call, args=(work,)) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(peak[0], 3)
+
+    def test_generation_runs_at_the_pace_of_the_api(self):
+        from raft import generate_finetune, memories
+
+        self.write_chunks("ds1", [chunk(f"t{i}", f"text number {i}") for i in range(5)])
+        embeddings_helpers.store_grounding_embeddings("ds1", backend="hashing")
+        exchanges = [[f"question {i}?", f"answer {i}"] for i in range(6)]
+        with open("data/ds1_transcript_1.json", "w") as f:
+            json.dump({"participants": {"q": "Q", "a": "A"}, "date": "2024-02-01",
+                       "url": "https://x/talk", "exchanges": exchanges}, f)
+
+        async def summarize(document, question, prev_answer, **kwargs):
+            await asyncio.sleep(0.05)
+            return f"{question} / {prev_answer}"
+
+        with (
+            mock.patch("raft.memories.AsyncPromptManager", autospec=True) as prompts,
+            mock.patch.object(memories, "SUMMARY_CACHE_MB", 0),
+            mock.patch.object(memories, "SUMMARY_BATCHED", False),  # a request per memory
+        ):
+            prompts.return_value.summarize_memory.side_effect = summarize
+            started = time.monotonic()
+            generate_finetune.generate_finetune("ds1")
+            elapsed = time.monotonic() - started
+
+        # 30 summaries of 50 ms: concurrent, and no fixed pauses
+        self.assertLess(elapsed, 30 * 0.05 / 2)
+        with open("data/ds1_finetune.json") as f:
+            items = json.load(f)
+        self.assertEqual(items[0]["metadata"]["participants"], {"q": "Q", "a": "A"})
+        examples = [item["example"] for item in items[1:]]
+        self.assertEqual([e["question"] for e in examples], [q for q, _ in exchanges])
+        self.assertIn("question 3? / answer 2", examples[3]["similar_memories"])
+        self.assertGreater(memories.summary_limiter().limit, memories.SUMMARY_CONCURRENCY)
+
+    def test_a_429_from_the_api_lowers_the_limit(self):
+        import openai
+
+        from raft import aio
+        from raft.prompt_manager import AsyncPromptManager
+
+        endpoint = FakeOpenAIEndpoint(throttle=1)
+        self.addCleanup(endpoint.close)
+        limiter = ratelimit.AsyncAdaptiveConcurrency(initial=8)
+        with mock.patch.dict(os.environ, endpoint.environ()), mock.patch.dict(aio._clients, clear=True):
+            with self.assertRaises(openai.RateLimitError):
+                aio.run(limiter.call_async(AsyncPromptManager().summarize_memory, "memory", "q?", "", "A"))
+            self.assertEqual(endpoint.requests, 1)  # the client did not retry it on its own
+            self.assertEqual(limiter.limit, 4.0)
+            self.assertEqual(limiter.in_flight, 0)
+            summary = aio.run(limiter.call_async(AsyncPromptManager().summarize_memory, "memory", "q?", "", "A"))
+        self.assertEqual(summary, "a memory")
+
+
+class TestEmbeddingBackends(TempCwdTestCase):
+    def test_hashing_backend_is_deterministic_and_normalised(self):
+        backend = embedding_backends.get_backend("hashing")
+        a, b, c = backend.embed(
+            ["parrots are stochastic", "Stochastic parrots!", "the weather in Rome"]
+        )
+        self.assertEqual(a, backend.embed(["parrots are stochastic"])[0])
+        self.assertAlmostEqual(sum(v * v for v in a), 1.0)
+
+        def dot(x, y):
+            return sum(p * q for p, q in zip(x, y))
+
+        self.assertGreater(dot(a, b), dot(a, c))
+
+    def test_unknown_backend_is_rejected(self):
+        with self.assertRaises(ValueError):
+            embedding_backends.get_backend("nope")
+
+    def test_a_backend_without_embed_cannot_be_created(self):
+        class Partial(embedding_backends.EmbeddingBackend):
+            name = "partial"
+
+        with self.assertRaises(TypeError):
+            Partial()
+
+    def test_offline_pipeline_with_the_local_backend(self):
+        from raft.memories import preview_context
+
+        self.write_chunks(
+            "ds1",
+            [chunk("birds", "parrots repeat what they hear"),
+             chunk("food", "pasta needs salted water")],
+        )
+        embeddings_helpers.store_grounding_embeddings("ds1", backend="hashing")
+        self.assertEqual(state.embedding_backend("ds1"), "hashing")
+        rows = preview_context("ds1", "why do parrots repeat things?")
+        self.assertEqual(rows[0]["title"], "birds")
+        self.assertEqual(self.client.calls, [])
+
+    def test_switching_backend_rebuilds_the_collection(self):
+        self.write_chunks("ds1", [chunk("t", "some text")])
+        embeddings_helpers.store_grounding_embeddings("ds1")
+        counts = embeddings_helpers.store_grounding_embeddings("ds1", backend="hashing")
+        self.assertEqual(counts["added"], 1)
+        collection = store.collection("ds1")
+        self.assertEqual(collection.metadata["embedding_model"], "hashing-512")
+
+
+class TestStoreRegistry(TempCwdTestCase):
+    def test_unembedded_dataset_stays_unembedded(self):
+        self.assertIsNone(store.collection("ds1"))
+        self.assertFalse(os.path.exists("data/ds1"))
+
+    def test_one_client_per_dataset_across_threads(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        with mock.patch.object(store, "PersistentClient", wraps=store.PersistentClient) as opened:
+            with ThreadPoolExecutor(8) as pool:
+                clients = list(pool.map(lambda _: store.client("ds1"), range(16)))
+        self.assertEqual(opened.call_count, 1)
+        self.assertTrue(all(c is clients[0] for c in clients))
+
+    def test_handles_are_reused_by_every_caller(self):
+        from raft.memories import MemoryManager, preview_context
+
+        self.write_chunks("ds1", [chunk("t", "some text")])
+        embeddings_helpers.store_grounding_embeddings("ds1", backend="hashing")
+        with mock.patch.object(store, "PersistentClient") as opened:
+            manager = MemoryManager("ds1", {})
+            preview_context("ds1", "text")
+            preview_context("ds1", "more text")
+        opened.assert_not_called()
+        self.assertIs(manager.collection, store.collection("ds1"))
+
+
+class TestBufferedWrites(TempCwdTestCase):
+    def test_upserts_go_out_in_write_batches(self):
+        self.write_chunks("ds1", [chunk(f"t{i}", f"doc {i}") for i in range(7)])
+        collection = store.writable_collection("ds1", embedding_backends.get_backend("hashing"))
+        with mock.patch.object(collection, "upsert", wraps=collection.upsert) as upsert:
+            embeddings_helpers.store_grounding_embeddings(
+                "ds1", backend="hashing", write_batch_size=3
+            )
+        self.assertEqual([len(c.kwargs["ids"]) for c in upsert.call_args_list], [3, 3, 1])
+        self.assertEqual(collection.count(), 7)
+
+    def test_buffer_is_flushed_on_interrupt(self):
+        collection = store.writable_collection("ds1", embedding_backends.get_backend("hashing"))
+        with self.assertRaises(KeyboardInterrupt):
+            with store.UpsertBuffer(collection, batch_size=10) as writer:
+                writer.add("a", [1.0] * 512, "doc a", {"date_num": 0})
+                writer.add("b", [0.5] * 512, "doc b", {"date_num": 0})
+                self.assertEqual(collection.count(), 0)
+                raise KeyboardInterrupt
+        self.assertEqual(collection.count(), 2)
+
+    def test_generation_buffers_questions_until_flush(self):
+        from raft.memories import MemoryManager
+
+        self.write_chunks("ds1", [chunk("t", "some text")])
+        embeddings_helpers.store_grounding_embeddings("ds1", backend="hashing")
+        manager = MemoryManager("ds1", {})
+        manager.get_similar_extracts(["what text?", ""], store=True)
+        manager.get_similar_extracts(["which words?", ""], store=True)
+        self.assertEqual(manager.collection.count(), 1)
+        manager.flush()
+        self.assertEqual(manager.collection.count(), 3)
+
+
+class TestEmbeddingCache(TempCwdTestCase):
+    def test_lru_eviction_by_size(self):
+        cache = SqliteLRUCache("data/c.sqlite3", max_bytes=30)
+        cache.put("a", b"x" * 10)
+        cache.put("b", b"x" * 10)
+        cache.put("c", b"x" * 10)
+        self.assertEqual(cache.get("a"), b"x" * 10)  # a is now fresher than b
+        cache.put("d", b"x" * 10)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(len(cache), 3)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        cache.close()
+        # persisted, size accounting included
+        reopened = SqliteLRUCache("data/c.sqlite3", max_bytes=30)
+        self.assertEqual(reopened.get("d"), b"x" * 10)
+        reopened.close()
+
+    def test_repeat_texts_are_served_from_disk(self):
+        first = embeddings_helpers.get_embeddings(["abc", "abcdef", "abc"])
+        self.assertEqual(self.client.calls, [["abc", "abcdef"]])
+        again = embeddings_helpers.get_embeddings(["abcdef", "abc", "z"])
+        self.assertEqual(self.client.calls[1:], [["z"]])
+        self.assertEqual(again[:2], [first[1], first[0]])
+        self.assertTrue(os.path.exists(embeddings_helpers.EMBEDDING_CACHE_PATH))
+
+    def test_query_paths_share_the_cache(self):
+        from raft.memories import preview_context
+
+        self.write_chunks("ds1", [chunk("t", "the doc")])
+        embeddings_helpers.store_grounding_embeddings("ds1")
+        embeddings_helpers.get_embedding("a question")
+        calls = len(self.client.calls)
+        preview_context("ds1", "a question")
+        self.assertEqual(len(self.client.calls), calls)
+
+    def test_workers_starting_at_once_share_one_cache_and_limiter(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        def slow_cache(*args):
+            time.sleep(0.05)  # every worker gets here before the first is done
+            return SqliteLRUCache(*args)
+
+        start = threading.Barrier(8)
+
+        def first_use(_):
+            start.wait()
+            return embeddings_helpers.embedding_cache(), embeddings_helpers.rate_limiter()
+
+        with (
+            mock.patch.dict(embeddings_helpers._caches, clear=True),
+            mock.patch.object(embeddings_helpers, "_limiter", None),
+            mock.patch.object(embeddings_helpers, "SqliteLRUCache", side_effect=slow_cache) as made,
+            mock.patch.object(embeddings_helpers, "RateLimiter", side_effect=lambda *a: time.sleep(0.05) or object()),
+            ThreadPoolExecutor(8) as pool,
+        ):
+            got = list(pool.map(first_use, range(8)))
+        self.assertEqual(made.call_count, 1)
+        self.assertEqual(len({id(cache) for cache, _ in got}), 1)
+        self.assertEqual(len({id(limiter) for _, limiter in got}), 1)
+
+
+class TestFlatIndex(TempCwdTestCase):
+    TOPICS = ["parrots", "pasta", "rome", "weather", "chess", "rivers", "jazz"]
+
+    def corpus(self, n=60):
+        # topic words plus filler, so no two chunks tie on distance
+        rng = random.Random(7)
+        words = self.TOPICS + [f"filler{j}" for j in range(200)]
+        return [
+            chunk(
+                f"post {i}",
+                " ".join(rng.choice(words) for _ in range(rng.randint(5, 30))),
+                date=f"2024-01-{1 + i % 28:02d}",
+            )
+            for i in range(n)
+        ]
+
+    def test_top_k_matches_chroma(self):
+        self.write_chunks("ds1", self.corpus())
+        embeddings_helpers.store_grounding_embeddings("ds1", backend="hashing", index="flat")
+        flat = store.reader("ds1")
+        self.assertIsInstance(flat, flat_index.FlatIndex)
+        self.assertEqual(flat.count(), 60)
+        # random (about unit length) directions: lexical queries tie on
+        # distance too often for the order to be comparable
+        rng = random.Random(11)
+        queries = [[rng.gauss(0, 1) / 512**0.5 for _ in range(512)] for _ in range(4)]
+        where = {"date_num": {"$lt": 20240110}}
+        for kwargs in ({}, {"where": where}):
+            expected = store.collection("ds1").query(
+                query_embeddings=queries, n_results=5, include=["distances"], **kwargs
+            )
+            got = flat.query(queries, n_results=5, include=["distances"], **kwargs)
+            self.assertEqual(got["ids"], expected["ids"])
+            for a, b in zip(got["distances"], expected["distances"]):
+                for x, y in zip(a, b):
+                    self.assertAlmostEqual(x, y, places=4)
+
+    def test_reduced_precision_rescoring_keeps_the_top_k(self):
+        self.write_chunks("ds1", self.corpus())
+        embeddings_helpers.store_grounding_embeddings(
+            "ds1", backend="hashing", index="flat", precision="int8"
+        )
+        self.assertEqual(state.index_precision("ds1"), "int8")
+        flat = store.reader("ds1")
+        self.assertEqual(flat.vectors.dtype, "int8")
+        rng = random.Random(11)
+        queries = [[rng.gauss(0, 1) / 512**0.5 for _ in range(512)] for _ in range(4)]
+        expected = store.collection("ds1").query(
+            query_embeddings=queries, n_results=5, include=["distances"]
+        )
+        got = flat.query(queries, n_results=5, include=["distances"])
+        self.assertEqual(got["ids"], expected["ids"])
+        for a, b in zip(got["distances"], expected["distances"]):
+            for x, y in zip(a, b):
+                self.assertAlmostEqual(x, y, places=4)  # float32, not int8
+        with self.assertRaises(ValueError):
+            embeddings_helpers.store_grounding_embeddings("ds1", precision="int4")
+
+    def test_date_filter_skips_later_and_undated_records(self):
+        self.write_chunks(
+            "ds1",
+            [chunk("old", "parrots talk", date="2020-05-01"),
+             chunk("new", "parrots talk a lot", date="2024-05-01")],
+        )
+        embeddings_helpers.store_grounding_embeddings("ds1", backend="hashing", index="flat")
+        store.collection("ds1").upsert(
+            ids=["undated"], embeddings=[[0.0] * 512], documents=["parrots"], metadatas=[{"title": "u"}]
+        )
+        store.rebuild_flat_index("ds1")
+        flat = store.reader("ds1")
+        self.assertTrue(flat.dated)
+        got = flat.query(
+            [embedding_backends.get_backend("hashing").embed(["parrots"])[0]],
+            n_results=5,
+            where={"date_num": {"$lt": 20230101}},
+        )
+        self.assertEqual([m["title"] for m in got["metadatas"][0]], ["old"])
+
+    def test_date_bounded_queries_scan_only_earlier_rows(self):
+        chunks = self.corpus()
+        chunks[3] = chunk("undated", chunks[3][1], date="")
+        self.write_chunks("ds1", chunks)
+        embeddings_helpers.store_grounding_embeddings("ds1", backend="hashing", index="flat")
+        flat = store.reader("ds1")
+        self.assertTrue(flat.date_sorted)
+        self.assertTrue((np.diff(flat.date_num) >= 0).all())
+        queries = embedding_backends.get_backend("hashing").embed(["parrots and pasta", "jazz in rome"])
+        where = {"date_num": {"$lt": 20240105}}
+        eligible = [i for i, d in enumerate(flat.date_num) if 0 <= d < 20240105]
+        with mock.patch.object(flat, "_scan", wraps=flat._scan) as scan:
+            got = flat.query(queries, n_results=5, where=where)
+        self.assertEqual(scan.call_args.args[1:], (eligible[0], eligible[-1] + 1))
+        self.assertTrue(all(m["date_num"] < 20240105 for row in got["metadatas"] for m in row))
+
+        flat.date_sorted = False  # the mask of older snapshots finds the same
+        self.assertEqual(flat.query(queries, n_results=5, where=where)["ids"], got["ids"])
+
+    def test_appended_records_are_searched_exactly(self):
+        self.write_chunks("ds1", self.corpus(4))
+        embeddings_helpers.store_grounding_embeddings("ds1", backend="hashing", index="flat")
+        flat = store.reader("ds1")
+        rng = np.random.default_rng(0)
+        vectors = rng.normal(size=(50, flat.vectors.shape[1])).astype(np.float32)
+        dates = [20240101 + i % 20 for i in range(50)]
+        flat.extend([f"q{i}" for i in range(50)], vectors.tolist(), [f"question {i}" for i in range(50)],
+                    [{"date_num": d} for d in dates])
+        rows = [(flat._record(row)[0], np.asarray(flat.full[row]), int(flat.date_num[row]))
+                for row in range(flat.count())]
+        everything = rows + [(f"q{i}", vectors[i], dates[i]) for i in range(50)]
+        queries = vectors[:3] + 0.01
+        got = flat.query(queries.tolist(), n_results=3, where={"date_num": {"$lt": 20240110}})
+        for query, ids in zip(queries, got["ids"]):
+            eligible = [(float(((v - query) ** 2).sum()), i) for i, v, d in everything if 0 <= d < 20240110]
+            self.assertEqual(ids, [i for _, i in sorted(eligible)[:3]])
+
+    def test_generation_reads_the_snapshot_and_its_own_questions(self):
+        from raft import generate_finetune
+
+        self.write_chunks("ds1", self.corpus(20))
+        embeddings_helpers.store_grounding_embeddings("ds1", backend="hashing", index="flat")
+        for i, date in enumerate(["2024-02-01", "2024-03-01"], 1):
+            with open(f"data/ds1_transcript_{i}.json", "w") as f:
+                json.dump({"participants": {"q": "Q", "a": "A"}, "date": date, "url": f"https://x/talk{i}",
+                           "exchanges": [["do parrots talk about pasta?", "yes"]]}, f)
+        flat = store.reader("ds1")
+        queried = []
+        original = flat.query
+        flat.query = lambda *args, **kwargs: queried.append(original(*args, **kwargs)) or queried[-1]
+        with (
+            mock.patch.object(store.collection("ds1"), "query") as chroma_query,
+            mock.patch("raft.memories.AsyncPromptManager", autospec=True) as prompts,
+        ):
+            prompts.return_value.summarize_memories.side_effect = lambda memories, *a, **k: ["skip"] * len(memories)
+            generate_finetune.generate_finetune("ds1")
+        chroma_query.assert_not_called()
+        # the second interview remembers the first one's question
+        self.assertIn("do parrots talk about pasta?", queried[1]["documents"][0])
+        self.assertEqual(store.reader("ds1").count(), 22)  # snapshotted at the end
+
+    def test_serving_reads_the_snapshot_and_sees_rebuilds(self):
+        from raft.memories import MemoryManager, preview_context
+
+        self.write_chunks("ds1", [chunk("birds", "parrots repeat what they hear")])
+        embeddings_helpers.store_grounding_embeddings("ds1", backend="hashing", index="flat")
+        manager = MemoryManager("ds1", {})
+        with mock.patch.object(manager.collection, "query") as chroma_query:
+            similar = manager.get_similar_extracts(["parrots?", ""], store=False)
+        chroma_query.assert_not_called()
+        self.assertEqual(similar[0]["document"], "parrots repeat what they hear")
+
+        time.sleep(0.01)  # a distinct index.json mtime
+        self.write_chunks("ds1", [chunk("food", "pasta needs salted water")])
+        embeddings_helpers.store_grounding_embeddings("ds1")
+        self.assertEqual(preview_context("ds1", "pasta water")[0]["title"], "food")
+
+    def test_replaced_snapshots_release_their_files(self):
+        def deleted_snapshot_files():
+            found = []
+            for fd in os.listdir("/proc/self/fd"):
+                try:
+                    target = os.readlink(f"/proc/self/fd/{fd}")
+                except OSError:
+                    continue  # closed meanwhile
+                if target.startswith(os.path.join(self.tmp, "data", "ds1", "flat", "")) and target.endswith("(deleted)"):
+                    found.append(target)
+            return found
+
+        self.write_chunks("ds1", [chunk("birds", "parrots repeat what they hear")])
+        embeddings_helpers.store_grounding_embeddings("ds1", backend="hashing", index="flat")
+        held = store.reader("ds1")  # as a serving MemoryManager holds it
+        query = embedding_backends.get_backend("hashing").embed(["parrots"])
+        time.sleep(0.01)  # a distinct index.json mtime
+        store.rebuild_flat_index("ds1")
+        self.assertIsNot(store.reader("ds1"), held)
+        # still answering from the snapshot it mapped
+        self.assertEqual(held.query(query, n_results=1)["documents"], [["parrots repeat what they hear"]])
+        del held
+        for i in range(3):
+            time.sleep(0.01)
+            store.rebuild_flat_index("ds1")
+            store.reader("ds1")
+        self.assertEqual(deleted_snapshot_files(), [])
+
+
+class TestServeTurn(TempCwdTestCase):
+    def test_a_turn_embeds_and_queries_once(self):
+        from raft import serve
+        from raft.memories import MemoryManager
+
+        self.write_chunks("ds1", [chunk("birds", "parrots repeat"), chunk("food", "pasta water")])
+        embeddings_helpers.store_grounding_embeddings("ds1")
+        manager = MemoryManager("ds1", {})
+        reply = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="hi"))])
+        manager.aio._openai_client = mock.Mock()
+        manager.aio._openai_client.chat.completions.create = mock.AsyncMock(return_value=reply)
+        calls = len(self.client.calls)
+        with (
+            mock.patch.object(embeddings_helpers, "EMBEDDING_CACHE_MB", 0),
+            mock.patch.object(manager.reader, "query", wraps=manager.reader.query) as query,
+            mock.patch("raft.memories.AsyncPromptManager", autospec=True) as prompts,
+        ):
+            prompts.return_value.summarize_memories.return_value = ["a memory", "skip"]
+            answer = serve.answer_turn(manager, "ds1", "what about parrots?", "ft:x")
+
+        self.assertEqual(answer, "hi")
+        self.assertEqual(self.client.calls[calls:], [["what about parrots?"]])
+        self.assertEqual(query.call_count, 1)
+        self.assertEqual(prompts.return_value.summarize_memories.call_count, 1)
+        messages = manager.aio._openai_client.chat.completions.create.call_args.kwargs["messages"]
+        self.assertIn("parrots repeat", messages[1]["content"])
+        self.assertIn("a memory", messages[2]["content"])
+
+
+class TestSummaryCache(TempCwdTestCase):
+    def test_workers_starting_at_once_share_one_cache(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        from raft import memories
+
+        def slow_cache(*args):
+            time.sleep(0.05)  # every worker gets here before the first is done
+            return SqliteLRUCache(*args)
+
+        start = threading.Barrier(8)
+
+        def first_use(_):
+            start.wait()
+            return memories.summary_cache()
+
+        with (
+            mock.patch.dict(memories._summary_caches, clear=True),
+            mock.patch.object(memories, "SqliteLRUCache", side_effect=slow_cache) as made,
+            ThreadPoolExecutor(8) as pool,
+        ):
+            got = list(pool.map(first_use, range(8)))
+        self.assertEqual(made.call_count, 1)
+        self.assertEqual(len({id(cache) for cache in got}), 1)
+
+    def test_summaries_and_skips_are_asked_once(self):
+        from raft import memories
+
+        manager = memories.MemoryManager("ds1", {})
+        verdicts = {"parrots repeat": "They mimic sounds.", "pasta water": "skip"}
+        with mock.patch("raft.memories.AsyncPromptManager", autospec=True) as prompts:
+            summarize = prompts.return_value.summarize_memory
+            summarize.side_effect = lambda document, *args, **kwargs: verdicts[document]
+            for _ in range(2):
+                got = [
+                    manager.summarize_memory({"date": "d", "document": doc}, "parrots?", "")
+                    for doc in verdicts
+                ]
+                self.assertEqual([g["memory"] for g in got], ["They mimic sounds.", ""])
+            self.assertEqual(summarize.call_count, 2)
+
+            # another question, previous answer or prompt version is asked anew
+            manager.summarize_memory({"date": "d", "document": "pasta water"}, "pasta?", "")
+            manager.summarize_memory({"date": "d", "document": "pasta water"}, "parrots?", "yes")
+            with mock.patch.object(memories, "SUMMARY_PROMPT_VERSION", 2):
+                manager.summarize_memory({"date": "d", "document": "pasta water"}, "parrots?", "")
+            self.assertEqual(summarize.call_count, 5)
+
+        # persisted: a new process (here, a new cache handle) still has them
+        memories._summary_caches.clear()
+        self.assertEqual(len(memories.summary_cache()), 5)
+
+
+class TestBatchedSummaries(TempCwdTestCase):
+    SIMILAR = [
+        {"date": "2024-01-01", "document": "parrots repeat"},
+        {"date": "2024-01-02", "document": "pasta water"},
+        {"date": "2024-01-03", "document": "parrots fly"},
+    ]
+
+    def test_replies_map_back_to_the_memories(self):
+        from raft.prompt_manager import parse_memory_verdicts
+
+        reply = """```json
+        [{"memory": 2, "helpful": false, "summary": ""},
+         {"memory": 1, "helpful": true, "summary": "They mimic."},
+         {"memory": 3, "helpful": true, "summary": " "}]
+        ```"""
+        self.assertEqual(parse_memory_verdicts(reply, 3), ["They mimic.", "skip", "skip"])
+        for bad in ("I cannot help", '[{"memory": 1, "helpful": true, "summary": "x"}]', "[1, 2]"):
+            with self.assertRaises(ValueError):
+                parse_memory_verdicts(bad, 2)
+        # memory indices the reply cannot be mapped back by
+        for memory in ("null", "[1]", "0", "3", "-1", '"1"', "true", "1.5"):
+            bad = f'[{{"memory": {memory}, "helpful": false}}, {{"memory": 1}}, {{"memory": 2}}]'
+            with self.assertRaises(ValueError):
+                parse_memory_verdicts(bad, 2)
+
+    def test_sync_prompt_manager_waits_for_the_async_one(self):
+        from raft import aio
+        from raft.prompt_manager import PromptManager
+
+        replies = ["  They mimic. ", '[{"memory": 1, "helpful": true, "summary": "x"}, {"memory": 2}]']
+        client = mock.Mock()
+        client.chat.completions.create = mock.AsyncMock(side_effect=[
+            SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=reply))])
+            for reply in replies
+        ])
+        with mock.patch.object(aio, "client", return_value=client):
+            prompts = PromptManager()
+            self.assertEqual(prompts.summarize_memory("parrots repeat", "parrots?", "", "A"), "They mimic.")
+            self.assertEqual(prompts.summarize_memories(["a", "b"], "parrots?", "", "A"), ["x", "skip"])
+        self.assertEqual(client.chat.completions.create.await_count, 2)
+
+    def test_one_request_per_exchange_and_cached(self):
+        from raft.memories import MemoryManager
+
+        manager = MemoryManager("ds1", {})
+        with mock.patch("raft.memories.AsyncPromptManager", autospec=True) as prompts:
+            batch = prompts.return_value.summarize_memories
+            batch.return_value = ["They mimic.", "skip", "They fly."]
+            got = manager.summarize_helpful_memories("parrots?", self.SIMILAR, "")
+            self.assertEqual(got, [
+                {"date": "2024-01-01", "memory": "They mimic."},
+                {"date": "2024-01-02", "memory": ""},
+                {"date": "2024-01-03", "memory": "They fly."},
+            ])
+            # the shared prompt once, every memory in it
+            self.assertEqual(batch.call_args.args[:3], (
+                ["parrots repeat", "pasta water", "parrots fly"], "parrots?", ""
+            ))
+
+            # only what the cache lacks is asked, still in one request
+            batch.return_value = ["They sing."]
+            more = self.SIMILAR[1:] + [{"date": "2024-01-04", "document": "parrots sing"}]
+            got = manager.summarize_helpful_memories("parrots?", more, "")
+            self.assertEqual([m["memory"] for m in got], ["", "They fly.", "They sing."])
+            self.assertEqual(batch.call_args.args[0], ["parrots sing"])
+            self.assertEqual(batch.call_count, 2)
+            prompts.return_value.summarize_memory.assert_not_called()
+
+    def test_unusable_replies_fall_back_to_one_request_each(self):
+        from raft.memories import MemoryManager
+
+        manager = MemoryManager("ds1", {})
+        with mock.patch("raft.memories.AsyncPromptManager", autospec=True) as prompts:
+            prompts.return_value.summarize_memories.side_effect = ValueError("no JSON array")
+            prompts.return_value.summarize_memory.return_value = "Still useful."
+            got = manager.summarize_helpful_memories("parrots?", self.SIMILAR, "")
+        self.assertEqual([m["memory"] for m in got], ["Still useful."] * 3)
+        self.assertEqual(prompts.return_value.summarize_memory.call_count, 3)
+
+
+class TestAsyncMemoryManager(TempCwdTestCase):
+    def test_many_questions_in_flight_and_bounded(self):
+        from raft import aio
+        from raft.memories import AsyncMemoryManager
+
+        self.write_chunks("ds1", [chunk("birds", "parrots repeat"), chunk("food", "pasta water")])
+        embeddings_helpers.store_grounding_embeddings("ds1")
+        manager = AsyncMemoryManager("ds1", {}, concurrency=3)
+        running, peak = [0], [0]
+
+        async def answer(model, messages):
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            await asyncio.sleep(0.3)  # well over a retrieval
+            running[0] -= 1
+            content = messages[-1]["content"].upper()
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+        manager._openai_client = mock.Mock()
+        manager._openai_client.chat.completions.create = mock.AsyncMock(side_effect=answer)
+        questions = [f"question {i}?" for i in range(10)]
+        with mock.patch("raft.memories.AsyncPromptManager", autospec=True) as prompts:
+            prompts.return_value.summarize_memories.return_value = ["a memory", "skip"]
+            answers = aio.run(manager.answer_questions(questions, model="ft:x"))
+        self.assertEqual(answers, [q.upper() for q in questions])
+        self.assertEqual(peak[0], 3)
+
+    def test_one_loop_and_client_for_every_caller(self):
+        from raft import aio
+
+        async def current():
+            return asyncio.get_running_loop(), aio.client()
+
+        with mock.patch.dict(os.environ, {"OPENAI_API_KEY": "sk-test"}):
+            first = aio.run(current())
+            from_thread = []
+            thread = threading.Thread(target=lambda: from_thread.append(aio.run(current())))
+            thread.start()
+            thread.join()
+        self.assertEqual(from_thread, [first])
+        self.assertIs(first[0], aio.loop())
+
+        async def nested():
+            return aio.run(current())
+
+        with self.assertRaises(RuntimeError):
+            aio.run(nested())
+
+    def test_clients_of_closed_loops_are_dropped(self):
+        from raft import aio
+
+        async def current():
+            return aio.client()
+
+        with mock.patch.dict(os.environ, {"OPENAI_API_KEY": "sk-test"}):
+            shared = aio.run(current())
+            for _ in range(5):
+                self.assertIsNot(asyncio.run(current()), shared)
+            loops = list(aio._clients)
+        self.assertLessEqual(len(loops), 2)  # the background loop's, and at most the last closed one's
+        self.assertIn(aio.loop(), loops)
+        self.assertIs(aio.run(current()), shared)
+
+    def test_async_retries_and_limit(self):
+        import httpx
+        import openai
+
+        attempts = [0]
+
+        async def flaky():
+            attempts[0] += 1
+            if attempts[0] < 3:
+                response = httpx.Response(429, request=httpx.Request("POST", "http://x/v1/chat"))
+                raise openai.RateLimitError("slow down", response=response, body=None)
+            return "done"
+
+        limiter = ratelimit.AsyncAdaptiveConcurrency(minimum=1, maximum=8, initial=4)
+        got = asyncio.run(ratelimit.call_with_retries_async(limiter.call_async, flaky, base_delay=0))
+        self.assertEqual((got, attempts[0]), ("done", 3))
+        self.assertEqual(limiter.limit, 2.0)  # two throttled calls, one decrease per latency
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_sync_and_asyncio_run_callers_mix(self):
+        from raft import aio, memories
+        from raft.memories import MemoryManager
+
+        self.write_chunks("ds1", [chunk("birds", "parrots repeat"), chunk("food", "pasta water")])
+        embeddings_helpers.store_grounding_embeddings("ds1")
+        manager = MemoryManager("ds1", {})
+        similar = [{"document": f"memory {i}", "date": "2024-01-01"} for i in range(12)]
+        exchanges = [["parrots?", "yes"], ["pasta?", "no"]]
+
+        async def summarize(document, question, prev_answer, **kwargs):
+            await asyncio.sleep(0.01)
+            return document
+
+        with (
+            mock.patch("raft.memories.AsyncPromptManager", autospec=True) as prompts,
+            mock.patch.object(memories, "SUMMARY_CACHE_MB", 0),
+        ):
+            prompts.return_value.summarize_memory.side_effect = summarize
+            prompts.return_value.summarize_memories.side_effect = lambda memories, *a, **k: ["skip"] * len(memories)
+            # more summaries than slots: waiters on the aio loop's limiter
+            synced = manager.summarize_helpful_memories("q?", similar, "", batched=False)
+            manager.summarize_exchanges(exchanges)
+            # then the same manager on loops of the caller's own
+            ran = asyncio.run(manager.aio.summarize_helpful_memories("q?", similar, "", batched=False))
+            asyncio.run(manager.aio.summarize_exchanges(exchanges))
+            manager.summarize_exchanges(exchanges)
+        self.assertEqual([m["memory"] for m in ran], [m["memory"] for m in synced])
+        self.assertEqual(len(synced), 12)
+
+        async def limiter():
+            return memories.summary_limiter()
+
+        self.assertIs(aio.run(limiter()), memories.summary_limiter())  # shared by synchronous callers
+        self.assertIsNot(asyncio.run(limiter()), memories.summary_limiter())
+
+
+class TestBatchedRetrieval(TempCwdTestCase):
+    def test_a_transcript_embeds_and_queries_once(self):
+        from raft import generate_finetune
+
+        self.write_chunks("ds1", [chunk("birds", "parrots repeat"), chunk("food", "pasta water")])
+        embeddings_helpers.store_grounding_embeddings("ds1")
+        questions = ["do parrots talk?", "what about pasta?", "and salt?"]
+        with open("data/ds1_transcript_1.json", "w") as f:
+            json.dump({"participants": {"q": "Q", "a": "A"}, "date": "2024-02-01", "url": "https://x/talk",
+                       "exchanges": [[q, "yes"] for q in questions]}, f)
+        self.client.calls.clear()
+        collection = store.collection("ds1")
+        with (
+            mock.patch.object(collection, "query", wraps=collection.query) as query,
+            mock.patch("raft.memories.AsyncPromptManager", autospec=True) as prompts,
+        ):
+            prompts.return_value.summarize_memories.side_effect = lambda memories, *a, **k: ["skip"] * len(memories)
+            generate_finetune.generate_finetune("ds1")
+        self.assertEqual(self.client.calls, [questions])
+        query.assert_called_once()
+        self.assertEqual(len(query.call_args.kwargs["query_embeddings"]), 3)
+        self.assertEqual(collection.count(), 5)  # and stores the questions
+
+    def test_query_many_matches_one_query_per_question(self):
+        from raft.memories import MemoryManager
+
+        self.write_chunks("ds1", [chunk("birds", "parrots repeat"), chunk("food", "pasta water"),
+                                  chunk("salt", "salt the water well")])
+        embeddings_helpers.store_grounding_embeddings("ds1")
+        manager = MemoryManager("ds1", {})
+        exchanges = [["parrots?", ""], ["pasta water?", ""], ["salt?", ""]]
+        batched = manager.query_many(exchanges, store=False)
+        for exchange, results in zip(exchanges, batched):
+            single = manager.query_memories(exchange, store=False)
+            self.assertEqual(results["ids"], single["ids"])
+            self.assertEqual(results["documents"], single["documents"])
+            self.assertEqual(results["distances"], single["distances"])
+
+
+class TestSimilarityGate(TempCwdTestCase):
+    # fake embeddings are [len(text), 1, 0]: distance is the squared
+    # difference in length
+    QUESTION = "what about parrots?"
+
+    def embed(self, index=""):
+        self.write_chunks("ds1", [
+            chunk("birds", "parrots repeat"),
+            chunk("food", "pasta water, salted like the sea, then a little more"),
+            chunk("city", "rome was not built in a day, nor in a week or in a month either"),
+        ])
+        embeddings_helpers.store_grounding_embeddings("ds1", index=index)
+
+    def test_distant_extracts_are_not_summarized(self):
+        from raft.memories import MemoryManager
+
+        self.embed()
+        state.update_meta("ds1", max_distance=100)
+        manager = MemoryManager("ds1", {})
+        similar = manager.get_similar_extracts([self.QUESTION, ""], store=False)
+        self.assertEqual([m["distance"] for m in similar], [25.0, 1089.0, 1936.0])
+        with mock.patch("raft.memories.AsyncPromptManager", autospec=True) as prompts:
+            prompts.return_value.summarize_memory.return_value = "They mimic."
+            memories = manager.get_similar_and_summarize([self.QUESTION, ""], "", similar=similar)
+        self.assertIn("They mimic.", memories)
+        summarized = prompts.return_value.summarize_memory.call_args_list
+        self.assertEqual([c.args[0] for c in summarized], ["parrots repeat"])
+        self.assertEqual(manager.gated, 2)
+
+        # nothing close enough: the summarizer is not called at all
+        state.update_meta("ds1", max_distance=1)
+        manager = MemoryManager("ds1", {})
+        with mock.patch("raft.memories.AsyncPromptManager", autospec=True) as prompts:
+            self.assertEqual(manager.get_similar_and_summarize([self.QUESTION, ""], "", similar=similar), "")
+        self.assertFalse(prompts.called)
+
+    def write_transcript(self, questions):
+        with open("data/ds1_transcript_1.json", "w") as f:
+            json.dump({"exchanges": [[q, "an answer"] for q in questions]}, f)
+
+    def test_auto_gate_is_calibrated_on_questions_once(self):
+        from raft import memories
+
+        self.embed(index="flat")
+        state.update_meta("ds1", max_distance="auto")
+        collection, reader = store.collection("ds1"), store.reader("ds1")
+        # no interview questions yet: nothing to calibrate on, no gate
+        self.assertEqual(memories.gate_distance("ds1", reader), float("inf"))
+        self.assertNotIn("max_distance_calibration", state.load_meta("ds1"))
+
+        # lengths 19, 10 and 12 against chunks of 14, 52 and 63
+        self.write_transcript([self.QUESTION, "and pasta?", "is rome old?"])
+        embeddings = embeddings_helpers.get_embeddings(
+            memories.calibration_questions("ds1"), embeddings_helpers.backend_for("ds1")
+        )
+        self.assertEqual(memories.calibrate_max_distance(collection, embeddings), 1936.0)
+        self.assertEqual(memories.calibrate_max_distance(reader, embeddings), 1936.0)
+        distance = memories.gate_distance("ds1", reader)
+        self.assertEqual(distance, 1936.0)
+        self.assertEqual(state.load_meta("ds1")["max_distance_calibration"]["questions"], 3)
+        with mock.patch.object(memories, "calibrate_max_distance") as calibrate:
+            self.assertEqual(memories.gate_distance("ds1", reader), distance)
+            self.assertFalse(calibrate.called)
+            state.add_test_question("ds1", "a fourth question")
+            calibrate.return_value = 5.0
+            self.assertEqual(memories.gate_distance("ds1", reader), 5.0)
+            state.update_meta("ds1", max_distance=0)
+            self.assertEqual(memories.gate_distance("ds1", reader), float("inf"))
+
+    def test_a_question_keeps_its_nearest_extract_under_the_auto_gate(self):
+        from raft.memories import MemoryManager
+
+        self.embed()
+        self.write_transcript([self.QUESTION, "and pasta?", "is rome old?"])
+        question = "why " * 30  # 120 characters: 3249 from the nearest chunk
+        for setting, kept in ((0, 3), ("auto", 1)):
+            state.update_meta("ds1", max_distance=setting)
+            manager = MemoryManager("ds1", {})
+            with (
+                mock.patch("raft.memories.AsyncPromptManager", autospec=True) as prompts,
+                mock.patch("raft.memories.SUMMARY_BATCHED", False),
+                mock.patch("raft.memories.SUMMARY_CACHE_MB", 0),
+            ):
+                prompts.return_value.summarize_memory.return_value = "Rome."
+                memories = manager.get_similar_and_summarize([question, ""], "", store=False)
+            self.assertIn("Rome.", memories)
+            summarized = [c.args[0] for c in prompts.return_value.summarize_memory.call_args_list]
+            self.assertEqual(len(summarized), kept)
+            self.assertIn("rome was not built in a day, nor in a week or in a month either", summarized)
+            self.assertEqual(manager.gated, 3 - kept)
+
+    def test_preview_shows_distances(self):
+        from raft import serve
+        from raft.memories import preview_context
+
+        self.embed()
+        rows = preview_context("ds1", self.QUESTION)
+        self.assertEqual([row["distance"] for row in rows], [25.0, 1089.0, 1936.0])
+        with mock.patch.object(serve.hx, "say") as say:
+            serve.show_context("ds1", self.QUESTION, max_distance=100)
+        lines = [c.args[0] for c in say.call_args_list]
+        self.assertIn("[25]", lines[1])
+        self.assertIn("not summarized", lines[2])
+
+    def test_cli_setting(self):
+        from raft import cli
+
+        self.assertEqual(cli.max_distance("auto"), "auto")
+        self.assertEqual(cli.max_distance("off"), 0.0)
+        self.assertEqual(cli.max_distance("0.35"), 0.35)
+        for bad in ("-1", "near", "nan"):
+            with self.assertRaises(Exception):
+                cli.max_distance(bad)
+
+
+class TestStreamingEmbed(TempCwdTestCase):
+    def test_streamed_embed_matches_chunk_then_embed(self):
+        from raft import files_helper
+
+        self.write_corpus("ds1", posts=12, lines=40)
+        counts = embeddings_helpers.chunk_and_embed("ds1", backend="hashing")
+        with open("data/ds1_chunked.jsonl") as f:
+            streamed = f.read()
+        self.assertFalse(os.path.exists("data/ds1_chunked.jsonl.partial"))
+
+        files_helper.chunker("ds1")
+        with open("data/ds1_chunked.jsonl") as f:
+            self.assertEqual(f.read(), streamed)
+        self.assertEqual(counts["added"], len(streamed.splitlines()))
+        self.assertGreater(counts["added"], 12)  # long posts split
+        again = embeddings_helpers.store_grounding_embeddings("ds1")
+        self.assertEqual(again, {"added": 0, "unchanged": counts["added"], "removed": 0})
+
+    def test_prefetch_is_bounded_and_stops_with_its_consumer(self):
+        produced = []
+        closed = threading.Event()
+
+        def source():
+            try:
+                for i in range(1000):
+                    produced.append(i)
+                    yield i
+            finally:
+                closed.set()
+
+        stream = embeddings_helpers.prefetch(source(), maxsize=4)
+        self.assertEqual(next(stream), 0)
+        time.sleep(0.05)
+        self.assertLessEqual(len(produced), 1 + 4 + 1)
+        stream.close()
+        self.assertTrue(closed.wait(1))
+        self.assertLess(len(produced), 1000)
+
+    def test_chunker_errors_reach_the_embedder(self):
+        self.write_corpus("ds1", posts=3)
+        with open("data/ds1.jsonl", "a") as f:
+            f.write("{not json\n")
+        with self.assertRaisesRegex(ValueError, "line 4"):
+            embeddings_helpers.chunk_and_embed("ds1", backend="hashing")
+        # nothing half-written replaces the chunk file
+        self.assertFalse(os.path.exists("data/ds1_chunked.jsonl"))
+        self.assertFalse(os.path.exists("data/ds1_chunked.jsonl.partial"))
+
+
+class TestChunker(TempCwdTestCase):
+    def test_both_entry_points_write_the_same_chunks(self):
+        from raft import chunker, files_helper
+
+        self.write_corpus("ds1", posts=10, lines=50)
+        with open("data/ds1.jsonl", "a") as f:
+            f.write(json.dumps({
+                "title": "special", "link": "https://x/s", "date": "2024-02-01",
+                "content": "ends with <|endoftext|> mid-text\n" + "w " * 5000,
+            }) + "\n")
+        chunker.chunker("ds1")
+        with open("data/ds1_chunked.jsonl") as f:
+            direct = f.read()
+        # the same corpus, chunked from scratch by `raft chunk`'s entry
+        # point, in worker processes
+        os.makedirs("fresh/data")
+        shutil.copy("data/ds1.jsonl", "fresh/data/ds1.jsonl")
+        os.chdir("fresh")
+        files_helper.chunker("ds1", workers=2)
+        with open("data/ds1_chunked.jsonl") as f:
+            self.assertEqual(f.read(), direct)
+        self.assertEqual(state.load_meta("ds1")["chunk_watermark"]["lines"], 11)
+        os.chdir(self.tmp)
+
+        chunks = [json.loads(line) for line in direct.splitlines()]
+        by_post: dict = {}
+        for metadata, _ in chunks:
+            by_post.setdefault(metadata["url"], []).append(metadata)
+        self.assertEqual(len(by_post), 11)
+        for parts in by_post.values():
+            self.assertEqual([m["part"] for m in parts], [str(i) for i in range(1, len(parts) + 1)])
+            self.assertTrue(all(m["total_parts"] == str(len(parts)) for m in parts))
+        self.assertGreater(len(by_post["https://x/s"]), 1)  # the overlong line split off
+
+    def test_threaded_tokenizing_matches_inline(self):
+        from raft import chunker
+
+        self.write_corpus("ds1", posts=4, lines=80)
+        posts = list(chunker.read_posts("data/ds1.jsonl"))
+        inline = list(chunker.split_into_chunks(posts))
+        with mock.patch.multiple(chunker, TOKENIZER_THREADS=3, PARALLEL_MIN_CHARS=100, _pool=None):
+            threaded = list(chunker.split_into_chunks(posts))
+            self.assertIsNotNone(chunker._pool)
+            chunker._pool.shutdown()
+        self.assertEqual(threaded, inline)
+
+    def test_worker_processes_write_the_same_file(self):
+        from raft import chunker
+
+        self.write_corpus("ds1", posts=40, lines=30)
+        chunker.chunker("ds1")
+        with open("data/ds1_chunked.jsonl", "rb") as f:
+            single = f.read()
+        # small batches: many in flight, completing out of order
+        with mock.patch.object(chunker, "CHUNK_BATCH_BYTES", 4096):
+            chunker.chunker("ds1", workers=3)
+        with open("data/ds1_chunked.jsonl", "rb") as f:
+            self.assertEqual(f.read(), single)
+
+        with open("data/ds1.jsonl", "a") as f:
+            f.write("{not json\n")
+        with mock.patch.object(chunker, "CHUNK_BATCH_BYTES", 4096):
+            with self.assertRaisesRegex(ValueError, "line 41"):
+                list(chunker.stream_chunks("ds1", workers=3))
+
+    def test_posts_are_chunked_as_they_are_read(self):
+        from raft import chunker
+
+        def posts():
+            yield {"title": "a", "link": "a", "date": "2024-01-01", "content": "one"}
+            raise AssertionError("read ahead of the consumer")
+
+        first = next(chunker.split_into_chunks(posts()))
+        self.assertEqual(first[1], "one")
+
+
+class TestChunkSettings(TempCwdTestCase):
+    def test_long_lines_are_cut_at_token_boundaries(self):
+        from raft import chunker
+
+        line = " ".join(f"w{i} 🙂" for i in range(3000))  # multi-byte tokens
+        post = {"title": "t", "link": "l", "date": "2024-01-01", "content": f"intro\n{line}\noutro"}
+        chunks = list(chunker.split_post(post, chunk_tokens=500))
+        texts = [document for _, document in chunks]
+        for text in texts:
+            self.assertLessEqual(len(chunker.encoding.encode_ordinary(text)), 500)
+            self.assertNotIn("\ufffd", text)
+        # nothing dropped (the pieces of the cut line are lines of their own)
+        self.assertEqual("".join(texts).replace("\n", ""), post["content"].replace("\n", ""))
+        self.assertEqual({m["total_parts"] for m, _ in chunks}, {str(len(chunks))})
+
+    def test_overlap_repeats_the_previous_lines(self):
+        from raft import chunker
+
+        lines = [f"line {i} " + "word " * 30 for i in range(40)]
+        post = {"title": "t", "link": "l", "date": "2024-01-01", "content": "\n".join(lines)}
+        chunks = [d.split("\n") for _, d in chunker.split_post(post, 200, overlap_tokens=70)]
+        for before, after in zip(chunks, chunks[1:]):
+            self.assertEqual(after[:2], before[-2:])  # ~32 tokens a line
+        self.assertLessEqual(
+            max(len(chunker.encoding.encode_ordinary("\n".join(c))) for c in chunks), 200
+        )
+
+    def test_size_is_capped_at_the_embedding_model(self):
+        from raft import chunker
+
+        chunker._warn_capped.cache_clear()
+        with mock.patch.object(chunker.hx, "warn") as warn:
+            chunker.configure("ds1", chunk_tokens=20000, overlap_tokens=100)
+            for _ in range(3):
+                self.assertEqual(chunker.chunk_settings("ds1"), {"chunk_tokens": 8191, "overlap_tokens": 100})
+        warn.assert_called_once()  # not on every read of the settings
+        with self.assertRaises(ValueError):
+            chunker.configure("ds1", overlap_tokens=9000)
+
+    def test_embed_rechunks_when_settings_changed(self):
+        from raft import chunker
+
+        self.write_corpus("ds1", posts=5, lines=60)
+        chunker.chunker("ds1")
+        self.assertFalse(chunker.chunks_stale("ds1"))
+        first = embeddings_helpers.store_grounding_embeddings("ds1", backend="hashing")
+
+        chunker.configure("ds1", chunk_tokens=256, overlap_tokens=32)
+        self.assertTrue(chunker.chunks_stale("ds1"))
+        again = embeddings_helpers.store_grounding_embeddings("ds1")
+        self.assertFalse(chunker.chunks_stale("ds1"))
+        self.assertEqual(state.load_meta("ds1")["chunked_with"]["chunk_tokens"], 256)
+        self.assertEqual(again["removed"] + again["unchanged"], first["added"])
+        self.assertGreater(again["added"], again["removed"])
+
+
+
+class TestIncrementalChunking(TempCwdTestCase):
+    def posts(self, start: int, count: int) -> list:
+        return [
+            {"title": f"post {i}", "link": f"https://x/{i}", "date": "2024-01-01",
+             "content": "\n".join(f"post {i} line {j} " + "word " * 300 for j in range(12))}
+            for i in range(start, start + count)
+        ]
+
+    def chunked(self) -> str:
+        with open("data/ds1_chunked.jsonl") as f:
+            return f.read()
+
+    def full_rebuild(self) -> str:
+        from raft import chunker
+
+        chunker.chunker("ds1", rebuild=True)
+        return self.chunked()
+
+    def test_appended_posts_are_chunked_alone(self):
+        from raft import chunker, sources
+
+        sources.append_corpus_records("ds1", self.posts(0, 4))
+        chunker.chunker("ds1")
+        sources.append_corpus_records("ds1", self.posts(4, 3))
+        self.assertTrue(chunker.chunks_stale("ds1"))
+
+        split = chunker._split_lines
+        with mock.patch.object(chunker, "_split_lines", side_effect=split) as spy:
+            chunker.chunker("ds1")
+        self.assertEqual([c.args[1] for c in spy.call_args_list], [5])  # from line 5 on
+        self.assertFalse(chunker.chunks_stale("ds1"))
+        appended = self.chunked()
+        self.assertEqual(appended, self.full_rebuild())
+        # the stream embedding reads is still the whole dataset's
+        streamed = [json.dumps(list(c)) + "\n" for c in chunker.stream_chunks("ds1")]
+        self.assertEqual("".join(streamed), appended)
+
+    def test_rewritten_corpus_is_chunked_whole(self):
+        from raft import chunker, sources
+
+        sources.append_corpus_records("ds1", self.posts(0, 4))
+        chunker.chunker("ds1")
+        with open("data/ds1.jsonl") as f:
+            text = f.read()
+        with open("data/ds1.jsonl", "w") as f:  # same size, other content
+            f.write(text.replace("post 0 line", "post 9 line"))
+        chunker.chunker("ds1")
+        self.assertIn("post 9 line", self.chunked())
+        self.assertEqual(self.chunked(), self.full_rebuild())
+
+        with open("data/ds1.jsonl", "w") as f:  # shrunk
+            f.write(text[: text.index("\n") + 1])
+        chunker.chunker("ds1")
+        self.assertEqual(self.chunked().count("post 0 line 0"), 1)
+        self.assertNotIn("post 1 line", self.chunked())
+
+    def test_failed_append_leaves_the_chunks_as_they_were(self):
+        from raft import chunker, sources
+
+        sources.append_corpus_records("ds1", self.posts(0, 2))
+        chunker.chunker("ds1")
+        before, meta = self.chunked(), state.load_meta("ds1")
+        with open("data/ds1.jsonl", "a") as f:
+            f.write(json.dumps(self.posts(2, 1)[0]) + "\n{not json\n")
+        with self.assertRaises(ValueError):
+            list(chunker.stream_chunks("ds1"))
+        self.assertEqual(self.chunked(), before)
+        self.assertEqual(state.load_meta("ds1")["chunk_watermark"], meta["chunk_watermark"])
+
+    def test_embed_picks_up_appended_posts(self):
+        from raft import chunker, sources
+
+        sources.append_corpus_records("ds1", self.posts(0, 3))
+        chunker.chunker("ds1")
+        first = embeddings_helpers.store_grounding_embeddings("ds1", backend="hashing")
+        sources.append_corpus_records("ds1", self.posts(3, 2))
+        again = embeddings_helpers.store_grounding_embeddings("ds1")
+        self.assertEqual(again["unchanged"], first["added"])
+        self.assertEqual(again["removed"], 0)
+        self.assertGreater(again["added"], 0)
+
+    def test_growth_is_seen_without_a_watermark(self):
+        from raft import chunker
+
+        with open("data/ds1.jsonl", "w") as f:  # no trailing newline
+            f.write("\n".join(json.dumps(post) for post in self.posts(0, 2)))
+        chunker.chunker("ds1")
+        self.assertIsNone(state.load_meta("ds1")["chunk_watermark"])
+        self.assertFalse(chunker.chunks_stale("ds1"))
+        with open("data/ds1.jsonl", "a") as f:
+            f.write("\n" + json.dumps(self.posts(2, 1)[0]) + "\n")
+        self.assertTrue(chunker.chunks_stale("ds1"))
+        embeddings_helpers.store_grounding_embeddings("ds1", backend="hashing")
+        self.assertIn("post 2 line", self.chunked())
+
+
+
+class TestDedup(TempCwdTestCase):
+    PASSAGE = " ".join(f"sentence {i} of the passage everyone quotes." for i in range(60))
+
+    def test_signatures_estimate_similarity(self):
+        from raft import dedup
+
+        base = dedup.signature(self.PASSAGE)
+        edited = dedup.signature(self.PASSAGE.replace("sentence 30 ", "line 30 "))
+        other = dedup.signature(" ".join(f"unrelated words {i}" for i in range(200)))
+        self.assertGreater(dedup.similarity(base, edited), 0.85)
+        self.assertLess(dedup.similarity(base, other), 0.1)
+        self.assertTrue((dedup.signature(self.PASSAGE) == base).all())  # deterministic
+        with self.assertRaises(ValueError):
+            dedup.Deduplicator(1.5)
+
+    def test_copies_are_collapsed_into_the_first(self):
+        self.write_chunks("ds1", [
+            chunk("thread", self.PASSAGE),
+            chunk("other", "something else entirely, said once"),
+            chunk("repost", self.PASSAGE.replace("sentence 30 ", "line 30 ")),
+            chunk("rss", self.PASSAGE),
+        ])
+        counts = embeddings_helpers.store_grounding_embeddings(
+            "ds1", backend="hashing", dedup_threshold=0.8
+        )
+        self.assertEqual(counts, {"added": 2, "unchanged": 0, "removed": 0, "collapsed": 2})
+        found = store.collection("ds1").get(where={"url": "https://x/thread"})
+        self.assertEqual(
+            found["metadatas"][0]["sources"],
+            "https://x/thread\nhttps://x/repost\nhttps://x/rss",
+        )
+        again = embeddings_helpers.store_grounding_embeddings("ds1")
+        self.assertEqual(again, {"added": 0, "unchanged": 2, "removed": 0, "collapsed": 2})
+
+        # turned off: every copy is embedded, and no chunk claims others
+        off = embeddings_helpers.store_grounding_embeddings("ds1", dedup_threshold=0)
+        self.assertEqual(off, {"added": 2, "unchanged": 2, "removed": 0})
+        metadatas = store.collection("ds1").get()["metadatas"]
+        self.assertFalse(any("sources" in m for m in metadatas))
+
+
+
+class TestStartup(unittest.TestCase):
+    def loaded(self, code: str) -> set:
+        """The heavy modules a fresh interpreter holds after running code."""
+        src = os.path.join(os.path.dirname(__file__), "..", "src")
+        probe = code + "\nimport sys; print(sorted({'chromadb', 'openai', 'tiktoken'} & set(sys.modules)))"
+        with tempfile.TemporaryDirectory() as cwd:
+            done = subprocess.run(
+                [sys.executable, "-c", probe], cwd=cwd, input="\n", capture_output=True, text=True,
+                env=dict(os.environ, PYTHONPATH=os.path.abspath(src)),
+            )
+        self.assertEqual(done.returncode, 0, done.stderr)
+        return set(json.loads(done.stdout.strip().splitlines()[-1].replace("'", '"')))
+
+    def test_help_loads_nothing_heavy(self):
+        self.assertEqual(self.loaded("import raft.cli"), set())
+
+    def test_tokenizers_load_on_first_use(self):
+        self.assertNotIn("tiktoken", self.loaded("from raft import chunker, oai_finetune, memories"))
+        from raft import chunker, oai_finetune, tokenizers
+
+        self.assertIs(chunker.encoding, tokenizers.encoding_for_model("gpt-4-turbo"))
+        self.assertEqual(oai_finetune.count_tokens("hello world"), 4)  # '"hello world"'
+
+
+if __name__ == "__main__":
+    unittest.main()